@@ -0,0 +1,151 @@
+import asyncio
+import math
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aiolimiter import AsyncLimiter
+from dotenv import load_dotenv
+
+from app.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS
+
+# Load environment variables
+load_dotenv()
+
+# Limits of the calls to the OpenAI API: maximum concurrent calls, maximum calls per
+# second (unlimited when 0), calls allowed to wait for a slot, and seconds they wait
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "0"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "100"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+# The same limits for the queries to the vector stores
+VECTOR_STORE_MAX_CONCURRENCY = int(os.getenv("VECTOR_STORE_MAX_CONCURRENCY", "64"))
+VECTOR_STORE_RATE_LIMIT = float(os.getenv("VECTOR_STORE_RATE_LIMIT", "0"))
+VECTOR_STORE_QUEUE_SIZE = int(os.getenv("VECTOR_STORE_QUEUE_SIZE", "200"))
+VECTOR_STORE_QUEUE_TIMEOUT = float(os.getenv("VECTOR_STORE_QUEUE_TIMEOUT", "5"))
+
+
+class OverloadedError(Exception):
+    """Raised when a call is rejected because its upstream service is at capacity."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(
+            f"The {name} service is busy, please try again in {retry_after} seconds"
+        )
+        self.name = name
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limit the concurrency and rate of the calls to an upstream service.
+
+    Calls wait in a bounded queue for one of max_concurrency slots and, with a rate
+    limit, for the token bucket to allow them. A call is rejected with an
+    OverloadedError when the queue is full, or when it has waited queue_timeout
+    seconds, so bursts beyond the service's capacity fail fast instead of piling up
+    into timeouts and rate-limit retries.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        rate_limit: float = 0,
+        queue_size: int = 100,
+        queue_timeout: Optional[float] = 10,
+    ):
+        """
+        :param name: The name of the service, which labels its metrics
+        :param max_concurrency: Maximum number of concurrent calls
+        :param rate_limit: Maximum number of calls per second, unlimited when 0
+        :param queue_size: Maximum number of calls waiting to be admitted
+        :param queue_timeout: Seconds a call waits to be admitted, if limited
+        """
+        self.name = name
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # A bucket of one second's calls, so bursts up to the rate are allowed
+        self._limiter = (
+            AsyncLimiter(max(rate_limit, 1), max(rate_limit, 1) / rate_limit)
+            if rate_limit > 0
+            else None
+        )
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait before retrying."""
+        return max(1, math.ceil(self.queue_timeout or 1))
+
+    def _reject(self, reason: str) -> None:
+        ADMISSION_REJECTIONS.inc(name=self.name, reason=reason)
+        raise OverloadedError(self.name, self.retry_after)
+
+    async def _acquire(self) -> None:
+        await self._semaphore.acquire()
+        try:
+            if self._limiter is not None:
+                await self._limiter.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def _has_capacity(self) -> bool:
+        return (
+            not self.waiting
+            and not self._semaphore.locked()
+            and (self._limiter is None or self._limiter.has_capacity())
+        )
+
+    async def _wait(self) -> None:
+        if self.waiting >= self.queue_size:
+            self._reject("queue_full")
+
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.set(self.waiting, name=self.name)
+        try:
+            await asyncio.wait_for(self._acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timeout")
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.set(self.waiting, name=self.name)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        Wait for a slot for a call, which is held until the context exits.
+
+        :raises OverloadedError: If the call was rejected
+        """
+        if self._has_capacity():
+            # Admitted right away, without queueing
+            await self._acquire()
+        else:
+            await self._wait()
+
+        ADMISSION_IN_FLIGHT.inc(name=self.name)
+        try:
+            yield
+        finally:
+            ADMISSION_IN_FLIGHT.dec(name=self.name)
+            self._semaphore.release()
+
+
+def create_llm_admission() -> AdmissionController:
+    return AdmissionController(
+        "llm", LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT
+    )
+
+
+def create_vector_store_admission() -> AdmissionController:
+    return AdmissionController(
+        "vector_store",
+        VECTOR_STORE_MAX_CONCURRENCY,
+        VECTOR_STORE_RATE_LIMIT,
+        VECTOR_STORE_QUEUE_SIZE,
+        VECTOR_STORE_QUEUE_TIMEOUT,
+    )
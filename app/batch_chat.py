@@ -0,0 +1,270 @@
+"""
+Answer many independent questions at once, for offline evaluation or to warm caches.
+
+Questions are read as NDJSON, one {"message": ..., "id": ...} object per line. The
+context of each batch of questions is retrieved with a single call to each vector
+store, the LLM is called for several questions at a time, and the answers are
+written as NDJSON as they finish, with their timings:
+
+    python -m app.batch_chat questions.ndjson --output answers.ndjson
+"""
+
+import argparse
+import asyncio
+import codecs
+import logging
+import os
+import sys
+import time
+from typing import AsyncIterable, AsyncIterator, List, Optional, Set
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field, ValidationError
+
+from app.chat_gpt_client import get_chat_response_with_history, select_route
+from app.context_builder import PreparedPrompt
+from app.models import RagCitation
+from app.rag_service import RAGService
+
+# Load environment variables
+load_dotenv()
+
+# Number of questions whose context is retrieved with one call to each vector store
+BATCH_CHAT_SIZE = int(os.getenv("BATCH_CHAT_SIZE", "32"))
+# Maximum number of LLM calls a batch run makes at once
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "8"))
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQuestion(BaseModel):
+    message: str
+    # Returned with the answer, to match it to the question
+    id: Optional[str] = None
+
+
+class BatchTimings(BaseModel):
+    # Retrieval and prompt assembly of the question's whole batch
+    retrieval_ms: float = 0.0
+    llm_ms: float = 0.0
+    # From the start of the batch's retrieval to the answer
+    total_ms: float = 0.0
+
+
+class BatchAnswer(BaseModel):
+    # Line number of the question, from 0, as answers arrive out of order
+    index: int
+    id: Optional[str] = None
+    message: Optional[str] = None
+    response: Optional[str] = None
+    # The model route of the question, if model routing is enabled
+    route: Optional[str] = None
+    citations: List[RagCitation] = []
+    error: Optional[str] = None
+    timings: BatchTimings = Field(default_factory=BatchTimings)
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of bytes into lines of text.
+
+    :param chunks: The bytes, in chunks of any size
+    :return: An async iterator over the lines, without their line endings
+    """
+    # Decode incrementally, since a chunk may end inside a multi-byte character
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+def parse_question(index: int, line: str) -> BatchAnswer:
+    """
+    Parse a line of NDJSON into the answer to fill in for its question.
+
+    :param index: The line number of the question
+    :param line: The line
+    :return: The answer, with an error if the line isn't a valid question
+    """
+    try:
+        question = BatchQuestion.model_validate_json(line)
+    except ValidationError as e:
+        return BatchAnswer(
+            index=index, error=f"Invalid question: {e.errors()[0]['msg']}"
+        )
+    return BatchAnswer(index=index, id=question.id, message=question.message)
+
+
+async def _read_batches(
+    lines: AsyncIterable[str], batch_size: int
+) -> AsyncIterator[List[BatchAnswer]]:
+    """Parse the questions in batches, skipping blank lines."""
+    batch: List[BatchAnswer] = []
+    index = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        batch.append(parse_question(index, line))
+        index += 1
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+async def run_batch_chat(
+    rag_service: RAGService,
+    lines: AsyncIterable[str],
+    system_prompt: str,
+    batch_size: int = BATCH_CHAT_SIZE,
+    concurrency: int = BATCH_CHAT_CONCURRENCY,
+    top_k: int = 5,
+) -> AsyncIterator[BatchAnswer]:
+    """
+    Answer a stream of questions, yielding the answers as they finish.
+
+    Questions are answered without chat history. While the LLM answers a batch, the
+    next one is read and its context retrieved. Questions that fail are answered with
+    their error, so one failure doesn't stop the run.
+
+    :param rag_service: The RAG service to retrieve context with
+    :param lines: The questions, one NDJSON object per line
+    :param system_prompt: The system prompt
+    :param batch_size: Number of questions whose context is retrieved at once
+    :param concurrency: Maximum number of LLM calls at once
+    :param top_k: Number of documents to retrieve per question
+    :return: An async iterator over the answers, in the order they finish
+    """
+    # Bounded, so answers aren't produced faster than they are consumed
+    answers: "asyncio.Queue[Optional[BatchAnswer]]" = asyncio.Queue(concurrency)
+    slots = asyncio.Semaphore(concurrency)
+    tasks: Set["asyncio.Task[None]"] = set()
+
+    async def answer(item: BatchAnswer, prompt: PreparedPrompt, start: float) -> None:
+        try:
+            route = select_route(
+                prompt.messages,
+                [c.score for c in prompt.citations if c.score is not None],
+            )
+            item.route = route.name if route is not None else None
+            llm_start = time.perf_counter()
+            item.response = await get_chat_response_with_history(
+                prompt.messages, route=route
+            )
+            item.timings.llm_ms = _elapsed_ms(llm_start)
+            item.citations = prompt.citations
+        except Exception as e:
+            item.error = str(e) or type(e).__name__
+        finally:
+            slots.release()
+        item.timings.total_ms = _elapsed_ms(start)
+        await answers.put(item)
+
+    async def produce() -> None:
+        try:
+            async for batch in _read_batches(lines, max(batch_size, 1)):
+                questions = [item for item in batch if item.error is None]
+                start = time.perf_counter()
+                prompts: List[PreparedPrompt] = []
+                if questions:
+                    try:
+                        prompts = await rag_service.prepare_prompts(
+                            system_prompt, [item.message for item in questions], top_k
+                        )
+                    except Exception as e:
+                        logger.error(f"Batch retrieval failed: {str(e)}")
+                        for item in questions:
+                            item.error = f"Retrieval failed: {str(e)}"
+                retrieval_ms = _elapsed_ms(start)
+
+                for item in batch:
+                    item.timings.retrieval_ms = retrieval_ms
+                    if item.error is not None:
+                        item.timings.total_ms = retrieval_ms
+                        await answers.put(item)
+                for item, prompt in zip(questions, prompts):
+                    await slots.acquire()
+                    task = asyncio.create_task(answer(item, prompt, start))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            await answers.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await answers.get()) is not None:
+            yield item
+        # Raise any error reading the questions
+        await producer
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+async def _read_file_lines(path: str) -> AsyncIterator[str]:
+    """Read the lines of a file, or of stdin for "-", without blocking the loop."""
+    file = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        while line := await asyncio.to_thread(file.readline):
+            yield line.rstrip("\r\n")
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("questions", help="NDJSON file of questions, or - for stdin")
+    parser.add_argument(
+        "--output", default="-", help="NDJSON file of answers, or - for stdout"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_CHAT_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CHAT_CONCURRENCY)
+    parser.add_argument("--top-k", type=int, default=5)
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Imported here, as the app imports this module for its endpoint
+    from app import chat_gpt_client, main as app_main
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    count = errors = 0
+    try:
+        async for item in run_batch_chat(
+            app_main.get_rag_service(),
+            _read_file_lines(args.questions),
+            app_main.chat_system_prompt(),
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            top_k=args.top_k,
+        ):
+            output.write(item.model_dump_json() + "\n")
+            output.flush()
+            count += 1
+            errors += item.error is not None
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await chat_gpt_client.close_client()
+    logger.info(f"Answered {count - errors} of {count} questions")
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
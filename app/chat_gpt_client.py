@@ -1,13 +1,69 @@
 from enum import Enum
+import asyncio
+from functools import partial
+import httpx
+import json
+import openai
 from openai import AsyncOpenAI, BaseModel
+from pydantic import Field
 import os
 import logging
-from typing import List
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
+from app.admission import OverloadedError, create_llm_admission
+from app.completion_cache import create_completion_cache
+from app.metrics import (
+    record_route_call,
+    record_stage,
+    record_token_usage,
+    timed_stage,
+)
+from app.single_flight import SINGLE_FLIGHT_ENABLED, SingleFlight
 
 CHAT_GPT_DEFAULT_MODEL = os.getenv("CHAT_GPT_MODEL", "gpt-4o")
 CHAT_GPT_DEFAULT_TEMPERATURE = float(os.getenv("CHAT_GPT_TEMPERATURE", "0.7"))
 CHAT_GPT_DEFAULT_MAX_TOKENS = int(os.getenv("CHAT_GPT_MAX_TOKENS", "1500"))
+# Model and maximum length of the rolling summaries of long conversations
+CHAT_GPT_SUMMARY_MODEL = os.getenv("CHAT_GPT_SUMMARY_MODEL", CHAT_GPT_DEFAULT_MODEL)
+CHAT_GPT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_GPT_SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation between the user and the assistant below, "
+    "extending the summary of its earlier part if one is given. Keep the facts, "
+    "names, numbers, decisions and open questions needed to continue the "
+    "conversation, and leave out pleasantries. Reply with the summary only."
+)
+
+# Route each chat request to a model by its size and retrieval scores (opt-in)
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "false").lower() == "true"
+# Messages of at most this many words, with at most this many earlier messages, take
+# the fast route: trivial ones always, others if their context matched well
+ROUTER_FAST_MAX_WORDS = int(os.getenv("ROUTER_FAST_MAX_WORDS", "12"))
+ROUTER_FAST_MAX_HISTORY = int(os.getenv("ROUTER_FAST_MAX_HISTORY", "4"))
+ROUTER_TRIVIAL_MAX_WORDS = int(os.getenv("ROUTER_TRIVIAL_MAX_WORDS", "3"))
+ROUTER_FAST_MIN_SCORE = float(os.getenv("ROUTER_FAST_MIN_SCORE", "0.75"))
+# Messages of at least this many words, or with at least this many earlier messages,
+# take the complex route
+ROUTER_COMPLEX_MIN_WORDS = int(os.getenv("ROUTER_COMPLEX_MIN_WORDS", "60"))
+ROUTER_COMPLEX_MIN_HISTORY = int(os.getenv("ROUTER_COMPLEX_MIN_HISTORY", "12"))
+# Estimated US dollars per million prompt and completion tokens of each model
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    model: tuple(prices)
+    for model, prices in json.loads(
+        os.getenv("MODEL_PRICES", '{"gpt-4o": [2.5, 10], "gpt-4o-mini": [0.15, 0.6]}')
+    ).items()
+}
+
+# Connection pool, timeout and retry settings for the OpenAI API
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# The OpenAI client retries connection errors, 429s and 5xx errors with jittered backoff
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
 
 
 class MessageRole(str, Enum):
@@ -19,16 +75,241 @@ class MessageRole(str, Enum):
 class Message(BaseModel):
     role: MessageRole
     content: str
+    # ID of the message in the chat history store it was read from, if any
+    id: Optional[int] = Field(default=None, exclude=True)
+
+
+class Route(BaseModel):
+    name: str
+    # Models tried in order, falling back to the next when one is slow or overloaded
+    models: List[str]
+    max_tokens: int
+    # Seconds a model has to answer, or to start streaming, before the next is tried
+    timeout: float
+
+
+def _route(name: str, models: str, max_tokens: int, timeout: float) -> Route:
+    """Create a route, overridden by the ROUTE_<NAME>_* settings."""
+    prefix = f"ROUTE_{name.upper()}_"
+    return Route(
+        name=name,
+        # Without repeats, such as when the default model is also the fallback
+        models=list(
+            dict.fromkeys(
+                model.strip()
+                for model in os.getenv(f"{prefix}MODELS", models).split(",")
+                if model.strip()
+            )
+        ),
+        max_tokens=int(os.getenv(f"{prefix}MAX_TOKENS", str(max_tokens))),
+        timeout=float(os.getenv(f"{prefix}TIMEOUT", str(timeout))),
+    )
+
+
+# Greetings and short lookups, standard questions, and long questions or conversations
+ROUTES = {
+    "fast": _route("fast", "gpt-4o-mini,gpt-4o", 500, 10),
+    "standard": _route(
+        "standard",
+        f"{CHAT_GPT_DEFAULT_MODEL},gpt-4o-mini",
+        CHAT_GPT_DEFAULT_MAX_TOKENS,
+        30,
+    ),
+    "complex": _route("complex", f"{CHAT_GPT_DEFAULT_MODEL},gpt-4o-mini", 3000, 60),
+}
+
+# Errors of a model that is slow or overloaded, after which the next one is tried
+FALLBACK_ERRORS = (
+    asyncio.TimeoutError,
+    OverloadedError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-if not client.api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables")
+# OpenAI client, created on first use so importing this module needs no API key
+client: Optional[AsyncOpenAI] = None
+
+
+def get_client() -> AsyncOpenAI:
+    """
+    Get the OpenAI client, creating it with a pooled keep-alive HTTP client.
+
+    :return: The OpenAI client
+    :raises ValueError: If OPENAI_API_KEY is not set
+    """
+    global client
+    if client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            ),
+        )
+    return client
+
+
+async def close_client() -> None:
+    """Close the OpenAI client's connections, if it was created."""
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+# Cache of completions for identical requests, None unless COMPLETION_CACHE_ENABLED
+completion_cache = create_completion_cache()
+
+# Limits the concurrency and rate of the calls to the OpenAI API
+llm_admission = create_llm_admission()
+
+# Completions in flight, shared by identical concurrent requests
+completions: Optional[SingleFlight[str]] = (
+    SingleFlight("llm") if SINGLE_FLIGHT_ENABLED else None
+)
+
+
+def classify_request(
+    messages: Sequence[Message], retrieval_scores: Sequence[float] = ()
+) -> Route:
+    """
+    Pick the route of a chat request from cheap local features.
+
+    :param messages: The prompt messages, ending with the user's message
+    :param retrieval_scores: The scores of the documents in the prompt's context
+    :return: The route
+    """
+    conversation = [message for message in messages if message.role != "system"]
+    words = len(conversation[-1].content.split()) if conversation else 0
+    history = max(len(conversation) - 1, 0)
+    top_score = max(retrieval_scores, default=0.0)
+
+    if words >= ROUTER_COMPLEX_MIN_WORDS or history >= ROUTER_COMPLEX_MIN_HISTORY:
+        return ROUTES["complex"]
+    if history <= ROUTER_FAST_MAX_HISTORY and (
+        words <= ROUTER_TRIVIAL_MAX_WORDS
+        or (words <= ROUTER_FAST_MAX_WORDS and top_score >= ROUTER_FAST_MIN_SCORE)
+    ):
+        return ROUTES["fast"]
+    return ROUTES["standard"]
+
+
+def select_route(
+    messages: Sequence[Message], retrieval_scores: Sequence[float] = ()
+) -> Optional[Route]:
+    """
+    Pick the route of a chat request, if model routing is enabled.
+
+    :param messages: The prompt messages, ending with the user's message
+    :param retrieval_scores: The scores of the documents in the prompt's context
+    :return: The route, or None to use the default model
+    """
+    if not MODEL_ROUTING_ENABLED:
+        return None
+    return classify_request(messages, retrieval_scores)
+
+
+def estimate_cost(model: str, usage) -> float:
+    """
+    Estimate the cost of an LLM call from the usage reported in its response.
+
+    :param model: The model name
+    :param usage: The response's usage object, if any
+    :return: The cost in US dollars, 0 if the usage or the model's prices are unknown
+    """
+    prices = MODEL_PRICES.get(model)
+    if usage is None or prices is None:
+        return 0.0
+    prompt_price, completion_price = prices
+    return (
+        usage.prompt_tokens * prompt_price + usage.completion_tokens * completion_price
+    ) / 1_000_000
+
+
+async def _complete(
+    full_messages: List[Message],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    route: Optional[str] = None,
+) -> str:
+    """Get a completion from the completion cache or the OpenAI API."""
+    cache_key = None
+    if completion_cache is not None and completion_cache.is_cacheable(temperature):
+        cache_key = completion_cache.make_key(
+            full_messages, model, temperature, max_tokens
+        )
+        cached_response = await completion_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response
+
+    async with llm_admission.admit():
+        with timed_stage("llm"):
+            start = time.perf_counter()
+            response = await get_client().chat.completions.create(
+                model=model,
+                messages=full_messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+    usage = getattr(response, "usage", None)
+    record_token_usage(model, usage)
+    if route is not None:
+        record_route_call(
+            route,
+            model,
+            "ok",
+            time.perf_counter() - start,
+            estimate_cost(model, usage),
+        )
+    content = response.choices[0].message.content.strip()
+
+    if cache_key is not None:
+        await completion_cache.set(cache_key, content)
+    return content
+
+
+async def _complete_routed(
+    full_messages: List[Message], route: Route, temperature: float
+) -> str:
+    """
+    Get a completion from the models of a route, falling back to the next one when
+    a model is slow or overloaded.
+    """
+    for index, model in enumerate(route.models):
+        last = index == len(route.models) - 1
+        start = time.perf_counter()
+        try:
+            # The last model may take as long as the client allows
+            return await asyncio.wait_for(
+                _complete(
+                    full_messages, model, temperature, route.max_tokens, route.name
+                ),
+                None if last or route.timeout <= 0 else route.timeout,
+            )
+        except FALLBACK_ERRORS as e:
+            outcome = "error" if last else "fallback"
+            record_route_call(route.name, model, outcome, time.perf_counter() - start)
+            if last:
+                raise
+            logger.warning(
+                f"{model} failed on the {route.name} route, falling back to "
+                f"{route.models[index + 1]}: {type(e).__name__}"
+            )
+    raise ValueError(f"The {route.name} route has no models")
 
 
 async def get_chat_response_with_history(
@@ -37,6 +318,7 @@ async def get_chat_response_with_history(
     model: str = CHAT_GPT_DEFAULT_MODEL,
     temperature: float = CHAT_GPT_DEFAULT_TEMPERATURE,
     max_tokens: int = CHAT_GPT_DEFAULT_MAX_TOKENS,
+    route: Optional[Route] = None,
 ) -> str:
     """
     Asynchronous function to get a chat response from OpenAI's ChatGPT, considering chat history.
@@ -46,19 +328,214 @@ async def get_chat_response_with_history(
     :param model: The GPT model to use
     :param temperature: Controls randomness (0 to 1)
     :param max_tokens: Maximum number of tokens in the response
+    :param route: The route of the request, whose models and max_tokens replace
+        model and max_tokens
     :return: The assistant's response as a string
     """
     try:
         full_messages = [Message(role=MessageRole.system, content=system_prompt)] + [
             Message(role=msg.role.value, content=msg.content) for msg in messages
         ]
-        response = await client.chat.completions.create(
+        if route is not None:
+            complete = partial(_complete_routed, full_messages, route, temperature)
+            target = (route.name, tuple(route.models), route.max_tokens)
+        else:
+            complete = partial(_complete, full_messages, model, temperature, max_tokens)
+            target = (model, max_tokens)
+        if completions is None:
+            return await complete()
+
+        # Identical requests made while one is in flight share its completion
+        key = (
+            target,
+            temperature,
+            tuple((msg.role, msg.content) for msg in full_messages),
+        )
+        return await completions.do(key, complete)
+    except OverloadedError:
+        # Rejected requests are answered with a 503, so clients back off
+        raise
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        return f"I'm sorry, but I encountered an error: {str(e)}"
+
+
+async def _stream_model(
+    full_messages: List[Message],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    route: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Stream a completion from the OpenAI API."""
+    # The slot is held until the whole response has been streamed
+    async with llm_admission.admit():
+        # Stages are recorded by hand, since a timing context can't span the yields
+        start = time.perf_counter()
+        stream = await get_client().chat.completions.create(
             model=model,
             messages=full_messages,
             temperature=temperature,
             max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
         )
-        return response.choices[0].message.content.strip()
+        first = True
+        usage = None
+        async for chunk in stream:
+            # The usage is reported in a final chunk without choices
+            usage = getattr(chunk, "usage", None) or usage
+            record_token_usage(model, getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                    first = False
+                yield delta
+        record_stage("llm", time.perf_counter() - start)
+    if route is not None:
+        record_route_call(
+            route, model, "ok", time.perf_counter() - start, estimate_cost(model, usage)
+        )
+
+
+async def stream_chat_response_with_history(
+    messages: List[Message],
+    system_prompt: str = "You are a helpful assistant that always answers questions.",
+    model: str = CHAT_GPT_DEFAULT_MODEL,
+    temperature: float = CHAT_GPT_DEFAULT_TEMPERATURE,
+    max_tokens: int = CHAT_GPT_DEFAULT_MAX_TOKENS,
+    route: Optional[Route] = None,
+) -> AsyncIterator[str]:
+    """
+    Asynchronous generator that streams a chat response from OpenAI's ChatGPT as it is generated.
+
+    With a route, the next model is tried when one is slow or overloaded before it
+    starts streaming. Once it has, the response is streamed from that model.
+
+    :param messages: List of previous messages, each a Message object with 'role' and 'content'
+    :param system_prompt: The system message to set the behavior of the assistant
+    :param model: The GPT model to use
+    :param temperature: Controls randomness (0 to 1)
+    :param max_tokens: Maximum number of tokens in the response
+    :param route: The route of the request, whose models and max_tokens replace
+        model and max_tokens
+    :return: An async iterator yielding the response text in incremental chunks
+    """
+    try:
+        full_messages = [Message(role=MessageRole.system, content=system_prompt)] + [
+            Message(role=msg.role.value, content=msg.content) for msg in messages
+        ]
+        models = [model] if route is None else route.models
+        if route is not None:
+            max_tokens = route.max_tokens
+        cache_key = None
+        if completion_cache is not None and completion_cache.is_cacheable(temperature):
+            cache_key = completion_cache.make_key(
+                full_messages, models[0], temperature, max_tokens
+            )
+            cached_response = await completion_cache.get(cache_key)
+            if cached_response is not None:
+                yield cached_response
+                return
+
+        deltas = []
+        for index, candidate in enumerate(models):
+            last = index == len(models) - 1
+            start = time.perf_counter()
+            stream = _stream_model(
+                full_messages,
+                candidate,
+                temperature,
+                max_tokens,
+                route.name if route is not None else None,
+            )
+            try:
+                # Only the wait for the first chunk can time out and fall back
+                first = await asyncio.wait_for(
+                    stream.__anext__(),
+                    (
+                        None
+                        if last or route is None or route.timeout <= 0
+                        else route.timeout
+                    ),
+                )
+            except StopAsyncIteration:
+                break
+            except FALLBACK_ERRORS as e:
+                await stream.aclose()
+                if route is None:
+                    raise
+                record_route_call(
+                    route.name,
+                    candidate,
+                    "error" if last else "fallback",
+                    time.perf_counter() - start,
+                )
+                if last:
+                    raise
+                logger.warning(
+                    f"{candidate} failed on the {route.name} route, falling back to "
+                    f"{models[index + 1]}: {type(e).__name__}"
+                )
+                continue
+            deltas.append(first)
+            yield first
+            async for delta in stream:
+                deltas.append(delta)
+                yield delta
+            break
+
+        if cache_key is not None:
+            await completion_cache.set(cache_key, "".join(deltas).strip())
     except Exception as e:
         logger.error(f"OpenAI API error: {str(e)}")
-        return f"I'm sorry, but I encountered an error: {str(e)}"
+        yield f"I'm sorry, but I encountered an error: {str(e)}"
+
+
+async def summarize_conversation(
+    previous_summary: Optional[str],
+    messages: List[Message],
+    model: str = CHAT_GPT_SUMMARY_MODEL,
+    max_tokens: int = CHAT_GPT_SUMMARY_MAX_TOKENS,
+) -> str:
+    """
+    Summarize a conversation, extending the summary of what preceded it.
+
+    Unlike the chat responses, errors are raised rather than returned as the summary.
+
+    :param previous_summary: The summary of the conversation before the messages, if any
+    :param messages: The messages to summarize, oldest first
+    :param model: The GPT model to use
+    :param max_tokens: Maximum number of tokens in the summary
+    :return: The summary of the whole conversation
+    """
+    transcript = "\n\n".join(
+        f"{MessageRole(message.role).value}: {message.content}" for message in messages
+    )
+    if previous_summary:
+        transcript = f"Summary so far: {previous_summary}\n\n{transcript}"
+    return await _complete(
+        [
+            Message(role=MessageRole.system, content=SUMMARY_PROMPT),
+            Message(role=MessageRole.user, content=transcript),
+        ],
+        model,
+        0,
+        max_tokens,
+    )
+
+
+async def get_embeddings(texts: List[str], model: str) -> List[List[float]]:
+    """
+    Embed a batch of texts with a single OpenAI embeddings request.
+
+    :param texts: The texts to embed
+    :param model: The embedding model to use
+    :return: One embedding per text, in the same order
+    """
+    with timed_stage("embedding"):
+        response = await get_client().embeddings.create(model=model, input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
@@ -0,0 +1,315 @@
+import asyncio
+import itertools
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.chat_gpt_client import Message, MessageRole
+
+# Load environment variables
+load_dotenv()
+
+# "memory" keeps history per worker process, "sqlite" shares it between workers
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "memory")
+CHAT_HISTORY_DB_PATH = os.getenv("CHAT_HISTORY_DB_PATH", "chat_history.sqlite3")
+# Maximum number of messages kept for each session
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "50"))
+# Maximum number of sessions kept in memory, and seconds before an idle session is dropped
+CHAT_HISTORY_MAX_SESSIONS = int(os.getenv("CHAT_HISTORY_MAX_SESSIONS", "10000"))
+CHAT_HISTORY_SESSION_TTL = float(os.getenv("CHAT_HISTORY_SESSION_TTL", "86400"))
+
+
+class ChatHistoryStore(ABC):
+    @abstractmethod
+    async def get_messages(
+        self, session_id: str, limit: Optional[int] = None
+    ) -> List[Message]:
+        """
+        Get the messages of a session, oldest first.
+
+        :param session_id: The session ID
+        :param limit: Only return this many of the most recent messages
+        :return: List of Message objects
+        """
+        pass
+
+    @abstractmethod
+    async def add_messages(self, session_id: str, messages: List[Message]) -> None:
+        """
+        Append messages to a session.
+
+        :param session_id: The session ID
+        :param messages: The messages to append, oldest first
+        """
+        pass
+
+    @abstractmethod
+    async def clear(self, session_id: str) -> None:
+        """
+        Remove all messages of a session, and its summary.
+
+        :param session_id: The session ID
+        """
+        pass
+
+    @abstractmethod
+    async def get_summary(self, session_id: str) -> Optional[str]:
+        """
+        Get the summary of the earlier messages of a session.
+
+        :param session_id: The session ID
+        :return: The summary, or None if the session hasn't been summarized
+        """
+        pass
+
+    @abstractmethod
+    async def summarize(
+        self, session_id: str, summary: str, last_message_id: int
+    ) -> bool:
+        """
+        Replace the oldest messages of a session by a summary of them.
+
+        The summary is only applied if its last message is still in the history, so a
+        summary made from a stale copy of the history, or applied twice, is dropped.
+
+        :param session_id: The session ID
+        :param summary: Summary of the conversation up to the last replaced message
+        :param last_message_id: The ID of the last message replaced
+        :return: Whether the summary was applied
+        """
+        pass
+
+
+class InMemoryChatHistoryStore(ChatHistoryStore):
+    """
+    Chat history kept in the memory of the current process.
+
+    Each session holds a ring buffer of its most recent messages, and sessions that
+    have been idle for longer than session_ttl seconds, or that exceed max_sessions,
+    are dropped least recently used first.
+    """
+
+    def __init__(
+        self,
+        max_messages: int = CHAT_HISTORY_MAX_MESSAGES,
+        max_sessions: int = CHAT_HISTORY_MAX_SESSIONS,
+        session_ttl: float = CHAT_HISTORY_SESSION_TTL,
+    ):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        # Maps session ID to (last access time, messages), least recently used first
+        self._sessions: "OrderedDict[str, Tuple[float, Deque[Message]]]" = (
+            OrderedDict()
+        )
+        self._summaries: Dict[str, str] = {}
+        # IDs of the added messages, increasing across sessions like SQLite row IDs
+        self._message_ids = itertools.count(1)
+
+    def _evict_idle_sessions(self, now: float) -> None:
+        while self._sessions:
+            session_id, (last_access, _) = next(iter(self._sessions.items()))
+            if (
+                now - last_access <= self.session_ttl
+                and len(self._sessions) <= self.max_sessions
+            ):
+                break
+            del self._sessions[session_id]
+            self._summaries.pop(session_id, None)
+
+    def _touch(self, session_id: str) -> Deque[Message]:
+        now = time.monotonic()
+        _, messages = self._sessions.pop(
+            session_id, (now, deque(maxlen=self.max_messages))
+        )
+        self._sessions[session_id] = (now, messages)
+        self._evict_idle_sessions(now)
+        return messages
+
+    async def get_messages(
+        self, session_id: str, limit: Optional[int] = None
+    ) -> List[Message]:
+        if session_id not in self._sessions:
+            return []
+        messages = list(self._touch(session_id))
+        return messages[-limit:] if limit else messages
+
+    async def add_messages(self, session_id: str, messages: List[Message]) -> None:
+        self._touch(session_id).extend(
+            message.model_copy(update={"id": next(self._message_ids)})
+            for message in messages
+        )
+
+    async def clear(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        self._summaries.pop(session_id, None)
+
+    async def get_summary(self, session_id: str) -> Optional[str]:
+        return self._summaries.get(session_id)
+
+    async def summarize(
+        self, session_id: str, summary: str, last_message_id: int
+    ) -> bool:
+        if session_id not in self._sessions:
+            return False
+        messages = self._touch(session_id)
+        if all(message.id != last_message_id for message in messages):
+            return False
+        while messages[0].id != last_message_id:
+            messages.popleft()
+        messages.popleft()
+        self._summaries[session_id] = summary
+        return True
+
+
+class SQLiteChatHistoryStore(ChatHistoryStore):
+    """
+    Chat history stored in a SQLite database that several worker processes can share.
+
+    Queries run in worker threads so they don't block the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str = CHAT_HISTORY_DB_PATH,
+        max_messages: int = CHAT_HISTORY_MAX_MESSAGES,
+    ):
+        self.path = path
+        self.max_messages = max_messages
+        with self._connect() as connection:
+            # Write-ahead logging lets readers in other processes work alongside a writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_session_id "
+                "ON messages (session_id, id)"
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS summaries (
+                    session_id TEXT PRIMARY KEY,
+                    content TEXT NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_messages(self, session_id: str, limit: Optional[int]) -> List[Message]:
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, limit or -1),
+            ).fetchall()
+        return [
+            Message(id=message_id, role=MessageRole(role), content=content)
+            for message_id, role, content in reversed(rows)
+        ]
+
+    def _add_messages(self, session_id: str, messages: List[Message]) -> None:
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                [
+                    (session_id, MessageRole(message.role).value, message.content)
+                    for message in messages
+                ],
+            )
+            # Keep only the most recent messages of the session
+            connection.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN ("
+                "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_messages),
+            )
+
+    def _clear(self, session_id: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            connection.execute(
+                "DELETE FROM summaries WHERE session_id = ?", (session_id,)
+            )
+
+    def _get_summary(self, session_id: str) -> Optional[str]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT content FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _summarize(self, session_id: str, summary: str, last_message_id: int) -> bool:
+        with self._connect() as connection:
+            # One statement, so another worker can't summarize between the check that
+            # the last message is still there and the deletion
+            deleted = connection.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id <= ? AND EXISTS ("
+                "SELECT 1 FROM messages WHERE session_id = ? AND id = ?)",
+                (session_id, last_message_id, session_id, last_message_id),
+            ).rowcount
+            if not deleted:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO summaries (session_id, content) VALUES (?, ?)",
+                (session_id, summary),
+            )
+        return True
+
+    async def get_messages(
+        self, session_id: str, limit: Optional[int] = None
+    ) -> List[Message]:
+        return await asyncio.to_thread(self._get_messages, session_id, limit)
+
+    async def add_messages(self, session_id: str, messages: List[Message]) -> None:
+        await asyncio.to_thread(self._add_messages, session_id, messages)
+
+    async def clear(self, session_id: str) -> None:
+        await asyncio.to_thread(self._clear, session_id)
+
+    async def get_summary(self, session_id: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get_summary, session_id)
+
+    async def summarize(
+        self, session_id: str, summary: str, last_message_id: int
+    ) -> bool:
+        return await asyncio.to_thread(
+            self._summarize, session_id, summary, last_message_id
+        )
+
+
+def create_chat_history_store(backend: str = CHAT_HISTORY_BACKEND) -> ChatHistoryStore:
+    """
+    Create the chat history store selected by the CHAT_HISTORY_BACKEND setting.
+
+    :param backend: Either "memory" or "sqlite"
+    :return: The chat history store
+    """
+    if backend == "memory":
+        return InMemoryChatHistoryStore()
+    if backend == "sqlite":
+        return SQLiteChatHistoryStore()
+    raise ValueError(f"Unknown chat history backend: {backend}")
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+# Load environment variables
+load_dotenv()
+
+# Cache completions of identical prompts (opt-in)
+COMPLETION_CACHE_ENABLED = (
+    os.getenv("COMPLETION_CACHE_ENABLED", "false").lower() == "true"
+)
+# Maximum number of completions kept in memory, and seconds they stay fresh
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "1024"))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+# Directory of the on-disk cache tier, which is disabled when empty
+COMPLETION_CACHE_DIR = os.getenv("COMPLETION_CACHE_DIR", "")
+# Also cache completions sampled with a temperature above 0
+COMPLETION_CACHE_ALLOW_SAMPLING = (
+    os.getenv("COMPLETION_CACHE_ALLOW_SAMPLING", "false").lower() == "true"
+)
+
+
+class CompletionCache:
+    """
+    Two-tier cache of chat completions keyed by a hash of the full request.
+
+    Completions are looked up in an in-memory LRU first, then in an optional on-disk
+    diskcache that survives restarts and can be shared by several worker processes.
+    """
+
+    def __init__(
+        self,
+        max_size: int = COMPLETION_CACHE_SIZE,
+        ttl: float = COMPLETION_CACHE_TTL,
+        directory: Optional[str] = COMPLETION_CACHE_DIR,
+        allow_sampling: bool = COMPLETION_CACHE_ALLOW_SAMPLING,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.allow_sampling = allow_sampling
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Maps cache key to (expiry time, completion), least recently used first
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk = None
+        if directory:
+            import diskcache
+
+            self._disk = diskcache.Cache(directory)
+
+    @staticmethod
+    def make_key(
+        messages: Sequence[Any],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+    ) -> str:
+        """
+        Hash everything that determines a completion into a cache key.
+
+        :param messages: The full list of messages sent to the model
+        :param model: The model name
+        :param temperature: The sampling temperature
+        :param max_tokens: The maximum number of tokens in the response
+        :return: A hex digest identifying the request
+        """
+        request = {
+            "messages": [
+                (
+                    message.model_dump(mode="json")
+                    if isinstance(message, BaseModel)
+                    else message
+                )
+                for message in messages
+            ],
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """
+        Check whether completions at a temperature may be cached.
+
+        Sampled completions vary between calls, so they are only cached if allowed.
+
+        :param temperature: The sampling temperature
+        :return: True if the completion may be cached
+        """
+        return temperature == 0 or self.allow_sampling
+
+    def _set_memory(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached completion.
+
+        :param key: The cache key
+        :return: The completion, or None if it isn't cached or has expired
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        if self._disk is not None:
+            value = await asyncio.to_thread(self._disk.get, key)
+            if value is not None:
+                self.disk_hits += 1
+                self._set_memory(key, value, time.monotonic() + self.ttl)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        Cache a completion in both tiers.
+
+        :param key: The cache key
+        :param value: The completion
+        """
+        self._set_memory(key, value, time.monotonic() + self.ttl)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, value, expire=self.ttl)
+
+    def close(self) -> None:
+        """Close the on-disk cache."""
+        if self._disk is not None:
+            self._disk.close()
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Cache size and hit/miss counters per tier."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            ),
+        }
+
+
+def create_completion_cache() -> Optional[CompletionCache]:
+    """
+    Create the completion cache if it is enabled by COMPLETION_CACHE_ENABLED.
+
+    :return: The completion cache, or None if caching is disabled
+    """
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    return CompletionCache()
@@ -0,0 +1,183 @@
+import logging
+import os
+from functools import lru_cache
+from typing import List, Optional, Protocol, Sequence
+
+import tiktoken
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app.chat_gpt_client import CHAT_GPT_DEFAULT_MODEL, Message, MessageRole
+from app.models import RagCitation
+from app.vector_store import VectorStoreResult
+
+# Load environment variables
+load_dotenv()
+
+# Maximum number of tokens in the whole prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Maximum number of those tokens spent on retrieved documents
+CONTEXT_MAX_DOCUMENT_TOKENS = int(os.getenv("CONTEXT_MAX_DOCUMENT_TOKENS", "3000"))
+# Documents are only truncated to fit if at least this many of their tokens remain
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "50"))
+
+# Tokens the chat format adds to each message on top of its content
+TOKENS_PER_MESSAGE = 4
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer(Protocol):
+    def encode(self, text: str) -> List[int]: ...
+
+    def decode(self, tokens: List[int]) -> str: ...
+
+
+class ApproximateTokenizer:
+    """Tokenizer that splits text into four-character pieces, roughly one token each."""
+
+    CHARS_PER_TOKEN = 4
+
+    def encode(self, text: str) -> List[str]:
+        return [
+            text[i : i + self.CHARS_PER_TOKEN]
+            for i in range(0, len(text), self.CHARS_PER_TOKEN)
+        ]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str = CHAT_GPT_DEFAULT_MODEL) -> Tokenizer:
+    """
+    Get the tiktoken encoding of a model, falling back to cl100k_base for unknown models.
+
+    tiktoken downloads encodings on first use, so if that fails the token counts are
+    approximated instead.
+
+    :param model: The model name
+    :return: The tokenizer
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding, approximating tokens: {e}")
+        return ApproximateTokenizer()
+
+
+class PreparedPrompt(BaseModel):
+    messages: List[Message]
+    citations: List[RagCitation]
+    prompt_tokens: int
+
+
+class ContextBuilder:
+    """
+    Assemble prompts that fit a token budget.
+
+    Retrieved documents are added by descending relevance score until the document
+    budget is spent, truncating the document that overflows it and dropping the rest.
+    The chat history then fills the remaining budget, newest message first.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        max_document_tokens: int = CONTEXT_MAX_DOCUMENT_TOKENS,
+        min_chunk_tokens: int = CONTEXT_MIN_CHUNK_TOKENS,
+        tokenizer: Optional[Tokenizer] = None,
+    ):
+        self.token_budget = token_budget
+        self.max_document_tokens = max_document_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self) -> Tokenizer:
+        # Loaded on first use, since tiktoken may need to fetch the encoding
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return self._tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    def _select_documents(
+        self, results: Sequence[VectorStoreResult], budget: int
+    ) -> List[VectorStoreResult]:
+        selected = []
+        ranked = sorted(results, key=lambda result: result.metadata.score, reverse=True)
+        for result in ranked:
+            # Documents are joined with newlines, one token each
+            tokens = self.tokenizer.encode(result.content)
+            if len(tokens) + 1 <= budget:
+                selected.append(result)
+                budget -= len(tokens) + 1
+            else:
+                if budget - 1 >= self.min_chunk_tokens:
+                    truncated = self.tokenizer.decode(tokens[: budget - 1])
+                    selected.append(result.model_copy(update={"content": truncated}))
+                break
+        return selected
+
+    def build(
+        self,
+        system_prompt: str,
+        results: Sequence[VectorStoreResult],
+        chat_history: Sequence[Message],
+        user_message: str,
+    ) -> PreparedPrompt:
+        """
+        Build the prompt messages for a user message.
+
+        :param system_prompt: The system prompt
+        :param results: The retrieved documents
+        :param chat_history: The chat history, oldest first
+        :param user_message: The user's message
+        :return: The prompt messages, the citations of the documents used, and the prompt size
+        """
+        system_prefix = f"{system_prompt}\n\nRelevant context: "
+        fixed_tokens = (
+            self.count_tokens(system_prefix)
+            + self.count_tokens(user_message)
+            + 2 * TOKENS_PER_MESSAGE
+        )
+        remaining = self.token_budget - fixed_tokens
+
+        documents = self._select_documents(
+            results, min(self.max_document_tokens, remaining)
+        )
+        context = "\n".join(document.content for document in documents)
+        remaining -= self.count_tokens(context)
+
+        # Keep the most recent history that fits, dropping the oldest messages
+        history: List[Message] = []
+        for message in reversed(chat_history):
+            tokens = self.count_tokens(message.content) + TOKENS_PER_MESSAGE
+            if tokens > remaining:
+                break
+            history.insert(0, message)
+            remaining -= tokens
+
+        messages = [
+            Message(role=MessageRole.system, content=f"{system_prefix}{context}"),
+            *history,
+            Message(role=MessageRole.user, content=user_message),
+        ]
+        citations = [
+            RagCitation(
+                source=document.metadata.source,
+                content=document.content,
+                score=document.metadata.score,
+            )
+            for document in documents
+        ]
+        return PreparedPrompt(
+            messages=messages,
+            citations=citations,
+            prompt_tokens=self.token_budget - remaining,
+        )
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from filelock import FileLock
+
+# Load environment variables
+load_dotenv()
+
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# Maximum number of texts in one embeddings request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+# Directory of the persistent embedding cache, which is disabled when empty
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+# Seconds to wait for concurrent cache misses to join the same embeddings request
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", "0.005"))
+
+
+class EmbeddingProvider(ABC):
+    # Name of the embedding model, which cached embeddings are keyed by
+    model: str = ""
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+
+        :param texts: The texts to embed
+        :return: A float32 matrix with one row per text
+        """
+        pass
+
+    async def __call__(self, texts: List[str]) -> np.ndarray:
+        # Providers can be used wherever an embedding function is expected
+        return await self.embed(texts)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embed texts with the OpenAI API, in requests of up to batch_size texts."""
+
+    def __init__(
+        self,
+        model: str = OPENAI_EMBEDDING_MODEL,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ):
+        self.model = model
+        self.batch_size = batch_size
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        from app.chat_gpt_client import get_embeddings
+
+        batches = await asyncio.gather(
+            *(
+                get_embeddings(texts[i : i + self.batch_size], self.model)
+                for i in range(0, len(texts), self.batch_size)
+            )
+        )
+        return np.asarray(
+            [embedding for batch in batches for embedding in batch], dtype=np.float32
+        )
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """
+    Persistent cache of the embeddings of another provider, keyed by a hash of the text.
+
+    Embeddings are appended to a float32 file that is memory-mapped for lookups, and
+    their keys to an index file whose line numbers are the rows of the embeddings.
+    Appends are serialized with a file lock, so several worker processes can share
+    the cache directory.
+
+    Texts that are not cached are embedded together: all misses of a call, and those
+    of concurrent calls within batch_window seconds, share a single request.
+    """
+
+    VECTORS_FILE = "embeddings.f32"
+    INDEX_FILE = "index.txt"
+    LOCK_FILE = "cache.lock"
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        directory: str = EMBEDDING_CACHE_DIR,
+        batch_window: float = EMBEDDING_BATCH_WINDOW,
+    ):
+        self.provider = provider
+        self.model = provider.model
+        # Each model's embeddings have their own size, so they are kept apart
+        self.directory = os.path.join(directory, provider.model or "default")
+        self.batch_window = batch_window
+        self.hits = 0
+        self.misses = 0
+        # Maps each key to its row in the embeddings file
+        self.rows: Dict[str, int] = {}
+        self.vectors: Optional[np.ndarray] = None
+        self._index_offset = 0
+        # Misses waiting to be embedded, and the futures of all misses being embedded
+        self._queue: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, self.VECTORS_FILE)
+        self._index_path = os.path.join(self.directory, self.INDEX_FILE)
+        self._lock = FileLock(os.path.join(self.directory, self.LOCK_FILE))
+        with self._lock:
+            self._refresh()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _refresh(self) -> None:
+        """Read the keys appended to the index, by this or another process."""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path) as f:
+            f.seek(self._index_offset)
+            keys = f.read().splitlines()
+            self._index_offset = f.tell()
+        if not keys:
+            return
+
+        rows = dict(self.rows)
+        for key in keys:
+            rows.setdefault(key, len(rows))
+        size = os.path.getsize(self._vectors_path) // np.dtype(np.float32).itemsize
+        dimensions = size // len(rows)
+        vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(rows), dimensions),
+        )
+        # This runs in a worker thread while embed() looks up rows on the event loop,
+        # so the vectors are published first: any row found is in them
+        self.vectors = vectors
+        self.rows = rows
+
+    def _append(self, keys: List[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            # Another process may have cached some of the same texts meanwhile
+            self._refresh()
+            new = [i for i, key in enumerate(keys) if key not in self.rows]
+            if new:
+                # Embeddings are written first, so the index never points past them
+                with open(self._vectors_path, "ab") as f:
+                    np.ascontiguousarray(vectors[new], dtype=np.float32).tofile(f)
+                with open(self._index_path, "a") as f:
+                    f.write("".join(f"{keys[i]}\n" for i in new))
+            self._refresh()
+
+    def _request(self, key: str, text: str) -> asyncio.Future:
+        """Get the future of a miss's embedding, queueing the miss if it is new."""
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            self._queue[key] = text
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush())
+        return future
+
+    async def _flush(self) -> None:
+        """Embed the queued misses in a single request and cache the embeddings."""
+        await asyncio.sleep(self.batch_window)
+        queue, self._queue = self._queue, {}
+        self._flush_task = None
+        keys = list(queue)
+
+        try:
+            vectors = await self.provider.embed(list(queue.values()))
+            await asyncio.to_thread(self._append, keys, vectors)
+        except BaseException as e:
+            for key in keys:
+                future = self._pending.pop(key)
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for key, vector in zip(keys, vectors):
+            future = self._pending.pop(key)
+            if not future.done():
+                future.set_result(vector)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        keys = [self._key(text) for text in texts]
+        embeddings: Dict[str, np.ndarray] = {}
+        misses: Dict[str, asyncio.Future] = {}
+        for key, text in zip(keys, texts):
+            if key in embeddings or key in misses:
+                continue
+            row = self.rows.get(key)
+            if row is not None:
+                self.hits += 1
+                embeddings[key] = self.vectors[row]
+            else:
+                self.misses += 1
+                misses[key] = self._request(key, text)
+
+        if misses:
+            # Shielded, since other calls may be waiting for the same embeddings
+            vectors = await asyncio.gather(
+                *(asyncio.shield(future) for future in misses.values())
+            )
+            embeddings.update(zip(misses, vectors))
+
+        return np.array([embeddings[key] for key in keys], dtype=np.float32)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Cache size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_embedding_provider() -> EmbeddingProvider:
+    """
+    Create the OpenAI embedding provider, cached unless EMBEDDING_CACHE_DIR is empty.
+
+    :return: The embedding provider
+    """
+    provider = OpenAIEmbeddingProvider()
+    if EMBEDDING_CACHE_DIR:
+        return CachedEmbeddingProvider(provider)
+    return provider
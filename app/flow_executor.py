@@ -0,0 +1,280 @@
+import asyncio
+import copy
+import json
+import os
+import string
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app.chat_gpt_client import (
+    CHAT_GPT_DEFAULT_MAX_TOKENS,
+    Message,
+    MessageRole,
+    get_chat_response_with_history,
+    stream_chat_response_with_history,
+)
+
+# Load environment variables
+load_dotenv()
+
+# Exported Langflow flow run in process by the "flow" chat backend
+FLOW_PATH = os.getenv(
+    "FLOW_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "memory_chatbot.json"),
+)
+
+# Names of the senders of chat messages, as Langflow's chat components default them
+DEFAULT_SENDER_NAMES = {MessageRole.user: "User", MessageRole.assistant: "AI"}
+# Langflow senders of each message role
+SENDERS = {MessageRole.user: "User", MessageRole.assistant: "Machine"}
+
+
+class FlowNode(BaseModel):
+    id: str
+    type: str
+    # The values of the node's fields, with any tweaks applied
+    params: Dict[str, Any]
+    # Maps each field that takes another node's output to that node's ID
+    inputs: Dict[str, str] = {}
+
+
+class FlowRun(BaseModel):
+    """The inputs of one run of a flow."""
+
+    message: str
+    # The chat history before the message, oldest first
+    history: List[Message] = []
+
+
+# Async function that computes the output of a node from its fields
+NodeRunner = Callable[[FlowNode, Dict[str, Any], FlowRun], Awaitable[str]]
+
+
+async def run_chat_input(node: FlowNode, fields: Dict[str, Any], run: FlowRun) -> str:
+    return run.message
+
+
+async def run_chat_output(node: FlowNode, fields: Dict[str, Any], run: FlowRun) -> str:
+    return str(fields.get("input_value") or "")
+
+
+async def run_memory(node: FlowNode, fields: Dict[str, Any], run: FlowRun) -> str:
+    """Render the most recent messages of the chat history as text."""
+    sender = fields.get("sender") or "Machine and User"
+    messages = [
+        message
+        for message in run.history
+        if sender == "Machine and User" or SENDERS.get(message.role) == sender
+    ]
+    n_messages = int(fields.get("n_messages") or 0)
+    if n_messages:
+        messages = messages[-n_messages:]
+    if fields.get("order") == "Descending":
+        messages = messages[::-1]
+
+    template = fields.get("template") or "{sender_name}: {text}"
+    return "\n".join(
+        template.format_map(
+            {
+                "sender": SENDERS.get(message.role, ""),
+                "sender_name": DEFAULT_SENDER_NAMES.get(message.role, ""),
+                "text": message.content,
+            }
+        )
+        for message in messages
+    )
+
+
+async def run_prompt(node: FlowNode, fields: Dict[str, Any], run: FlowRun) -> str:
+    """Fill the variables of the prompt template from the node's fields."""
+    template = fields.get("template") or ""
+    variables = {
+        name for _, name, _, _ in string.Formatter().parse(template) if name is not None
+    }
+    return template.format_map(
+        {name: "" if fields.get(name) is None else fields[name] for name in variables}
+    )
+
+
+def _model_arguments(fields: Dict[str, Any]) -> Dict[str, Any]:
+    arguments: Dict[str, Any] = {
+        "messages": [
+            Message(role=MessageRole.user, content=str(fields.get("input_value", "")))
+        ],
+        "max_tokens": int(fields.get("max_tokens") or CHAT_GPT_DEFAULT_MAX_TOKENS),
+    }
+    if fields.get("model_name"):
+        arguments["model"] = fields["model_name"]
+    if fields.get("temperature") not in (None, ""):
+        arguments["temperature"] = float(fields["temperature"])
+    if fields.get("system_message"):
+        arguments["system_prompt"] = fields["system_message"]
+    return arguments
+
+
+async def run_openai_model(node: FlowNode, fields: Dict[str, Any], run: FlowRun) -> str:
+    # The app's shared OpenAI client is used, rather than the node's key and base URL
+    return await get_chat_response_with_history(**_model_arguments(fields))
+
+
+NODE_RUNNERS: Dict[str, NodeRunner] = {
+    "ChatInput": run_chat_input,
+    "ChatOutput": run_chat_output,
+    "Memory": run_memory,
+    "Prompt": run_prompt,
+    "OpenAIModel": run_openai_model,
+}
+
+
+class FlowExecutor:
+    """
+    Run an exported Langflow flow in process, without a Langflow server.
+
+    The flow is compiled once into stages of nodes in topological order. The nodes of
+    a stage only depend on earlier stages, so they run concurrently. Only the node
+    types in NODE_RUNNERS are supported.
+    """
+
+    def __init__(self, flow: Dict[str, Any], tweaks: Optional[Dict[str, Any]] = None):
+        """
+        :param flow: The exported flow
+        :param tweaks: Field values that override those of the flow, by node ID
+        :raises ValueError: If the flow has unsupported nodes or a cycle
+        """
+        graph = flow.get("data", flow)
+        tweaks = tweaks or {}
+        self.nodes: Dict[str, FlowNode] = {}
+        for node in graph["nodes"]:
+            node_type = node["data"]["type"]
+            if node_type not in NODE_RUNNERS:
+                raise ValueError(f"Unsupported flow node type: {node_type}")
+            params = {
+                name: copy.deepcopy(field.get("value"))
+                for name, field in node["data"]["node"]["template"].items()
+                if isinstance(field, dict) and name != "code"
+            }
+            params.update(copy.deepcopy(tweaks.get(node["id"], {})))
+            self.nodes[node["id"]] = FlowNode(
+                id=node["id"], type=node_type, params=params
+            )
+        for edge in graph["edges"]:
+            field = edge["data"]["targetHandle"]["fieldName"]
+            self.nodes[edge["target"]].inputs[field] = edge["source"]
+
+        self.stages = self._compile()
+        outputs = [node for node in self.nodes.values() if node.type == "ChatOutput"]
+        if len(outputs) != 1:
+            raise ValueError("The flow must have exactly one chat output")
+        self.output = outputs[0]
+
+    def _compile(self) -> List[List[FlowNode]]:
+        """Group the nodes into stages by topological order (Kahn's algorithm)."""
+        remaining = {
+            node_id: set(node.inputs.values()) for node_id, node in self.nodes.items()
+        }
+        stages = []
+        while remaining:
+            ready = [node_id for node_id, sources in remaining.items() if not sources]
+            if not ready:
+                raise ValueError("The flow has a cycle")
+            stages.append([self.nodes[node_id] for node_id in ready])
+            for node_id in ready:
+                del remaining[node_id]
+            for sources in remaining.values():
+                sources.difference_update(ready)
+        return stages
+
+    def _fields(self, node: FlowNode, outputs: Dict[str, Any]) -> Dict[str, Any]:
+        fields = dict(node.params)
+        for field, source in node.inputs.items():
+            fields[field] = outputs[source]
+        return fields
+
+    async def _run_stages(
+        self, run: FlowRun, stages: Sequence[List[FlowNode]], outputs: Dict[str, Any]
+    ) -> None:
+        for stage in stages:
+            results = await asyncio.gather(
+                *(
+                    NODE_RUNNERS[node.type](node, self._fields(node, outputs), run)
+                    for node in stage
+                )
+            )
+            outputs.update((node.id, result) for node, result in zip(stage, results))
+
+    async def run(self, message: str, history: Sequence[Message] = ()) -> str:
+        """
+        Run the flow for a user message.
+
+        :param message: The user's message
+        :param history: The chat history before the message, oldest first
+        :return: The text of the chat output
+        """
+        outputs: Dict[str, Any] = {}
+        await self._run_stages(
+            FlowRun(message=message, history=list(history)), self.stages, outputs
+        )
+        return outputs[self.output.id]
+
+    def _streamed_model(self) -> Optional[Tuple[int, FlowNode]]:
+        """Find the model whose response the chat output passes on, and its stage."""
+        source = self.nodes.get(self.output.inputs.get("input_value", ""))
+        if source is None or source.type != "OpenAIModel":
+            return None
+        for index, stage in enumerate(self.stages):
+            if any(node.id == source.id for node in stage):
+                return index, source
+        return None
+
+    async def stream(
+        self, message: str, history: Sequence[Message] = ()
+    ) -> AsyncIterator[str]:
+        """
+        Run the flow for a user message, streaming the response of its model.
+
+        The nodes before the model run first. Flows whose chat output doesn't pass on a
+        model's response are run whole, and their output is yielded at once.
+
+        :param message: The user's message
+        :param history: The chat history before the message, oldest first
+        :return: An async iterator over the text of the chat output, in pieces
+        """
+        streamed = self._streamed_model()
+        if streamed is None:
+            yield await self.run(message, history)
+            return
+
+        index, model = streamed
+        run = FlowRun(message=message, history=list(history))
+        outputs: Dict[str, Any] = {}
+        await self._run_stages(run, self.stages[:index], outputs)
+        async for delta in stream_chat_response_with_history(
+            **_model_arguments(self._fields(model, outputs))
+        ):
+            yield delta
+
+
+def load_flow_executor(
+    path: str = FLOW_PATH, tweaks: Optional[Dict[str, Any]] = None
+) -> FlowExecutor:
+    """
+    Load and compile an exported flow, to be run for any number of messages.
+
+    :param path: The file of the flow
+    :param tweaks: Field values that override those of the flow, by node ID
+    :return: The flow executor
+    """
+    with open(path) as f:
+        return FlowExecutor(json.load(f), tweaks)
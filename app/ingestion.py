@@ -0,0 +1,461 @@
+"""
+Load documents into a vector store.
+
+Files are read as a stream, split into overlapping chunks and added to the store in
+pages, several pages at a time. Chunks are identified by a hash of their content,
+and a manifest of the chunks already added makes re-ingesting a corpus incremental:
+
+    python -m app.ingestion docs/ --store astra --collection my_collection
+"""
+
+import argparse
+import asyncio
+import codecs
+import hashlib
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app import vector_store
+from app.vector_store import DocumentChunk, VectorStore
+
+# Load environment variables
+load_dotenv()
+
+# Number of characters in each chunk, and how many of them repeat the previous chunk
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+# Number of chunks embedded and added to the store in each request
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+# Maximum number of those requests running at once
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "4"))
+# SQLite database recording the chunks already added to each store
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "ingest_manifest.sqlite3")
+
+SUPPORTED_EXTENSIONS = {".txt", ".md", ".markdown", ".pdf"}
+
+# Bytes read from a text file at a time
+READ_BLOCK_SIZE = 64 * 1024
+
+# Preferred places to end a chunk, best first
+CHUNK_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# Maximum number of chunk IDs in one manifest query
+MANIFEST_QUERY_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionStats(BaseModel):
+    files: int = 0
+    chunks: int = 0
+    skipped: int = 0
+    added: int = 0
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Find the supported documents in files and directories.
+
+    :param paths: Files and directories, which are searched recursively
+    :return: An iterator of file paths, in sorted order within each directory
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                        yield os.path.join(directory, filename)
+        else:
+            yield path
+
+
+def read_segments(source: str, stream: BinaryIO) -> Iterator[str]:
+    """
+    Read the text of a document in segments, without loading all of it at once.
+
+    :param source: The document's file name, whose extension selects the format
+    :param stream: The document's contents
+    :return: An iterator of text segments: pages of a PDF, or blocks of a text file
+    """
+    extension = os.path.splitext(source)[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Unsupported document type: {source}")
+
+    if extension == ".pdf":
+        from pypdf import PdfReader
+
+        for page in PdfReader(stream).pages:
+            yield page.extract_text() + "\n\n"
+        return
+
+    # Decode incrementally, since a block may end inside a multi-byte character
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while block := stream.read(READ_BLOCK_SIZE):
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+
+def _find_chunk_end(text: str, chunk_size: int, overlap: int) -> int:
+    """Find where to end a chunk, preferably after a paragraph, line or sentence."""
+    # Only consider the second half of the chunk, so chunks don't get too small,
+    # and always end after the overlap, so every chunk makes progress
+    start = max(chunk_size // 2, overlap + 1)
+    for separator in CHUNK_SEPARATORS:
+        index = text.rfind(separator, start, chunk_size)
+        if index != -1:
+            return index + len(separator)
+    return chunk_size
+
+
+def chunk_text(
+    segments: Iterable[str],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    overlap: int = INGEST_CHUNK_OVERLAP,
+) -> Iterator[str]:
+    """
+    Split streamed text into chunks of at most chunk_size characters.
+
+    Consecutive chunks share about overlap characters, so text cut at a chunk
+    boundary is still found with its context.
+
+    :param segments: The text, in any number of segments
+    :param chunk_size: The maximum number of characters in a chunk
+    :param overlap: The number of characters repeated from the previous chunk
+    :return: An iterator of chunks
+    """
+    if not 0 <= overlap < chunk_size:
+        raise ValueError("overlap must be at least 0 and less than chunk_size")
+
+    buffer = ""
+    # Number of characters at the start of the buffer already in the previous chunk
+    carried = 0
+    for segment in segments:
+        buffer += segment
+        while len(buffer) > chunk_size:
+            end = _find_chunk_end(buffer, chunk_size, overlap)
+            chunk = buffer[:end].strip()
+            if chunk:
+                yield chunk
+            # Start the overlap at a word boundary, so it doesn't begin mid-word
+            start = end - overlap
+            for i in range(start, end):
+                if buffer[i].isspace():
+                    start = i + 1
+                    break
+            buffer = buffer[start:]
+            carried = end - start
+
+    if len(buffer) > carried and buffer.strip():
+        yield buffer.strip()
+
+
+def make_chunk_id(source: str, content: str) -> str:
+    """
+    Derive a chunk's ID from its source and content.
+
+    :param source: The source of the document
+    :param content: The content of the chunk
+    :return: A hex digest that only changes when the chunk does
+    """
+    return hashlib.sha256(f"{source}\0{content}".encode()).hexdigest()
+
+
+def iter_chunks(
+    source: str,
+    stream: BinaryIO,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    overlap: int = INGEST_CHUNK_OVERLAP,
+) -> Iterator[DocumentChunk]:
+    """
+    Read and chunk a document.
+
+    :param source: The document's file name
+    :param stream: The document's contents
+    :param chunk_size: The maximum number of characters in a chunk
+    :param overlap: The number of characters repeated from the previous chunk
+    :return: An iterator of the document's chunks
+    """
+    for content in chunk_text(read_segments(source, stream), chunk_size, overlap):
+        yield DocumentChunk(
+            id=make_chunk_id(source, content), content=content, source=source
+        )
+
+
+class IngestionManifest:
+    """
+    Record of the chunks added to each vector store, kept in a SQLite database.
+
+    Queries run in worker threads so they don't block the event loop.
+    """
+
+    def __init__(self, path: str = INGEST_MANIFEST_PATH):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    namespace TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    PRIMARY KEY (namespace, id)
+                ) WITHOUT ROWID
+                """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _find_existing(self, namespace: str, ids: List[str]) -> Set[str]:
+        existing = set()
+        with self._connect() as connection:
+            for i in range(0, len(ids), MANIFEST_QUERY_SIZE):
+                batch = ids[i : i + MANIFEST_QUERY_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    "SELECT id FROM chunks "
+                    f"WHERE namespace = ? AND id IN ({placeholders})",
+                    (namespace, *batch),
+                )
+                existing.update(row[0] for row in rows)
+        return existing
+
+    def _record(self, namespace: str, ids: List[str]) -> None:
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO chunks (namespace, id) VALUES (?, ?)",
+                [(namespace, chunk_id) for chunk_id in ids],
+            )
+
+    async def find_existing(self, namespace: str, ids: List[str]) -> Set[str]:
+        """
+        Find which of the given chunks were already added to a store.
+
+        :param namespace: The store, e.g. its backend and collection name
+        :param ids: The chunk IDs
+        :return: The IDs that were already added
+        """
+        return await asyncio.to_thread(self._find_existing, namespace, ids)
+
+    async def record(self, namespace: str, ids: List[str]) -> None:
+        """
+        Record chunks as added to a store.
+
+        :param namespace: The store, e.g. its backend and collection name
+        :param ids: The chunk IDs
+        """
+        await asyncio.to_thread(self._record, namespace, ids)
+
+
+async def ingest_chunks(
+    store: VectorStore,
+    chunks: Iterable[DocumentChunk],
+    manifest: Optional[IngestionManifest] = None,
+    namespace: str = "default",
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_concurrency: int = INGEST_MAX_CONCURRENCY,
+    stats: Optional[IngestionStats] = None,
+) -> IngestionStats:
+    """
+    Add chunks to a vector store in pages, skipping the chunks it already has.
+
+    Up to max_concurrency pages are embedded and added at once. Chunks are only
+    recorded in the manifest once their page was added, so an interrupted run
+    resumes where it stopped.
+
+    :param store: The vector store to add the chunks to
+    :param chunks: The chunks
+    :param manifest: The record of chunks already added, if any
+    :param namespace: The store's name in the manifest
+    :param batch_size: The number of chunks added in each request
+    :param max_concurrency: The maximum number of requests running at once
+    :param stats: Counters to update, if counting across several calls
+    :return: The number of chunks seen, skipped and added
+    """
+    stats = stats or IngestionStats()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: Set[asyncio.Task] = set()
+    # Chunks seen in this run, which the manifest doesn't list until they are added
+    seen: Set[str] = set()
+    page: List[DocumentChunk] = []
+
+    async def add_page(documents: List[DocumentChunk]) -> None:
+        try:
+            await store.add_documents(documents)
+            if manifest is not None:
+                await manifest.record(
+                    namespace, [document.id for document in documents]
+                )
+            stats.added += len(documents)
+        finally:
+            semaphore.release()
+
+    async def schedule(documents: List[DocumentChunk]) -> None:
+        await semaphore.acquire()
+        # Stop at the first failed page rather than after the whole corpus
+        for task in [task for task in tasks if task.done()]:
+            tasks.discard(task)
+            task.result()
+        tasks.add(asyncio.create_task(add_page(documents)))
+
+    async def add_new(candidates: List[DocumentChunk]) -> None:
+        existing = set()
+        if manifest is not None:
+            existing = await manifest.find_existing(
+                namespace, [chunk.id for chunk in candidates]
+            )
+        for chunk in candidates:
+            if chunk.id in existing or chunk.id in seen:
+                stats.skipped += 1
+                continue
+            seen.add(chunk.id)
+            page.append(chunk)
+            if len(page) == batch_size:
+                await schedule(page[:])
+                page.clear()
+
+    try:
+        candidates: List[DocumentChunk] = []
+        for chunk in chunks:
+            stats.chunks += 1
+            candidates.append(chunk)
+            if len(candidates) == batch_size:
+                await add_new(candidates)
+                candidates = []
+        await add_new(candidates)
+        if page:
+            await schedule(page[:])
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return stats
+
+
+async def ingest_paths(
+    store: VectorStore,
+    paths: Iterable[str],
+    manifest: Optional[IngestionManifest] = None,
+    namespace: str = "default",
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    overlap: int = INGEST_CHUNK_OVERLAP,
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_concurrency: int = INGEST_MAX_CONCURRENCY,
+) -> IngestionStats:
+    """
+    Chunk the documents in files and directories and add them to a vector store.
+
+    :param store: The vector store to add the documents to
+    :param paths: Files and directories, which are searched recursively
+    :param manifest: The record of chunks already added, if any
+    :param namespace: The store's name in the manifest
+    :param chunk_size: The maximum number of characters in a chunk
+    :param overlap: The number of characters repeated from the previous chunk
+    :param batch_size: The number of chunks added in each request
+    :param max_concurrency: The maximum number of requests running at once
+    :return: The number of files and chunks seen, skipped and added
+    """
+    stats = IngestionStats()
+
+    def chunks() -> Iterator[DocumentChunk]:
+        for path in iter_files(paths):
+            stats.files += 1
+            logger.info(f"Ingesting {path}")
+            with open(path, "rb") as stream:
+                yield from iter_chunks(path, stream, chunk_size, overlap)
+
+    return await ingest_chunks(
+        store, chunks(), manifest, namespace, batch_size, max_concurrency, stats
+    )
+
+
+def create_vector_store(
+    backend: str, collection_name: str, path: Optional[str] = None
+) -> VectorStore:
+    """
+    Create the vector store to ingest documents into.
+
+    :param backend: One of "astra", "chroma", "local" or "bm25"
+    :param collection_name: The collection name, for Astra DB and ChromaDB
+    :param path: The database directory, for ChromaDB and the local store, or the
+        file of the BM25 index
+    :return: The vector store
+    """
+    if backend == "bm25":
+        from app.lexical_index import LEXICAL_INDEX_PATH, BM25Index
+
+        return BM25Index(path or LEXICAL_INDEX_PATH or "lexical_index.json")
+    return vector_store.create_vector_store(backend, collection_name, path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Chunk documents and add them to a vector store."
+    )
+    parser.add_argument("paths", nargs="+", help="Files and directories to ingest")
+    parser.add_argument(
+        "--store", choices=["astra", "chroma", "local", "bm25"], default="astra"
+    )
+    parser.add_argument(
+        "--collection",
+        default=os.getenv("ASTRA_COLLECTION_NAME") or "default_collection",
+    )
+    parser.add_argument(
+        "--path",
+        help="Database directory of the chroma and local stores, or BM25 index file",
+    )
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--overlap", type=int, default=INGEST_CHUNK_OVERLAP)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=INGEST_MAX_CONCURRENCY)
+    parser.add_argument("--manifest", default=INGEST_MANIFEST_PATH)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Add every chunk, even those the manifest lists as added",
+    )
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> IngestionStats:
+    args = parse_args(argv)
+    store = create_vector_store(args.store, args.collection, args.path)
+    # The local store and BM25 index skip the chunks they have themselves, and a
+    # manifest could list chunks that were never saved if ingestion is interrupted
+    manifest = None
+    if not args.full and args.store not in ("local", "bm25"):
+        manifest = IngestionManifest(args.manifest)
+
+    stats = await ingest_paths(
+        store,
+        args.paths,
+        manifest=manifest,
+        namespace=f"{args.store}:{args.path or ''}:{args.collection}",
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        max_concurrency=args.concurrency,
+    )
+    if args.store in ("local", "bm25"):
+        store.save()
+    logger.info(
+        f"Ingested {stats.files} files: {stats.added} chunks added, "
+        f"{stats.skipped} unchanged of {stats.chunks}"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
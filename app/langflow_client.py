@@ -1,9 +1,34 @@
+import asyncio
+import copy
+import os
+import random
 import httpx
-from typing import Optional, Dict, Any
+import ijson
+from dotenv import load_dotenv
+from typing import Any, AsyncIterator, Dict, Optional
 
-BASE_API_URL = "http://127.0.0.1:7861/api/v1/run"
-FLOW_ID = "8c4e757e-4bbf-45b0-b131-14a3e9af1836"
-ENDPOINT = ""  # You can set a specific endpoint name in the flow settings
+# Load environment variables
+load_dotenv()
+
+BASE_API_URL = os.getenv("LANGFLOW_API_URL", "http://127.0.0.1:7861/api/v1/run")
+FLOW_ID = os.getenv("LANGFLOW_FLOW_ID", "8c4e757e-4bbf-45b0-b131-14a3e9af1836")
+# You can set a specific endpoint name in the flow settings
+ENDPOINT = os.getenv("LANGFLOW_ENDPOINT", "")
+LANGFLOW_API_KEY = os.getenv("LANGFLOW_API_KEY")
+
+# Connection pool and timeout settings for requests to Langflow
+LANGFLOW_MAX_CONNECTIONS = int(os.getenv("LANGFLOW_MAX_CONNECTIONS", "100"))
+LANGFLOW_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LANGFLOW_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+LANGFLOW_TIMEOUT = float(os.getenv("LANGFLOW_TIMEOUT", "60"))
+LANGFLOW_CONNECT_TIMEOUT = float(os.getenv("LANGFLOW_CONNECT_TIMEOUT", "5"))
+# Retries of requests that fail with a server error or a connection error
+LANGFLOW_MAX_RETRIES = int(os.getenv("LANGFLOW_MAX_RETRIES", "3"))
+LANGFLOW_RETRY_BACKOFF = float(os.getenv("LANGFLOW_RETRY_BACKOFF", "0.5"))
+
+# Errors that happen before the request reached the server, so retrying is safe
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
 
 # You can tweak the flow by adding a tweaks dictionary
 TWEAKS = {
@@ -12,10 +37,86 @@ TWEAKS = {
     "OpenAIModel-YWZWf": {},
     "ChatOutput-gADpg": {},
     "Memory-dw7V3": {},
-    "TextInput-yH3PL": {
-        "input_value": "session-123",
-    },
+    "TextInput-yH3PL": {},
 }
+# The component fields that take the chat session ID, so each session has its own
+# memory in the flow
+SESSION_TWEAKS = {"TextInput-yH3PL": "input_value"}
+
+# Location of the response text in the result of a flow run
+RESPONSE_TEXT_PATH = "outputs.item.outputs.item.results.message.text"
+
+
+# Shared client, so requests reuse pooled keep-alive connections
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared HTTP client for Langflow requests, creating it on first use.
+
+    :return: The shared client
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LANGFLOW_MAX_CONNECTIONS,
+                max_keepalive_connections=LANGFLOW_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(LANGFLOW_TIMEOUT, connect=LANGFLOW_CONNECT_TIMEOUT),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def post_with_retry(
+    client: httpx.AsyncClient,
+    url: str,
+    max_retries: Optional[int] = None,
+    backoff: Optional[float] = None,
+    stream: bool = False,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    POST a request, retrying server errors and connection errors with jittered backoff.
+
+    :param client: The HTTP client
+    :param url: The URL to post to
+    :param max_retries: Maximum number of retries, defaults to LANGFLOW_MAX_RETRIES
+    :param backoff: Base delay in seconds, doubled on every retry, defaults to
+        LANGFLOW_RETRY_BACKOFF
+    :param stream: Return before reading the response body, which the caller must
+        then read or close
+    :param kwargs: Further arguments for client.build_request
+    :return: The response of the last attempt
+    """
+    if max_retries is None:
+        max_retries = LANGFLOW_MAX_RETRIES
+    if backoff is None:
+        backoff = LANGFLOW_RETRY_BACKOFF
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.send(
+                client.build_request("POST", url, **kwargs), stream=stream
+            )
+            if response.status_code < 500 or attempt == max_retries:
+                return response
+            await response.aclose()
+            print(f"Server error {response.status_code}, retrying: {url}")
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            print(f"Connection error, retrying: {e}")
+        # Full jitter keeps clients that failed together from retrying together
+        await asyncio.sleep(random.uniform(0, backoff * 2**attempt))
 
 
 async def run_flow(
@@ -48,38 +149,164 @@ async def run_flow(
     if api_key:
         headers["x-api-key"] = api_key
 
-    async with httpx.AsyncClient() as client:
+    try:
+        response = await post_with_retry(
+            get_http_client(), api_url, json=payload, headers=headers
+        )
+        response.raise_for_status()  # Raise an exception for bad status codes
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        print(f"HTTP error occurred: {e}")
+        return {"error": str(e)}
+    except httpx.RequestError as e:
+        print(f"An error occurred while requesting: {e}")
+        return {"error": str(e)}
+
+
+def build_tweaks(session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the tweaks of a run for a chat session, leaving TWEAKS untouched.
+
+    :param session_id: The chat session ID, if any
+    :return: A copy of TWEAKS with the session ID set
+    """
+    tweaks = copy.deepcopy(TWEAKS)
+    if session_id:
+        for component, field in SESSION_TWEAKS.items():
+            tweaks.setdefault(component, {})[field] = session_id
+    return tweaks
+
+
+class _ResponseReader:
+    """File-like view of a streamed response body, for the async ijson parsers."""
+
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.aiter_bytes()
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson reads nothing first to tell bytes from text, and accepts chunks of
+        # any size after that, with an empty one at the end of the body
+        if size == 0:
+            return b""
         try:
-            response = await client.post(api_url, json=payload, headers=headers)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            print(f"HTTP error occurred: {e}")
-            return {"error": str(e)}
-        except httpx.RequestError as e:
-            print(f"An error occurred while requesting: {e}")
-            return {"error": str(e)}
-
-
-async def get_chat_response(message: str) -> str:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+
+async def _start_flow(
+    message: str,
+    session_id: Optional[str],
+    stream: bool,
+    endpoint: str = ENDPOINT or FLOW_ID,
+) -> httpx.Response:
+    """
+    Start a run of the flow for a chat session, without reading the response body.
+
+    :param message: The message to send to the flow
+    :param session_id: The chat session ID, if any
+    :param stream: Ask Langflow to stream the events of the run
+    :param endpoint: The ID or the endpoint name of the flow
+    :return: The streamed response, which the caller must close
+    :raises httpx.HTTPError: If the request failed
+    """
+    payload: Dict[str, Any] = {
+        "input_value": message,
+        "output_type": "chat",
+        "input_type": "chat",
+        "tweaks": build_tweaks(session_id),
+    }
+    if session_id:
+        payload["session_id"] = session_id
+    headers = {"x-api-key": LANGFLOW_API_KEY} if LANGFLOW_API_KEY else {}
+
+    response = await post_with_retry(
+        get_http_client(),
+        f"{BASE_API_URL}/{endpoint}",
+        stream=True,
+        params={"stream": "true"} if stream else None,
+        json=payload,
+        headers=headers,
+    )
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+async def get_chat_response(message: str, session_id: Optional[str] = None) -> str:
     """
     Asynchronous function to get a chat response from the LLM.
+
+    The response text is parsed as the body arrives, without loading the rest of the
+    run's result.
+
     :param message: The user's message
+    :param session_id: The chat session ID, which keeps the flow's memory apart
     :return: The LLM's response as a string
     """
-    response = await run_flow(message, tweaks=TWEAKS)
-
-    if "error" in response:
-        return f"I'm sorry, but I encountered an error: {response['error']}"
+    try:
+        response = await _start_flow(message, session_id, stream=False)
+    except httpx.HTTPError as e:
+        print(f"An error occurred while requesting: {e}")
+        return f"I'm sorry, but I encountered an error: {e}"
 
     try:
-        # Navigate through the nested structure to get the message text
-        llm_response = response["outputs"][0]["outputs"][0]["results"]["message"][
-            "text"
-        ]
-    except (KeyError, IndexError) as e:
+        async for text in ijson.items_async(
+            _ResponseReader(response), RESPONSE_TEXT_PATH
+        ):
+            return text
+    except (ijson.JSONError, httpx.HTTPError) as e:
         print(f"Error parsing LLM response: {e}")
-        print(f"Full response: {response}")
-        return "I'm sorry, but I couldn't understand the response. Please try again."
+    finally:
+        await response.aclose()
+    return "I'm sorry, but I couldn't understand the response. Please try again."
+
+
+async def stream_chat_response(
+    message: str, session_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a chat response from the flow, token by token.
+
+    Langflow streams a run as a sequence of JSON events, which are parsed as they
+    arrive. If the flow's model doesn't stream tokens, the whole response text is
+    yielded from the result of the run once it ends.
 
-    return llm_response
+    :param message: The user's message
+    :param session_id: The chat session ID, which keeps the flow's memory apart
+    :return: An async iterator over the response text, in pieces
+    """
+    try:
+        response = await _start_flow(message, session_id, stream=True)
+    except httpx.HTTPError as e:
+        print(f"An error occurred while requesting: {e}")
+        yield f"I'm sorry, but I encountered an error: {e}"
+        return
+
+    streamed = False
+    try:
+        async for event in ijson.items_async(
+            _ResponseReader(response), "", multiple_values=True
+        ):
+            data = event.get("data") or {}
+            if event.get("event") == "token":
+                streamed = True
+                yield data.get("chunk", "")
+            elif event.get("event") == "error":
+                yield f"I'm sorry, but I encountered an error: {data.get('error')}"
+                return
+            elif event.get("event") == "end" and not streamed:
+                try:
+                    yield data["result"]["outputs"][0]["outputs"][0]["results"][
+                        "message"
+                    ]["text"]
+                except (KeyError, IndexError, TypeError) as e:
+                    print(f"Error parsing LLM response: {e}")
+                    yield "I'm sorry, but I couldn't understand the response."
+    except (ijson.JSONError, httpx.HTTPError) as e:
+        print(f"Error streaming LLM response: {e}")
+        yield f"I'm sorry, but I encountered an error: {e}"
+    finally:
+        await response.aclose()
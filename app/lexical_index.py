@@ -0,0 +1,210 @@
+import asyncio
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from app.vector_store import (
+    DocumentChunk,
+    VectorStore,
+    VectorStoreMetadata,
+    VectorStoreResult,
+)
+
+# Load environment variables
+load_dotenv()
+
+# File of the BM25 index searched alongside the vector store, disabled when empty
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "")
+
+# Words, numbers and identifiers such as "SKU-1234" or "v2.1.0"
+TOKEN_PATTERN = re.compile(r"\w+(?:[-_.]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lower case terms for lexical search.
+
+    Identifiers joined by hyphens, underscores or dots are kept whole, so they can be
+    matched exactly, and are also split into their parts.
+
+    :param text: The text
+    :return: The terms, in order
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-_.]", token) if part)
+    return terms
+
+
+class BM25Index(VectorStore):
+    """
+    In-process inverted index that ranks documents with Okapi BM25.
+
+    Lexical search finds exact identifiers and rare terms that dense embeddings tend
+    to miss. Documents are added incrementally, and documents whose IDs the index
+    already has are skipped. Searches run in a worker thread.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Dict[str, str]] = []
+        self.lengths: List[int] = []
+        # Maps each term to the number of times it occurs in each document
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.ids: Set[str] = set()
+        self.total_length = 0
+        # Guards the index against being searched while documents are added
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def add(self, documents: List[DocumentChunk]) -> int:
+        """
+        Add documents to the index.
+
+        :param documents: The documents to add
+        :return: The number of documents added, excluding those already in the index
+        """
+        added = 0
+        with self._lock:
+            for document in documents:
+                if document.id in self.ids:
+                    continue
+                index = len(self.documents)
+                terms = tokenize(document.content)
+                for term, count in Counter(terms).items():
+                    self.postings.setdefault(term, {})[index] = count
+                self.documents.append(
+                    {
+                        "id": document.id,
+                        "content": document.content,
+                        "source": document.source,
+                    }
+                )
+                self.lengths.append(len(terms))
+                self.total_length += len(terms)
+                self.ids.add(document.id)
+                added += 1
+        return added
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        self.add(documents)
+
+    def search(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        """
+        Find the documents that best match the terms of a query.
+
+        :param query: The query string
+        :param top_k: Number of top results to return
+        :return: Matching documents by descending BM25 score
+        """
+        with self._lock:
+            if not self.documents:
+                return []
+            count = len(self.documents)
+            average_length = self.total_length / count
+
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for index, frequency in postings.items():
+                    length_norm = (
+                        1 - self.b + self.b * self.lengths[index] / average_length
+                    )
+                    scores[index] = scores.get(index, 0.0) + idf * (
+                        frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                    )
+
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [
+                VectorStoreResult(
+                    content=self.documents[index]["content"],
+                    metadata=VectorStoreMetadata(
+                        score=score, source=self.documents[index]["source"]
+                    ),
+                )
+                for index, score in best
+            ]
+
+    async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        return await asyncio.to_thread(self.search, query, top_k)
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Persist the index to a JSON file, replacing it atomically.
+
+        :param path: The file to write to, defaults to the index's path
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError("No path given to save the index to")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            data = {
+                "k1": self.k1,
+                "b": self.b,
+                "documents": self.documents,
+                "lengths": self.lengths,
+                # JSON object keys are strings, so postings are stored as pairs
+                "postings": {
+                    term: list(postings.items())
+                    for term, postings in self.postings.items()
+                },
+            }
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temporary_path, path)
+
+    def load(self, path: str) -> None:
+        """
+        Load a saved index, without re-tokenizing its documents.
+
+        :param path: The file the index was saved to
+        """
+        with open(path) as f:
+            data = json.load(f)
+        with self._lock:
+            self.k1 = data["k1"]
+            self.b = data["b"]
+            self.documents = data["documents"]
+            self.lengths = data["lengths"]
+            self.postings = {
+                term: {index: count for index, count in postings}
+                for term, postings in data["postings"].items()
+            }
+            self.ids = {document["id"] for document in self.documents}
+            self.total_length = sum(self.lengths)
+
+
+def load_lexical_index(path: str = LEXICAL_INDEX_PATH) -> Optional[BM25Index]:
+    """
+    Load the lexical index if LEXICAL_INDEX_PATH is set.
+
+    :param path: The file of the index
+    :return: The index, empty if the file doesn't exist yet, or None if disabled
+    """
+    if not path:
+        return None
+    return BM25Index(path)
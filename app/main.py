@@ -1,16 +1,76 @@
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, Form, Request
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    Form,
+    HTTPException,
+    Request,
+    UploadFile,
+)
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
+from starlette.routing import Match
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from typing import List, Dict
-import markdown2
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from typing import AsyncIterator, List, Dict, Optional, Set, Tuple
+from functools import lru_cache
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+from markdown_it import MarkdownIt
+import time
 import uuid
 
-from app.chat_gpt_client import get_chat_response_with_history, Message, MessageRole
+from app import chat_gpt_client
+from app.admission import OverloadedError, create_vector_store_admission
+from app.chat_gpt_client import (
+    get_chat_response_with_history,
+    select_route,
+    stream_chat_response_with_history,
+    Message,
+    MessageRole,
+    Route,
+)
+from app.batch_chat import iter_lines, run_batch_chat
+from app.chat_history import create_chat_history_store
+from app.flow_executor import FlowExecutor, load_flow_executor
+from app.ingestion import IngestionManifest, IngestionStats, ingest_chunks, iter_chunks
+from app.langflow_client import (
+    close_http_client,
+    get_chat_response as get_langflow_response,
+    stream_chat_response as stream_langflow_response,
+)
+from app.lexical_index import BM25Index, load_lexical_index
+from app.metrics import (
+    REQUEST_DURATION,
+    REQUESTS_IN_FLIGHT,
+    RequestTimer,
+    current_request_timer,
+    registry,
+    timed_stage,
+)
+from app.models import RagCitation
+from app.shared_state import create_state_store
 from app.rag_service import RAGService
-from app.vector_store import AstraDBStore
+from app.vector_store import (
+    AdmissionControlledVectorStore,
+    CachedVectorStore,
+    LocalVectorStore,
+    VECTOR_CACHE_SIZE,
+    VECTOR_STORE,
+    VECTOR_STORE_PATH,
+    VectorStore,
+    create_vector_store,
+)
 
 # Load environment variables
 load_dotenv()
@@ -28,11 +88,68 @@ SYSTEM_PROMPT = os.getenv(
     "SYSTEM_PROMPT",
     "You are a helpful assistant that answers questions based on the given context and chat history.",
 )
-# TODO: Move this to be a Pydantc Field on the AstraDBStore (AstraDBConfig?)
+# Stream bot responses token by token over server-sent events
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+# Minimum number of seconds between re-rendering a streamed response
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.05"))
+# Maximum number of accepted messages waiting for the browser to open their stream
+MAX_PENDING_STREAMS = int(os.getenv("MAX_PENDING_STREAMS", "1000"))
+# Seconds an accepted message waits for the browser to open its stream
+PENDING_STREAM_TTL = float(os.getenv("PENDING_STREAM_TTL", "300"))
+# Maximum number of messages whose citations can be loaded when their sources expand
+MAX_STORED_CITATIONS = int(os.getenv("MAX_STORED_CITATIONS", "1000"))
+# Maximum number of rendered citation snippets kept for reuse
+CITATION_CACHE_SIZE = int(os.getenv("CITATION_CACHE_SIZE", "1024"))
+# Seconds the citations of a message can be loaded
+STORED_CITATIONS_TTL = float(os.getenv("STORED_CITATIONS_TTL", "86400"))
+# Collection of the "astra" and "chroma" vector stores
 ASTRA_COLLECTION_NAME = os.getenv("ASTRA_COLLECTION_NAME")
+# Trace requests with OpenTelemetry (requires the FastAPI instrumentation package)
+OTEL_INSTRUMENT_FASTAPI = (
+    os.getenv("OTEL_INSTRUMENT_FASTAPI", "false").lower() == "true"
+)
+# Name of the cookie that identifies a chat session
+SESSION_COOKIE_NAME = os.getenv("SESSION_COOKIE_NAME", "chat_session")
+# Where responses come from: "openai", with retrieved context and the chat history,
+# "langflow", which runs the Langflow flow with its own memory of each session, or
+# "flow", which runs the exported flow at FLOW_PATH in process over the chat history
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "openai")
+# Allow uploading documents to the vector store through /api/ingest
+INGEST_API_ENABLED = os.getenv("INGEST_API_ENABLED", "false").lower() == "true"
+# Allow answering NDJSON streams of questions through /api/batch_chat
+BATCH_CHAT_API_ENABLED = os.getenv("BATCH_CHAT_API_ENABLED", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the vector store and the OpenAI client before the first request, rather
+    # than on import or during it
+    get_rag_service()
+    if CHAT_BACKEND == "flow":
+        get_flow_executor()
+    try:
+        chat_gpt_client.get_client()
+    except ValueError as e:
+        logger.error(f"OpenAI client unavailable: {e}")
+    app.state.ready = True
+    yield
+    # Take the worker out of rotation while it drains
+    app.state.ready = False
+    # Close pooled upstream connections on shutdown
+    await close_http_client()
+    await chat_gpt_client.close_client()
+    if chat_gpt_client.completion_cache is not None:
+        chat_gpt_client.completion_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+if OTEL_INSTRUMENT_FASTAPI:
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+    FastAPIInstrumentor.instrument_app(app)
 
 templates_directory = os.path.join(os.path.dirname(__file__), "templates")
 templates = Jinja2Templates(directory=templates_directory)
@@ -41,16 +158,137 @@ templates = Jinja2Templates(directory=templates_directory)
 static_directory = os.path.join(os.path.dirname(__file__), "static")
 app.mount("/static", StaticFiles(directory=static_directory), name="static")
 
-# Simulating a database with an in-memory list
-chat_history: List[Message] = []
+# Chat history of each session, keyed by the session cookie
+chat_history_store = create_chat_history_store()
+# Sessions whose history is being summarized by this worker
+summarizing_sessions: Set[str] = set()
+
+# (session ID, user message) waiting for the response to be streamed, keyed by message
+# ID, which the request that opens the stream may find on any worker
+pending_streams = create_state_store(
+    "pending_streams", MAX_PENDING_STREAMS, PENDING_STREAM_TTL
+)
+
+# Citations of recent messages, loaded when their sources are expanded
+recent_citations = create_state_store(
+    "citations", MAX_STORED_CITATIONS, STORED_CITATIONS_TTL
+)
+
+# The vector store selected by VECTOR_STORE, the BM25 index searched alongside it if
+# LEXICAL_INDEX_PATH is set, and the RAG service over both, created on startup
+vector_store: Optional[VectorStore] = None
+# The same store if it is the local one, which is saved after documents are uploaded
+local_vector_store: Optional[LocalVectorStore] = None
+lexical_index: Optional[BM25Index] = None
+rag_service: Optional[RAGService] = None
+
+
+def get_rag_service() -> RAGService:
+    """
+    Get the RAG service, creating it and its vector store on first use.
+
+    :return: The RAG service
+    """
+    global vector_store, local_vector_store, lexical_index, rag_service
+    if rag_service is None:
+        store = create_vector_store(collection_name=ASTRA_COLLECTION_NAME)
+        if isinstance(store, LocalVectorStore):
+            local_vector_store = store
+        store = AdmissionControlledVectorStore(store, create_vector_store_admission())
+        if VECTOR_CACHE_SIZE > 0:
+            store = CachedVectorStore(store)
+        vector_store = store
+        lexical_index = load_lexical_index()
+        rag_service = RAGService(vector_store, lexical_index=lexical_index)
+    return rag_service
+
+
+# The exported flow run by the "flow" chat backend, compiled on startup
+flow_executor: Optional[FlowExecutor] = None
+
+
+def get_flow_executor() -> FlowExecutor:
+    """
+    Get the executor of the exported flow, loading it on first use.
+
+    :return: The flow executor
+    """
+    global flow_executor
+    if flow_executor is None:
+        flow_executor = load_flow_executor()
+    return flow_executor
+
+
+# Record of the chunks uploaded through /api/ingest, shared with the ingestion CLI
+ingestion_manifest = IngestionManifest() if INGEST_API_ENABLED else None
+
+
+@app.middleware("http")
+async def session_middleware(request: Request, call_next):
+    """Assign each browser a session ID cookie that keys its chat history."""
+    session_id = request.cookies.get(SESSION_COOKIE_NAME)
+    is_new_session = not session_id
+    if is_new_session:
+        session_id = uuid.uuid4().hex
+    request.state.session_id = session_id
+
+    response = await call_next(request)
+
+    if is_new_session:
+        response.set_cookie(
+            SESSION_COOKIE_NAME, session_id, httponly=True, samesite="lax"
+        )
+    return response
 
-# Get the absolute path to the project root
-project_root = os.path.dirname(os.path.abspath(__file__))
 
-# Initialize RAG service with ChromaDBStore
-chroma_db_path = os.path.join(project_root, "db")
-vector_store = AstraDBStore(collection_name=ASTRA_COLLECTION_NAME)
-rag_service = RAGService(vector_store)
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Time each request and report its pipeline stages in a Server-Timing header."""
+    # Label by route template, so path parameters don't create new series
+    route = "unmatched"
+    for candidate in app.router.routes:
+        if candidate.matches(request.scope)[0] == Match.FULL:
+            route = getattr(candidate, "path", route)
+            break
+
+    timer = RequestTimer()
+    token = current_request_timer.set(timer)
+    REQUESTS_IN_FLIGHT.inc(route=route)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        REQUESTS_IN_FLIGHT.dec(route=route)
+        REQUEST_DURATION.observe(time.perf_counter() - start, route=route)
+        current_request_timer.reset(token)
+
+    if timer.stages:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError) -> Response:
+    """Answer calls rejected by admission control with a 503 and a Retry-After."""
+    headers = {"Retry-After": str(exc.retry_after)}
+    if request.headers.get("HX-Request"):
+        # Shown in the chat like a bot message
+        return templates.TemplateResponse(
+            "bot_message.html",
+            {
+                "request": request,
+                "bot_response_html": render_markdown(str(exc)),
+                "citations": [],
+                "message_id": str(uuid.uuid4()),
+            },
+            status_code=503,
+            headers=headers,
+        )
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers=headers)
+
+
+def get_session_id(request: Request) -> str:
+    return request.state.session_id
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -61,51 +299,443 @@ async def read_root(request: Request) -> HTMLResponse:
             "request": request,
             "chat_title": CHAT_TITLE,
             "welcome_message": WELCOME_MESSAGE,
+            "chat_endpoint": "/chat/stream" if STREAM_RESPONSES else "/chat",
         },
     )
 
 
-@app.post("/chat")
-async def chat(request: Request, message: str = Form(...)) -> HTMLResponse:
-    # Prepare messages with the correct order
-    prepared_messages, citations = await rag_service.prepare_messages_with_sources(
-        system_prompt=f"<system-prompt>{SYSTEM_PROMPT}</system-prompt>",
-        chat_history=chat_history[-5:],  # Last 5 messages for context
+def chat_system_prompt() -> str:
+    """The system prompt of chat responses, before any retrieved context."""
+    return f"<system-prompt>{SYSTEM_PROMPT}</system-prompt>"
+
+
+async def prepare_chat_messages(
+    session_id: str,
+    message: str,
+) -> Tuple[List[Message], List[RagCitation]]:
+    """
+    Prepare the prompt for a user message from retrieved context and recent history.
+
+    :param session_id: The chat session ID
+    :param message: The user's message
+    :return: The prepared messages and the citations for the retrieved context
+    """
+    # The RAG service trims the history to fit the prompt's token budget, after the
+    # summary of the earlier conversation
+    chat_history, summary = await asyncio.gather(
+        chat_history_store.get_messages(session_id),
+        chat_history_store.get_summary(session_id),
+    )
+    return await get_rag_service().prepare_messages_with_sources(
+        system_prompt=chat_system_prompt(),
+        chat_history=chat_history,
         user_message=message,
+        summary=summary,
+    )
+
+
+def route_chat(
+    prepared_messages: List[Message], citations: List[RagCitation]
+) -> Optional[Route]:
+    """
+    Pick the model route of a prepared prompt, if model routing is enabled.
+
+    :param prepared_messages: The prepared messages
+    :param citations: The citations of the retrieved context
+    :return: The route, or None to use the default model
+    """
+    return select_route(
+        prepared_messages,
+        [citation.score for citation in citations if citation.score is not None],
+    )
+
+
+async def record_exchange(session_id: str, message: str, bot_response: str) -> None:
+    """
+    Add a user message and the bot response to the chat history.
+
+    :param session_id: The chat session ID
+    :param message: The user's message
+    :param bot_response: The bot's response
+    """
+    await chat_history_store.add_messages(
+        session_id,
+        [
+            Message(role=MessageRole.user, content=message),
+            Message(role=MessageRole.assistant, content=bot_response),
+        ],
+    )
+
+
+# CommonMark renderer with tables, compiled once; raw HTML is escaped
+markdown_renderer = MarkdownIt("commonmark", {"html": False}).enable(
+    ["table", "strikethrough"]
+)
+
+
+async def summarize_history(session_id: str) -> None:
+    """
+    Fold the older messages of a long chat history into the session's summary.
+
+    Runs as a background task once the response has been sent.
+
+    :param session_id: The chat session ID
+    """
+    # A session is summarized by one task at a time, and only the "openai" backend
+    # prompts with the summary
+    if session_id in summarizing_sessions or CHAT_BACKEND != "openai":
+        return
+    summarizing_sessions.add(session_id)
+    try:
+        chat_history, summary = await asyncio.gather(
+            chat_history_store.get_messages(session_id),
+            chat_history_store.get_summary(session_id),
+        )
+        result = await get_rag_service().update_summary(summary, chat_history)
+        if result is not None:
+            new_summary, count = result
+            # Dropped if another worker summarized the history in the meantime
+            await chat_history_store.summarize(
+                session_id, new_summary, chat_history[count - 1].id
+            )
+    except Exception as e:
+        # The history is summarized after a later response instead
+        logger.error(f"Error summarizing chat history: {str(e)}")
+    finally:
+        summarizing_sessions.discard(session_id)
+
+
+def render_markdown(text: str) -> str:
+    """
+    Render Markdown to HTML, escaping any raw HTML in it.
+
+    :param text: The Markdown text
+    :return: The rendered HTML
+    """
+    with timed_stage("markdown"):
+        return markdown_renderer.render(text)
+
+
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def render_citation(source: str, content: str) -> str:
+    """
+    Render the list item of a citation.
+
+    Popular documents are cited by many responses, so their snippets are memoized.
+
+    :param source: The source of the cited document
+    :param content: The cited content
+    :return: The rendered HTML
+    """
+    return templates.get_template("citation.html").render(
+        source=source, content=content
+    )
+
+
+async def remember_citations(message_id: str, citations: List[RagCitation]) -> None:
+    """
+    Keep the citations of a message until its sources are expanded.
+
+    :param message_id: The ID of the message in the page
+    :param citations: The citations of the message
+    """
+    await recent_citations.set(
+        message_id, json.dumps([citation.model_dump() for citation in citations])
     )
 
-    # Get response from ChatGPT using prepared messages
-    bot_response = await get_chat_response_with_history(prepared_messages)
+
+@app.post("/chat")
+async def chat(
+    request: Request, background_tasks: BackgroundTasks, message: str = Form(...)
+) -> HTMLResponse:
+    session_id = get_session_id(request)
+
+    if CHAT_BACKEND == "langflow":
+        # The flow remembers the session's history, and cites no documents
+        bot_response = await get_langflow_response(message, session_id)
+        citations = []
+    elif CHAT_BACKEND == "flow":
+        # The flow's memory is the session's chat history
+        chat_history = await chat_history_store.get_messages(session_id)
+        bot_response = await get_flow_executor().run(message, chat_history)
+        citations = []
+    else:
+        # Prepare messages with the correct order
+        prepared_messages, citations = await prepare_chat_messages(session_id, message)
+
+        # Get response from ChatGPT using prepared messages
+        bot_response = await get_chat_response_with_history(
+            prepared_messages, route=route_chat(prepared_messages, citations)
+        )
 
     # Render Markdown to HTML (with safety features)
-    bot_response_html = markdown2.markdown(bot_response, safe_mode="escape")
+    bot_response_html = render_markdown(bot_response)
 
     # Add user message and bot response to chat history
-    chat_history.append(Message(role=MessageRole.user, content=message))
-    chat_history.append(Message(role=MessageRole.assistant, content=bot_response))
+    await record_exchange(session_id, message, bot_response)
+    background_tasks.add_task(summarize_history, session_id)
 
     message_id = str(uuid.uuid4())
+    await remember_citations(message_id, citations)
+
+    with timed_stage("template"):
+        response_html = templates.TemplateResponse(
+            "bot_message.html",
+            {
+                "request": request,
+                "bot_response_html": bot_response_html,
+                "citations": citations,
+                "message_id": message_id,
+            },
+        )
+
+    return response_html
+
+
+def format_sse(event: str, data: str) -> str:
+    """
+    Format a server-sent event, splitting multi-line data across several data fields.
+
+    :param event: The event name
+    :param data: The event payload
+    :return: The encoded event, terminated by a blank line
+    """
+    data_lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{data_lines}\n"
+
+
+async def stream_bot_response(
+    session_id: str, message: str, message_id: str
+) -> AsyncIterator[str]:
+    """
+    Generate the server-sent events for a streamed bot response.
+
+    Emits a "chunk" event with the Markdown rendered so far as the response
+    grows, then a "citations" event with the sources block and a final "done" event.
+
+    :param session_id: The chat session ID
+    :param message: The user's message
+    :param message_id: The ID of the placeholder message in the page
+    :return: An async iterator of encoded server-sent events
+    """
+    if CHAT_BACKEND == "langflow":
+        citations: List[RagCitation] = []
+        deltas = stream_langflow_response(message, session_id)
+    elif CHAT_BACKEND == "flow":
+        citations = []
+        chat_history = await chat_history_store.get_messages(session_id)
+        deltas = get_flow_executor().stream(message, chat_history)
+    else:
+        try:
+            prepared_messages, citations = await prepare_chat_messages(
+                session_id, message
+            )
+        except Exception as e:
+            logger.error(f"Error preparing messages: {str(e)}")
+            error_message = f"I'm sorry, but I encountered an error: {str(e)}"
+            yield format_sse("chunk", render_markdown(error_message))
+            yield format_sse("done", "")
+            return
+        deltas = stream_chat_response_with_history(
+            prepared_messages, route=route_chat(prepared_messages, citations)
+        )
+
+    # Re-render the accumulated Markdown at most once per render interval,
+    # so long responses don't cost a full render for every token
+    bot_response = ""
+    last_render = 0.0
+    rendered_length = 0
+    async for delta in deltas:
+        bot_response += delta
+        now = time.monotonic()
+        if now - last_render >= STREAM_RENDER_INTERVAL:
+            last_render = now
+            rendered_length = len(bot_response)
+            yield format_sse("chunk", render_markdown(bot_response))
+
+    if rendered_length != len(bot_response):
+        yield format_sse("chunk", render_markdown(bot_response))
+
+    await record_exchange(session_id, message, bot_response)
+
+    await remember_citations(message_id, citations)
+    citations_html = templates.get_template("citations.html").render(
+        citations=citations, message_id=message_id
+    )
+    yield format_sse("citations", citations_html)
+    yield format_sse("done", "")
+
+
+@app.post("/chat/stream")
+async def chat_stream_start(request: Request, message: str = Form(...)) -> HTMLResponse:
+    """
+    Accept a user message and return a placeholder that streams the bot response.
+
+    The placeholder connects to /chat/stream/{message_id}, which produces the response.
+    """
+    message_id = str(uuid.uuid4())
+
+    await pending_streams.set(
+        message_id, json.dumps([get_session_id(request), message])
+    )
 
-    response_html = templates.TemplateResponse(
-        "bot_message.html",
+    return templates.TemplateResponse(
+        "bot_message_stream.html",
         {
             "request": request,
-            "bot_response_html": bot_response_html,
-            "citations": citations,
             "message_id": message_id,
         },
     )
 
-    return response_html
+
+@app.get("/chat/stream/{message_id}")
+async def chat_stream(message_id: str) -> StreamingResponse:
+    """
+    Stream the bot response for a message accepted by /chat/stream.
+
+    Each message can be streamed once; unknown or already streamed IDs return 404.
+    """
+    pending_stream = await pending_streams.pop(message_id)
+    if pending_stream is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired stream")
+    session_id, message = json.loads(pending_stream)
+
+    return StreamingResponse(
+        stream_bot_response(session_id, message, message_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(summarize_history, session_id),
+    )
+
+
+@app.get("/citations/{message_id}", response_class=HTMLResponse)
+async def get_citations(message_id: str) -> HTMLResponse:
+    """
+    Render the citations of a message, when its sources are expanded.
+
+    Citations are kept for the last MAX_STORED_CITATIONS messages.
+    """
+    citations = await recent_citations.get(message_id)
+    if citations is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired citations")
+    return HTMLResponse(
+        "".join(
+            render_citation(citation["source"], citation["content"])
+            for citation in json.loads(citations)
+        )
+    )
+
+
+@app.get("/healthz")
+async def healthz() -> Dict[str, str]:
+    """Liveness probe: the worker is running."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz() -> JSONResponse:
+    """Readiness probe: the worker has started and can answer chat requests."""
+    checks = {
+        "startup": "ok" if getattr(app.state, "ready", False) else "pending",
+        "vector_store": "ok" if rag_service is not None else "pending",
+    }
+    try:
+        chat_gpt_client.get_client()
+        checks["openai"] = "ok"
+    except ValueError as e:
+        checks["openai"] = str(e)
+
+    ready = all(check == "ok" for check in checks.values())
+    return JSONResponse(
+        {"status": "ok" if ready else "unavailable", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.get("/api/chat_history")
-async def get_chat_history() -> List[Dict[str, str]]:
+async def get_chat_history(request: Request) -> List[Dict[str, str]]:
+    chat_history = await chat_history_store.get_messages(get_session_id(request))
     return [message.model_dump() for message in chat_history]
 
 
+@app.post("/api/ingest")
+async def ingest(files: List[UploadFile] = File(...)) -> Dict[str, int]:
+    """
+    Chunk uploaded documents and add the new chunks to the vector store.
+
+    Only available if INGEST_API_ENABLED is set.
+    """
+    if ingestion_manifest is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    get_rag_service()
+    # The local store skips the chunks it has itself, and isn't saved until the
+    # upload is ingested, so the manifest could list chunks that were never saved
+    manifest = ingestion_manifest if local_vector_store is None else None
+    stats = IngestionStats()
+    for file in files:
+        try:
+            # Reading and chunking is blocking work, notably for PDFs
+            chunks = await asyncio.to_thread(
+                lambda: list(iter_chunks(file.filename, file.file))
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stats.files += 1
+        await ingest_chunks(
+            vector_store,
+            chunks,
+            manifest,
+            namespace=f"{VECTOR_STORE}:{VECTOR_STORE_PATH}:{ASTRA_COLLECTION_NAME}",
+            stats=stats,
+        )
+        if lexical_index is not None:
+            lexical_index.add(chunks)
+    if local_vector_store is not None:
+        await asyncio.to_thread(local_vector_store.save)
+    if lexical_index is not None:
+        await asyncio.to_thread(lexical_index.save)
+    return stats.model_dump()
+
+
+@app.post("/api/batch_chat")
+async def batch_chat(request: Request) -> StreamingResponse:
+    """
+    Answer an NDJSON stream of questions, streaming NDJSON answers as they finish.
+
+    Each line of the body is a {"message": ..., "id": ...} object, answered with
+    retrieved context but without chat history. Only available if
+    BATCH_CHAT_API_ENABLED is set.
+    """
+    if not BATCH_CHAT_API_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    # The body is read before responding, since a streaming response listens for
+    # the client disconnecting, which would take the body's messages
+    lines = [line async for line in iter_lines(request.stream())]
+
+    async def questions() -> AsyncIterator[str]:
+        for line in lines:
+            yield line
+
+    async def answer_lines() -> AsyncIterator[str]:
+        async for answer in run_batch_chat(
+            get_rag_service(), questions(), chat_system_prompt()
+        ):
+            yield answer.model_dump_json() + "\n"
+
+    return StreamingResponse(answer_lines(), media_type="application/x-ndjson")
+
+
 # Optional: Add a route to clear chat history (for testing/demo purposes)
 @app.post("/api/clear_history")
-async def clear_history() -> Dict[str, str]:
-    chat_history.clear()
+async def clear_history(request: Request) -> Dict[str, str]:
+    await chat_history_store.clear(get_session_id(request))
     return {"message": "Chat history cleared"}
@@ -0,0 +1,291 @@
+import bisect
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from opentelemetry import trace
+
+    tracer = trace.get_tracer(__name__)
+except ImportError:  # pragma: no cover - OpenTelemetry is optional
+    tracer = None
+
+# Histogram buckets in seconds, from fast cache hits to slow completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """Base class of metrics rendered in the Prometheus text exposition format."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._label_values(labels)] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: (count per bucket, with +Inf last; sum of observations)
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        counts, total = self.values.setdefault(
+            key, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _samples(self) -> List[str]:
+        samples = []
+        bucket_labelnames = (*self.labelnames, "le")
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(bucket_labelnames, (*key, le))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    "chat_request_duration_seconds",
+    "Time to produce the response headers of a request.",
+    ["route"],
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "chat_requests_in_flight", "Requests currently being handled.", ["route"]
+)
+STAGE_DURATION = registry.histogram(
+    "chat_stage_duration_seconds",
+    "Time spent in each stage of the chat pipeline.",
+    ["stage"],
+)
+LLM_TOKENS = registry.counter(
+    "chat_llm_tokens_total",
+    "Prompt and completion tokens reported by the LLM.",
+    ["model", "type"],
+)
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "chat_single_flight_calls_total",
+    "Calls that started an upstream call (leader) or joined one in flight (follower).",
+    ["name", "role"],
+)
+ADMISSION_QUEUE_DEPTH = registry.gauge(
+    "chat_admission_queue_depth",
+    "Calls waiting to be admitted to an upstream service.",
+    ["name"],
+)
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "chat_admission_in_flight", "Admitted calls to an upstream service.", ["name"]
+)
+ADMISSION_REJECTIONS = registry.counter(
+    "chat_admission_rejections_total",
+    "Calls rejected because an upstream service was at capacity.",
+    ["name", "reason"],
+)
+
+ROUTE_REQUESTS = registry.counter(
+    "chat_route_requests_total",
+    "Calls to each model of a route, by whether it answered, was slow or overloaded "
+    "and fell back to the next model, or failed.",
+    ["route", "model", "outcome"],
+)
+ROUTE_DURATION = registry.histogram(
+    "chat_route_duration_seconds",
+    "Time for each model of a route to answer, or to fail.",
+    ["route", "model"],
+)
+ROUTE_COST = registry.counter(
+    "chat_route_cost_dollars_total",
+    "Estimated cost of the calls to each model of a route, in US dollars.",
+    ["route", "model"],
+)
+
+
+class RequestTimer:
+    """Collects the stage timings of one request for its Server-Timing header."""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{stage};dur={duration * 1000:.1f}" for stage, duration in self.stages
+        )
+
+
+current_request_timer: ContextVar[Optional[RequestTimer]] = ContextVar(
+    "current_request_timer", default=None
+)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """
+    Time a stage of the chat pipeline.
+
+    The duration is recorded in the stage histogram and the current request's
+    Server-Timing header, and the stage is traced as an OpenTelemetry span when
+    OpenTelemetry is installed and configured.
+
+    :param stage: The stage name
+    """
+    with ExitStack() as stack:
+        if tracer is not None:
+            stack.enter_context(tracer.start_as_current_span(stage))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record_stage(stage, time.perf_counter() - start)
+
+
+def record_stage(stage: str, duration: float) -> None:
+    """
+    Record the duration of a stage that was timed separately.
+
+    :param stage: The stage name
+    :param duration: The duration in seconds
+    """
+    STAGE_DURATION.observe(duration, stage=stage)
+    timer = current_request_timer.get()
+    if timer is not None:
+        timer.stages.append((stage, duration))
+
+
+def record_token_usage(model: str, usage) -> None:
+    """
+    Count the tokens of an LLM call from the usage reported in its response.
+
+    :param model: The model name
+    :param usage: The response's usage object, if any
+    """
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens, model=model, type="prompt")
+    LLM_TOKENS.inc(usage.completion_tokens, model=model, type="completion")
+
+
+def record_route_call(
+    route: str, model: str, outcome: str, duration: float, cost: float = 0.0
+) -> None:
+    """
+    Record a call to a model of a route.
+
+    :param route: The route name
+    :param model: The model name
+    :param outcome: "ok", "fallback" if the next model was tried, or "error"
+    :param duration: The duration in seconds
+    :param cost: The estimated cost in US dollars
+    """
+    ROUTE_REQUESTS.inc(route=route, model=model, outcome=outcome)
+    ROUTE_DURATION.observe(duration, route=route, model=model)
+    if cost:
+        ROUTE_COST.inc(cost, route=route, model=model)
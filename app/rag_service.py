@@ -1,59 +1,365 @@
-from typing import List, Tuple
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple, Union
 
-from app.vector_store import VectorStore
-from app.chat_gpt_client import Message, MessageRole
+from dotenv import load_dotenv
+
+from app.vector_store import (
+    VectorStore,
+    VectorStoreResult,
+    merge_results,
+    reciprocal_rank_fusion,
+)
+from app.chat_gpt_client import Message, summarize_conversation
+from app.context_builder import TOKENS_PER_MESSAGE, ContextBuilder, PreparedPrompt
+from app.lexical_index import BM25Index
+from app.metrics import timed_stage
 from app.models import RagCitation
+from app.reranking import (
+    MMR_LAMBDA,
+    RERANK_FETCH_MULTIPLIER,
+    RERANK_MIN_SCORE,
+    Reranker,
+    diversify,
+    filter_by_score,
+)
+from app.single_flight import SINGLE_FLIGHT_ENABLED, SingleFlight
+
+# Load environment variables
+load_dotenv()
+
+# Seconds to wait for each vector store before continuing without its results
+RAG_STORE_TIMEOUT = float(os.getenv("RAG_STORE_TIMEOUT", "5"))
+# Damping constant of reciprocal rank fusion, higher values flatten the top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Chat history tokens beyond which the older messages are summarized (0 disables)
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "2000"))
+# Number of the most recent messages that are never summarized
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "4"))
+
+# Async function that extends a conversation's summary (or None) with older messages
+Summarizer = Callable[[Optional[str], List[Message]], Awaitable[str]]
+
+logger = logging.getLogger(__name__)
 
 
 class RAGService:
-    def __init__(self, vector_store: VectorStore):
-        self.vector_store = vector_store
+    def __init__(
+        self,
+        vector_store: Union[VectorStore, Sequence[VectorStore]],
+        context_builder: Optional[ContextBuilder] = None,
+        store_timeout: Optional[float] = RAG_STORE_TIMEOUT,
+        lexical_index: Optional[BM25Index] = None,
+        rrf_k: int = RRF_K,
+        single_flight: bool = SINGLE_FLIGHT_ENABLED,
+        summarizer: Summarizer = summarize_conversation,
+        summary_trigger_tokens: int = SUMMARY_TRIGGER_TOKENS,
+        summary_keep_messages: int = SUMMARY_KEEP_MESSAGES,
+        fetch_multiplier: int = RERANK_FETCH_MULTIPLIER,
+        min_score: float = RERANK_MIN_SCORE,
+        mmr_lambda: float = MMR_LAMBDA,
+        reranker: Optional[Reranker] = None,
+    ):
+        if isinstance(vector_store, VectorStore):
+            self.vector_stores = [vector_store]
+        else:
+            self.vector_stores = list(vector_store)
+        self.context_builder = context_builder or ContextBuilder()
+        self.store_timeout = store_timeout
+        self.lexical_index = lexical_index
+        self.rrf_k = rrf_k
+        # Retrievals in flight, shared by identical concurrent queries
+        self._retrievals: Optional[SingleFlight[List[VectorStoreResult]]] = (
+            SingleFlight("retrieval") if single_flight else None
+        )
+        self.summarizer = summarizer
+        self.summary_trigger_tokens = summary_trigger_tokens
+        self.summary_keep_messages = summary_keep_messages
+        self.fetch_multiplier = max(fetch_multiplier, 1)
+        self.min_score = min_score
+        self.mmr_lambda = mmr_lambda
+        self.reranker = reranker
+
+    async def retrieve(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        """
+        Query all vector stores concurrently and merge their results.
+
+        With a lexical index, it is searched concurrently with the vector stores, and
+        its ranking is fused with theirs by reciprocal rank fusion.
+
+        Each store is asked for fetch_multiplier times top_k candidates. Vector store
+        results scoring below min_score are dropped, and the rest are reranked and
+        diversified down to top_k.
+
+        Stores that don't answer within the store timeout, or that fail, are skipped so
+        that the results which did arrive are still used. Only if every store failed is
+        the error raised.
+
+        Identical queries made while one is in flight share its results.
+
+        :param query: The query string
+        :param top_k: Number of top results to return
+        :return: The best unique results across all stores
+        """
+        if self._retrievals is None:
+            return await self._retrieve(query, top_k)
+        results = await self._retrievals.do(
+            (query, top_k), lambda: self._retrieve(query, top_k)
+        )
+        # Each caller gets its own list, since they share the results
+        return list(results)
+
+    async def retrieve_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        """
+        Retrieve the results of several queries, with a single call to each store.
+
+        Stores that support it answer the whole batch at once, such as by embedding
+        all the queries in one request. The results of each query are then merged,
+        fused and reranked as by retrieve.
+
+        :param queries: The query strings
+        :param top_k: Number of top results to return per query
+        :return: The best unique results of each query
+        """
+        if not queries:
+            return []
+        return await self._retrieve_batch(queries, top_k)
+
+    async def _retrieve(self, query: str, top_k: int) -> List[VectorStoreResult]:
+        return (await self._retrieve_batch([query], top_k))[0]
+
+    async def _retrieve_batch(
+        self, queries: List[str], top_k: int
+    ) -> List[List[VectorStoreResult]]:
+        stores = list(self.vector_stores)
+        if self.lexical_index is not None:
+            stores.append(self.lexical_index)
+        fetch_k = top_k * self.fetch_multiplier
+
+        async def query_store(store: VectorStore) -> List[List[VectorStoreResult]]:
+            if len(queries) == 1:
+                return [await store.query(queries[0], fetch_k)]
+            return await store.query_batch(queries, fetch_k)
+
+        tasks = [asyncio.ensure_future(query_store(store)) for store in stores]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.store_timeout)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        results: List[List[VectorStoreResult]] = [[] for _ in queries]
+        lexical_results: List[List[VectorStoreResult]] = [[] for _ in queries]
+        errors = []
+        for store, task in zip(stores, tasks):
+            if task in pending:
+                logger.warning(
+                    f"{type(store).__name__} timed out after {self.store_timeout}s"
+                )
+            elif task.exception() is not None:
+                logger.error(f"{type(store).__name__} query failed: {task.exception()}")
+                errors.append(task.exception())
+            elif store is self.lexical_index:
+                lexical_results = task.result()
+            else:
+                for query_results, store_results in zip(results, task.result()):
+                    query_results.extend(store_results)
+
+        if errors and len(errors) == len(tasks):
+            raise errors[0]
+        return list(
+            await asyncio.gather(
+                *(
+                    self._select(query, query_results, query_lexical_results, top_k)
+                    for query, query_results, query_lexical_results in zip(
+                        queries, results, lexical_results
+                    )
+                )
+            )
+        )
+
+    async def _select(
+        self,
+        query: str,
+        results: List[VectorStoreResult],
+        lexical_results: List[VectorStoreResult],
+        top_k: int,
+    ) -> List[VectorStoreResult]:
+        """Narrow the results of a query from all stores down to the top_k best."""
+        fetch_k = top_k * self.fetch_multiplier
+        candidates = merge_results(results, fetch_k)
+        if self.min_score > 0:
+            candidates = filter_by_score(candidates, self.min_score)
+        if self.lexical_index is not None:
+            candidates = reciprocal_rank_fusion(
+                [candidates, lexical_results], fetch_k, k=self.rrf_k
+            )
+        return await self.rerank(query, candidates, top_k)
+
+    async def rerank(
+        self, query: str, candidates: List[VectorStoreResult], top_k: int
+    ) -> List[VectorStoreResult]:
+        """
+        Narrow the retrieved candidates down to the most relevant, diverse results.
+
+        The reranker, if any, reorders the candidates first. Maximal marginal
+        relevance then skips near duplicates of the results already selected, so the
+        prompt gets fewer but more informative chunks.
+
+        :param query: The query string
+        :param candidates: The retrieved candidates, best first
+        :param top_k: Maximum number of results to return
+        :return: The selected results, best first
+        """
+        with timed_stage("rerank"):
+            if self.reranker is not None and candidates:
+                candidates = await self.reranker(query, candidates)
+            return diversify(candidates, top_k, self.mmr_lambda)
 
     async def get_relevant_context(
         self,
         query: str,
         top_k: int = 5,
     ) -> Tuple[str, List[RagCitation]]:
-        results = await self.vector_store.query(query, top_k)
+        results = await self.retrieve(query, top_k)
         context = "\n".join([result.content for result in results])
         citations = [
-            RagCitation(source=result.metadata.source, content=result.content)
+            RagCitation(
+                source=result.metadata.source,
+                content=result.content,
+                score=result.metadata.score,
+            )
             for result in results
         ]
         return context, citations
 
+    async def prepare_prompt(
+        self,
+        system_prompt: str,
+        chat_history: List[Message],
+        user_message: str,
+        top_k: int = 5,
+        summary: Optional[str] = None,
+    ) -> PreparedPrompt:
+        """
+        Retrieve context for a user message and assemble a prompt within the token budget.
+
+        :param system_prompt: The system prompt
+        :param chat_history: The chat history, oldest first
+        :param user_message: The user's message
+        :param top_k: Number of documents to retrieve
+        :param summary: Summary of the conversation before the chat history, if any
+        :return: The prepared prompt with its citations and token count
+        """
+        if summary:
+            system_prompt = (
+                f"{system_prompt}\n\nSummary of the earlier conversation: {summary}"
+            )
+        with timed_stage("retrieval"):
+            results = await self.retrieve(user_message, top_k)
+        with timed_stage("prompt_assembly"):
+            prompt = self.context_builder.build(
+                system_prompt=system_prompt,
+                results=results,
+                chat_history=chat_history,
+                user_message=user_message,
+            )
+        logger.info(
+            f"Prepared prompt with {prompt.prompt_tokens} tokens, "
+            f"{len(prompt.citations)}/{len(results)} documents and "
+            f"{len(prompt.messages) - 2}/{len(chat_history)} history messages"
+        )
+        return prompt
+
+    async def prepare_prompts(
+        self, system_prompt: str, user_messages: List[str], top_k: int = 5
+    ) -> List[PreparedPrompt]:
+        """
+        Prepare the prompts of several independent questions, without chat history.
+
+        The context of all the questions is retrieved in one batch.
+
+        :param system_prompt: The system prompt
+        :param user_messages: The questions
+        :param top_k: Number of documents to retrieve per question
+        :return: The prepared prompt of each question
+        """
+        with timed_stage("retrieval"):
+            batch_results = await self.retrieve_batch(user_messages, top_k)
+        with timed_stage("prompt_assembly"):
+            return [
+                self.context_builder.build(
+                    system_prompt=system_prompt,
+                    results=results,
+                    chat_history=[],
+                    user_message=user_message,
+                )
+                for user_message, results in zip(user_messages, batch_results)
+            ]
+
     async def prepare_messages_with_sources(
         self,
         system_prompt: str,
         chat_history: List[Message],
         user_message: str,
+        summary: Optional[str] = None,
     ) -> Tuple[List[Message], List[RagCitation]]:
-        context, citations = await self.get_relevant_context(user_message)
-
-        prepared_messages = [
-            Message(
-                role=MessageRole.system,
-                content=f"{system_prompt}\n\nRelevant context: {context}",
-            ),
-            *chat_history,
-            Message(role=MessageRole.user, content=user_message),
-        ]
+        prompt = await self.prepare_prompt(
+            system_prompt, chat_history, user_message, summary=summary
+        )
+        return prompt.messages, prompt.citations
+
+    def count_messages_to_summarize(self, chat_history: Sequence[Message]) -> int:
+        """
+        Count the oldest messages to fold into the summary of a conversation.
+
+        Once the history exceeds the summary trigger, all but the most recent messages
+        are summarized. Whole exchanges are summarized, so the kept history starts with
+        a user message.
 
-        return prepared_messages, citations
+        :param chat_history: The chat history, oldest first
+        :return: The number of messages to summarize, 0 if the history is short enough
+        """
+        if self.summary_trigger_tokens <= 0:
+            return 0
+        tokens = sum(
+            self.context_builder.count_tokens(message.content) + TOKENS_PER_MESSAGE
+            for message in chat_history
+        )
+        if tokens <= self.summary_trigger_tokens:
+            return 0
+        count = max(len(chat_history) - self.summary_keep_messages, 0)
+        return count - count % 2
+
+    async def update_summary(
+        self, summary: Optional[str], chat_history: List[Message]
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Fold the older messages of a long chat history into its rolling summary.
+
+        Meant to run in the background after a response was sent, so that prompts
+        stay within a roughly constant size without losing the earlier conversation.
+
+        :param summary: The current summary of the conversation, if any
+        :param chat_history: The chat history since the summary, oldest first
+        :return: The new summary and the number of messages it replaces, or None if
+            the history is short enough
+        """
+        count = self.count_messages_to_summarize(chat_history)
+        if count == 0:
+            return None
+        with timed_stage("summary"):
+            new_summary = await self.summarizer(summary, chat_history[:count])
+        logger.info(f"Summarized {count}/{len(chat_history)} history messages")
+        return new_summary, count
 
     # Keep the original prepare_messages method for backwards compatibility
     async def prepare_messages(
         self, system_prompt: str, chat_history: List[Message], user_message: str
     ) -> List[Message]:
-        context, _ = await self.get_relevant_context(user_message)
-
-        prepared_messages = [
-            Message(
-                role=MessageRole.system,
-                content=f"{system_prompt}\n\nRelevant context: {context}",
-            ),
-            *chat_history,
-            Message(role=MessageRole.user, content=user_message),
-        ]
-
-        return prepared_messages
+        prompt = await self.prepare_prompt(system_prompt, chat_history, user_message)
+        return prompt.messages
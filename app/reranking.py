@@ -0,0 +1,121 @@
+import os
+from typing import Awaitable, Callable, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.lexical_index import tokenize
+from app.vector_store import VectorStoreResult
+
+# Load environment variables
+load_dotenv()
+
+# Candidates retrieved for each result returned, so there are some left to choose
+# from once low-scoring and redundant chunks are dropped
+RERANK_FETCH_MULTIPLIER = int(os.getenv("RERANK_FETCH_MULTIPLIER", "3"))
+# Vector store results scoring below this similarity are dropped (0 keeps all)
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0"))
+# Trade-off of maximal marginal relevance between relevance (1) and diversity (0)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+# Async function that reorders the candidates of a query, best first, and may
+# rescore or drop some of them, such as a cross-encoder
+Reranker = Callable[[str, List[VectorStoreResult]], Awaitable[List[VectorStoreResult]]]
+
+
+def filter_by_score(
+    results: List[VectorStoreResult], min_score: float
+) -> List[VectorStoreResult]:
+    """
+    Drop the results whose score is below a threshold.
+
+    :param results: The results
+    :param min_score: The lowest score kept
+    :return: The remaining results, in order
+    """
+    return [result for result in results if result.metadata.score >= min_score]
+
+
+def term_vectors(texts: List[str]) -> np.ndarray:
+    """
+    Represent texts as normalized term count vectors over their shared vocabulary.
+
+    The cosine similarity of two texts is the dot product of their vectors, so near
+    duplicates, such as overlapping chunks of one document, score close to 1.
+
+    :param texts: The texts
+    :return: A float32 matrix with one unit-length row per text
+    """
+    vocabulary = {}
+    rows, columns = [], []
+    for row, text in enumerate(texts):
+        for term in tokenize(text):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+
+    vectors = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float32)
+    np.add.at(vectors, (rows, columns), 1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def maximal_marginal_relevance(
+    relevance: np.ndarray, similarity: np.ndarray, top_k: int, lambda_: float
+) -> List[int]:
+    """
+    Select relevant results that are not redundant with each other.
+
+    Each step selects the candidate maximizing lambda_ * relevance - (1 - lambda_) *
+    its highest similarity to the candidates already selected.
+
+    :param relevance: Relevance of each candidate
+    :param similarity: Pairwise similarity matrix of the candidates
+    :param top_k: Maximum number of candidates to select
+    :param lambda_: Weight of relevance against diversity, between 0 and 1
+    :return: Indices of the selected candidates, in order of selection
+    """
+    count = len(relevance)
+    available = np.ones(count, dtype=bool)
+    # Highest similarity of each candidate to those selected so far
+    redundancy = np.zeros(count, dtype=np.float32)
+    selected: List[int] = []
+    for _ in range(min(top_k, count)):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+def diversify(
+    results: List[VectorStoreResult], top_k: int, lambda_: float = MMR_LAMBDA
+) -> List[VectorStoreResult]:
+    """
+    Pick diverse results by maximal marginal relevance.
+
+    Scores are rescaled to at most 1 as the relevance, since stores and rankings score
+    on different scales, and the similarity of the results is that of their term
+    vectors.
+
+    :param results: Candidate results, best first
+    :param top_k: Maximum number of results to return
+    :param lambda_: Weight of relevance against diversity, 1 keeps the order
+    :return: The selected results, in order of selection
+    """
+    if len(results) <= 1 or lambda_ >= 1:
+        return results[:top_k]
+    scores = np.array([result.metadata.score for result in results], dtype=np.float32)
+    if scores.min() >= 0 and scores.max() > 0:
+        relevance = scores / scores.max()
+    else:
+        # Scores such as logits can be negative, so they are rescaled to [0, 1]
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread else np.ones_like(scores)
+    vectors = term_vectors([result.content for result in results])
+    selected = maximal_marginal_relevance(
+        relevance, vectors @ vectors.T, top_k, lambda_
+    )
+    return [results[index] for index in selected]
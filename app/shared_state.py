@@ -0,0 +1,191 @@
+import asyncio
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# "memory" keeps short-lived request state per worker process, "sqlite" shares it
+# between workers, so a follow-up request can be served by any of them
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory")
+SHARED_STATE_DB_PATH = os.getenv("SHARED_STATE_DB_PATH", "shared_state.sqlite3")
+
+
+class StateStore(ABC):
+    """Short-lived string values keyed by ID, such as the state between two requests."""
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        """
+        Store a value, replacing any value of the key.
+
+        :param key: The key
+        :param value: The value
+        """
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Get a value.
+
+        :param key: The key
+        :return: The value, or None if it is unknown or expired
+        """
+        pass
+
+    @abstractmethod
+    async def pop(self, key: str) -> Optional[str]:
+        """
+        Get a value and remove it, so that only one request gets it.
+
+        :param key: The key
+        :return: The value, or None if it is unknown, expired or was already taken
+        """
+        pass
+
+
+class InMemoryStateStore(StateStore):
+    """
+    Values kept in the memory of the current process.
+
+    Values expire after ttl seconds, and the oldest are dropped beyond max_size.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Maps each key to (expiry time, value), oldest first
+        self._values: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    async def set(self, key: str, value: str) -> None:
+        self._values.pop(key, None)
+        self._values[key] = (time.monotonic() + self.ttl, value)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def pop(self, key: str) -> Optional[str]:
+        value = await self.get(key)
+        self._values.pop(key, None)
+        return value
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Values stored in a SQLite database that several worker processes can share.
+
+    Each store keeps its values in its own namespace of the database. Values expire
+    after ttl seconds, and expired values are purged as new ones are stored.
+    """
+
+    def __init__(self, namespace: str, ttl: float, path: str = SHARED_STATE_DB_PATH):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS state_expires_at "
+                "ON state (namespace, expires_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _set(self, key: str, value: str) -> None:
+        # Wall-clock time, since the values are shared between processes
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM state WHERE namespace = ? AND expires_at <= ?",
+                (self.namespace, now),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (self.namespace, key, value, now + self.ttl),
+            )
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM state "
+                "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _pop(self, key: str) -> Optional[str]:
+        with self._connect() as connection:
+            # A single statement, so two workers can't both take the value
+            row = connection.execute(
+                "DELETE FROM state WHERE namespace = ? AND key = ? "
+                "RETURNING value, expires_at",
+                (self.namespace, key),
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def pop(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._pop, key)
+
+
+def create_state_store(
+    namespace: str, max_size: int, ttl: float, backend: str = SHARED_STATE_BACKEND
+) -> StateStore:
+    """
+    Create a state store of the backend selected by the SHARED_STATE_BACKEND setting.
+
+    :param namespace: The name of the values, which keeps them apart in a shared store
+    :param max_size: Maximum number of values kept in memory
+    :param ttl: Seconds before a value expires
+    :param backend: Either "memory" or "sqlite"
+    :return: The state store
+    """
+    if backend == "memory":
+        return InMemoryStateStore(max_size, ttl)
+    if backend == "sqlite":
+        return SQLiteStateStore(namespace, ttl)
+    raise ValueError(f"Unknown shared state backend: {backend}")
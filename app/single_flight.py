@@ -0,0 +1,81 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+from dotenv import load_dotenv
+
+from app.metrics import SINGLE_FLIGHT_CALLS
+
+# Load environment variables
+load_dotenv()
+
+# Share one retrieval and LLM call between identical concurrent requests
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesce identical concurrent calls into one.
+
+    The first call for a key runs in its own task, and calls for the same key made
+    while it is in flight await that task instead of starting another. Every caller
+    gets its result or its exception. Nothing is kept once the call completes, so
+    later calls, including retries after an error, start afresh.
+
+    A caller that is cancelled stops waiting without affecting the others; the call
+    itself is only cancelled once every caller waiting for it is.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: The name of the calls, which labels their metrics
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run a call, or join the call in flight for the same key.
+
+        :param key: The key of identical calls
+        :param function: Makes the call, only invoked if no call is in flight
+        :return: The result of the call
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(function()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            SINGLE_FLIGHT_CALLS.inc(name=self.name, role="leader")
+        else:
+            SINGLE_FLIGHT_CALLS.inc(name=self.name, role="follower")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.task.cancelled():
+                raise
+            # The caller was cancelled, rather than the call
+            if call.waiters == 1:
+                call.task.cancel()
+                # Calls for the key made from now on start afresh
+                self._forget(key, call)
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
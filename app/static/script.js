@@ -22,6 +22,14 @@ document.body.addEventListener('htmx:beforeRequest', function(event) {
     chatContainer.appendChild(typingIndicator);
 });
 
+// Show the busy message of a request rejected by admission control
+document.body.addEventListener('htmx:beforeSwap', function(event) {
+    if (event.detail.xhr.status === 503) {
+        event.detail.shouldSwap = true;
+        event.detail.isError = false;
+    }
+});
+
 document.body.addEventListener('htmx:afterSwap', function(event) {
     var chatContainer = document.getElementById('chat-container');
     
@@ -39,8 +47,43 @@ document.body.addEventListener('htmx:afterSwap', function(event) {
     
     // Add 'show' class to trigger animation
     newMessage.classList.add('show');
+
+    // Start streaming the response if the server sent a placeholder
+    if (newMessage.dataset.streamUrl) {
+        streamBotMessage(newMessage);
+    }
 });
 
+function streamBotMessage(messageElement) {
+    var source = new EventSource(messageElement.dataset.streamUrl);
+    var content = messageElement.querySelector('[data-stream-target="chunk"]');
+    var citations = messageElement.querySelector('[data-stream-target="citations"]');
+
+    // Each chunk carries the full response rendered so far
+    source.addEventListener('chunk', function(event) {
+        content.innerHTML = event.data;
+        scrollToLastMessage();
+    });
+
+    source.addEventListener('citations', function(event) {
+        citations.innerHTML = event.data;
+        // Let htmx load the citations when the sources are expanded
+        htmx.process(citations);
+    });
+
+    source.addEventListener('done', function() {
+        source.close();
+    });
+
+    source.onerror = function() {
+        source.close();
+        // Replace the typing indicator if the stream failed before any content arrived
+        if (content.querySelector('.typing-indicator')) {
+            content.innerHTML = '<p>I\'m sorry, but the response could not be loaded. Please try again.</p>';
+        }
+    };
+}
+
 function scrollToLastMessage() {
     const chatContainer = document.getElementById('chat-container');
     const lastMessage = chatContainer.lastElementChild;
@@ -1,18 +1,52 @@
 import asyncio
+import json
 import os
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import random
-from typing import Any, Dict, List
-from astrapy import DataAPIClient
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+import numpy as np
 from pydantic import BaseModel, Field
-import chromadb
-from chromadb.config import Settings
-import chromadb.utils.embedding_functions as embedding_functions
 from dotenv import load_dotenv
 
+from app.admission import AdmissionController
+from app.embeddings import EmbeddingProvider, create_embedding_provider
+
 # Load environment variables
 load_dotenv()
 
+# Vector store the app retrieves from: "astra", "chroma", "local" or "mock". Each
+# backend imports its client library only when it is created
+VECTOR_STORE = os.getenv("VECTOR_STORE", "astra")
+# Directory of the "chroma" database and of the "local" store's index
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "")
+
+# Maximum number of ChromaDB queries running at once in worker threads
+CHROMA_MAX_CONCURRENCY = int(os.getenv("CHROMA_MAX_CONCURRENCY", "4"))
+# Maximum number of cached query results, and how many seconds they stay fresh
+VECTOR_CACHE_SIZE = int(os.getenv("VECTOR_CACHE_SIZE", "256"))
+VECTOR_CACHE_TTL = float(os.getenv("VECTOR_CACHE_TTL", "300"))
+
+# Async function that embeds a batch of texts, returning one vector per text
+EmbeddingFunction = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+T = TypeVar("T")
+
 
 class VectorStoreMetadata(BaseModel):
     score: float = Field(..., description="Relevance score of the document")
@@ -24,6 +58,88 @@ class VectorStoreResult(BaseModel):
     metadata: VectorStoreMetadata
 
 
+class DocumentChunk(BaseModel):
+    id: str = Field(..., description="Stable ID derived from the chunk's content")
+    content: str = Field(..., description="Content of the chunk")
+    source: str = Field(..., description="Source of the document the chunk is from")
+
+
+def filter_unique_results(
+    results: Iterable[T],
+    top_k: int,
+    key: Callable[[T], Hashable],
+) -> List[T]:
+    """
+    Filter results to ensure uniqueness, keeping the first result for each key.
+
+    :param results: Results in order of preference
+    :param top_k: Maximum number of results to return
+    :param key: Function returning the value results are deduplicated by
+    :return: List of unique results, up to top_k in length
+    """
+    seen_keys = set()
+    unique_results = []
+    for result in results:
+        result_key = key(result)
+        if result_key not in seen_keys:
+            seen_keys.add(result_key)
+            unique_results.append(result)
+            if len(unique_results) == top_k:
+                break
+    return unique_results
+
+
+def merge_results(
+    results: Iterable[VectorStoreResult], top_k: int
+) -> List[VectorStoreResult]:
+    """
+    Merge results from several queries, keeping the best-scoring result for each content.
+
+    :param results: Results from any number of queries
+    :param top_k: Maximum number of results to return
+    :return: Unique results by descending score, up to top_k in length
+    """
+    ranked = sorted(results, key=lambda result: result.metadata.score, reverse=True)
+    return filter_unique_results(ranked, top_k, key=lambda result: result.content)
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[List[VectorStoreResult]], top_k: int, k: int = 60
+) -> List[VectorStoreResult]:
+    """
+    Fuse rankings whose scores aren't comparable, such as lexical and vector search.
+
+    Each result scores 1 / (k + rank) in every ranking it appears in, by content, and
+    the fused results carry the sum as their score.
+
+    :param rankings: Results of each search, best first
+    :param top_k: Maximum number of results to return
+    :param k: Damping constant that limits the weight of the top ranks
+    :return: Unique results by descending fused score, up to top_k in length
+    """
+    scores: Dict[str, float] = {}
+    fused: Dict[str, VectorStoreResult] = {}
+    for ranking in rankings:
+        ranked = filter_unique_results(
+            ranking, len(ranking), key=lambda result: result.content
+        )
+        for rank, result in enumerate(ranked, start=1):
+            scores[result.content] = scores.get(result.content, 0.0) + 1 / (k + rank)
+            fused.setdefault(result.content, result)
+
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [
+        fused[content].model_copy(
+            update={
+                "metadata": fused[content].metadata.model_copy(
+                    update={"score": scores[content]}
+                )
+            }
+        )
+        for content in best
+    ]
+
+
 class VectorStore(ABC):
     @abstractmethod
     async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
@@ -36,9 +152,36 @@ class VectorStore(ABC):
         """
         pass
 
+    async def query_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        """
+        Query the vector store with several queries.
+
+        The queries run concurrently, unless the store overrides this to answer them
+        in a single call.
+
+        :param queries: The query strings
+        :param top_k: Number of top results to return per query
+        :return: A list of results for each query
+        """
+        return list(await asyncio.gather(*(self.query(q, top_k) for q in queries)))
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        """
+        Embed and add documents to the vector store, replacing any with the same IDs.
+
+        :param documents: The document chunks to add
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support adding documents"
+        )
+
 
 class MockVectorStore(VectorStore):
-    def __init__(self):
+    def __init__(self, delay: float = 0.1):
+        # Seconds each query takes, to mimic a real database query
+        self.delay = delay
         self.lorem_ipsum = [
             "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
             "Sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.",
@@ -54,7 +197,7 @@ class MockVectorStore(VectorStore):
 
     async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
         # Simulate a delay to mimic a real database query
-        await asyncio.sleep(0.1)
+        await asyncio.sleep(self.delay)
 
         # Randomly select 'top_k' sentences from the lorem ipsum list
         selected_sentences = random.sample(
@@ -76,61 +219,486 @@ class MockVectorStore(VectorStore):
         return results
 
 
+class CachedVectorStore(VectorStore):
+    """
+    Wrap a vector store with an in-memory LRU cache of query results.
+
+    Results are keyed by the normalized query string and top_k, and expire after ttl seconds.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        max_size: int = VECTOR_CACHE_SIZE,
+        ttl: float = VECTOR_CACHE_TTL,
+    ):
+        self.vector_store = vector_store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Maps (normalized query, top_k) to (expiry time, results), least recently used first
+        self._cache: (
+            "OrderedDict[Tuple[str, int], Tuple[float, List[VectorStoreResult]]]"
+        ) = OrderedDict()
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        """
+        Normalize a query so that trivially different spellings share a cache entry.
+
+        :param query: The query string
+        :return: The query in lower case with collapsed whitespace
+        """
+        return " ".join(query.lower().split())
+
+    def _get(self, key: Tuple[str, int]) -> Optional[List[VectorStoreResult]]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires_at, results = entry
+            if expires_at > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(results)
+            del self._cache[key]
+        self.misses += 1
+        return None
+
+    def _set(self, key: Tuple[str, int], results: List[VectorStoreResult]) -> None:
+        self._cache[key] = (time.monotonic() + self.ttl, list(results))
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        key = (self._normalize(query), top_k)
+        results = self._get(key)
+        if results is None:
+            results = await self.vector_store.query(query, top_k)
+            self._set(key, results)
+        return results
+
+    async def query_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        keys = [(self._normalize(query), top_k) for query in queries]
+        cached = [self._get(key) for key in keys]
+        # Only the queries that missed are sent to the store, each of them once
+        missing: Dict[Tuple[str, int], str] = {}
+        for query, key, results in zip(queries, keys, cached):
+            if results is None:
+                missing.setdefault(key, query)
+        if missing:
+            fetched = await self.vector_store.query_batch(list(missing.values()), top_k)
+            for key, results in zip(missing, fetched):
+                self._set(key, results)
+            fetched_by_key = dict(zip(missing, fetched))
+            cached = [
+                list(fetched_by_key[key]) if results is None else results
+                for key, results in zip(keys, cached)
+            ]
+        return cached
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        await self.vector_store.add_documents(documents)
+        # Cached results may no longer be the best matches
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all cached results."""
+        self._cache.clear()
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Cache size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AdmissionControlledVectorStore(VectorStore):
+    """
+    Wrap a vector store with admission control of its queries.
+
+    Queries beyond the store's concurrency or rate limits wait in a bounded queue, and
+    are rejected with an OverloadedError when it is full or they waited too long.
+    """
+
+    def __init__(self, vector_store: VectorStore, admission: AdmissionController):
+        self.vector_store = vector_store
+        self.admission = admission
+
+    async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        async with self.admission.admit():
+            return await self.vector_store.query(query, top_k)
+
+    async def query_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        # A batch takes a single slot, as it is a single call to stores that batch
+        async with self.admission.admit():
+            return await self.vector_store.query_batch(queries, top_k)
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        # Ingestion bounds its own concurrency
+        await self.vector_store.add_documents(documents)
+
+
 # Placeholder classes for other vector stores
 class PineconeStore(VectorStore):
     async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
         # Implement Pinecone-specific query method
-        pass
+        raise NotImplementedError("PineconeStore is not implemented yet")
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index over a NumPy matrix of normalized embeddings.
+
+    Queries use exact (brute-force) cosine similarity by default. With index_type="hnsw"
+    an approximate faiss HNSW index is used instead, for larger corpora. Texts are
+    embedded with an EmbeddingProvider, such as a CachedEmbeddingProvider that embeds
+    each text only once, or with any async function that embeds a batch of texts.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    DOCUMENTS_FILE = "documents.json"
+    FAISS_INDEX_FILE = "index.faiss"
+
+    def __init__(
+        self,
+        embedding_function: Union[EmbeddingProvider, EmbeddingFunction],
+        path: Optional[str] = None,
+        index_type: str = "flat",
+        hnsw_neighbors: int = 32,
+    ):
+        if index_type not in ("flat", "hnsw"):
+            raise ValueError(f"Unsupported index type: {index_type}")
+
+        self.embedding_function = embedding_function
+        self.path = path
+        self.index_type = index_type
+        self.hnsw_neighbors = hnsw_neighbors
+        self.vectors: Optional[np.ndarray] = None
+        self.documents: List[Dict[str, str]] = []
+        # IDs of the documents added with one
+        self.ids: Set[str] = set()
+        self.index = None
+
+        if path and os.path.exists(os.path.join(path, self.VECTORS_FILE)):
+            self.load(path)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = await self.embedding_function(texts)
+        return self._normalize(np.asarray(embeddings, dtype=np.float32))
+
+    def _build_index(self) -> None:
+        """Build the faiss HNSW index from the stored vectors."""
+        import faiss
+
+        self.index = faiss.IndexHNSWFlat(
+            self.vectors.shape[1], self.hnsw_neighbors, faiss.METRIC_INNER_PRODUCT
+        )
+        self.index.add(np.ascontiguousarray(self.vectors))
+
+    async def add(
+        self, texts: List[str], sources: List[str], ids: Optional[List[str]] = None
+    ) -> None:
+        """
+        Embed and add documents to the index.
+
+        :param texts: The document contents
+        :param sources: The source of each document
+        :param ids: The ID of each document, if any
+        """
+        if len(texts) != len(sources) or (ids is not None and len(ids) != len(texts)):
+            raise ValueError("texts, sources and ids must have the same length")
+        if not texts:
+            return
+
+        vectors = await self._embed(texts)
+        if self.vectors is None:
+            self.vectors = vectors
+        else:
+            self.vectors = np.vstack([self.vectors, vectors])
+        if ids is None:
+            self.documents.extend(
+                {"content": text, "source": source}
+                for text, source in zip(texts, sources)
+            )
+        else:
+            self.documents.extend(
+                {"content": text, "source": source, "id": document_id}
+                for text, source, document_id in zip(texts, sources, ids)
+            )
+            self.ids.update(ids)
+
+        if self.index_type == "hnsw":
+            if self.index is None:
+                self._build_index()
+            else:
+                self.index.add(vectors)
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        # Documents the store already has are skipped before they are embedded
+        documents = [document for document in documents if document.id not in self.ids]
+        await self.add(
+            [document.content for document in documents],
+            [document.source for document in documents],
+            [document.id for document in documents],
+        )
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Persist the vectors, documents and any faiss index to a directory.
+
+        :param path: The directory to write to, defaults to the store's path
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError("No path given to save the vector store to")
+        os.makedirs(path, exist_ok=True)
+
+        vectors = self.vectors
+        if vectors is None:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        documents = json.dumps(self.documents)
+        self._replace_file(
+            os.path.join(path, self.VECTORS_FILE),
+            lambda temporary_path: np.save(temporary_path, vectors),
+        )
+        self._replace_file(
+            os.path.join(path, self.DOCUMENTS_FILE),
+            lambda temporary_path: self._write_text(temporary_path, documents),
+        )
+
+        if self.index is not None:
+            import faiss
+
+            index = self.index
+            self._replace_file(
+                os.path.join(path, self.FAISS_INDEX_FILE),
+                lambda temporary_path: faiss.write_index(index, temporary_path),
+            )
+
+    @staticmethod
+    def _replace_file(path: str, write: Callable[[str], None]) -> None:
+        """
+        Write a file to a temporary path, then move it over the old one.
+
+        The old file may be memory-mapped by this store, which writing it in place
+        would corrupt, and other processes never see a partly written file.
+
+        :param path: The file to replace
+        :param write: Writes the new file to the temporary path it is given
+        """
+        # Keep the extension, which np.save would otherwise append
+        root, extension = os.path.splitext(path)
+        temporary_path = f"{root}.tmp{extension}"
+        try:
+            write(temporary_path)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    @staticmethod
+    def _write_text(path: str, text: str) -> None:
+        with open(path, "w") as f:
+            f.write(text)
+
+    def load(self, path: str) -> None:
+        """
+        Load a saved store from a directory.
+
+        The vectors are memory-mapped rather than read, so loading is fast even for large corpora.
+
+        :param path: The directory the store was saved to
+        """
+        vectors = np.load(os.path.join(path, self.VECTORS_FILE), mmap_mode="r")
+        self.vectors = vectors if vectors.size else None
+        with open(os.path.join(path, self.DOCUMENTS_FILE)) as f:
+            self.documents = json.load(f)
+        self.ids = {document["id"] for document in self.documents if "id" in document}
+
+        self.index = None
+        if self.index_type == "hnsw" and self.vectors is not None:
+            index_path = os.path.join(path, self.FAISS_INDEX_FILE)
+            if os.path.exists(index_path):
+                import faiss
+
+                self.index = faiss.read_index(index_path)
+            else:
+                self._build_index()
+
+    def _search(
+        self, query_vectors: np.ndarray, top_k: int
+    ) -> List[List[VectorStoreResult]]:
+        """
+        Find the top_k documents for each query vector.
+
+        :param query_vectors: Normalized query vectors, one row per query
+        :param top_k: Number of top results to return per query
+        :return: A list of results for each query, most similar first
+        """
+        if self.vectors is None:
+            return [[] for _ in range(len(query_vectors))]
+        top_k = min(top_k, len(self.documents))
+
+        if self.index is not None:
+            scores, indices = self.index.search(query_vectors, top_k)
+        else:
+            # One matrix product scores every query against every document
+            all_scores = query_vectors @ self.vectors.T
+            candidates = np.argpartition(-all_scores, top_k - 1, axis=1)[:, :top_k]
+            candidate_scores = np.take_along_axis(all_scores, candidates, axis=1)
+            order = np.argsort(-candidate_scores, axis=1)
+            indices = np.take_along_axis(candidates, order, axis=1)
+            scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        return [
+            [
+                VectorStoreResult(
+                    content=self.documents[index]["content"],
+                    metadata=VectorStoreMetadata(
+                        score=float(score), source=self.documents[index]["source"]
+                    ),
+                )
+                for index, score in zip(row_indices, row_scores)
+                if index >= 0
+            ]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+    async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
+        return (await self.query_batch([query], top_k))[0]
+
+    async def query_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        """
+        Query the store with several queries at once, embedding them in a single batch.
+
+        :param queries: The query strings
+        :param top_k: Number of top results to return per query
+        :return: A list of results for each query
+        """
+        if not queries:
+            return []
+        return self._search(await self._embed(queries), top_k)
 
 
 class ChromaDBStore(VectorStore):
-    def __init__(self, path: str, collection_name: str = "default_collection"):
+    def __init__(
+        self,
+        path: str,
+        collection_name: str = "default_collection",
+        max_concurrency: int = CHROMA_MAX_CONCURRENCY,
+        embedding_provider: Optional[EmbeddingProvider] = None,
+    ):
+        import chromadb
+        from chromadb.config import Settings
+
         self.client = chromadb.PersistentClient(
             path=path, settings=Settings(allow_reset=True)
         )
 
-        openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.getenv("OPENAI_API_KEY"), model_name="text-embedding-3-small"
+        # Texts are embedded by the (cached) provider rather than by ChromaDB
+        self.embedding_provider = embedding_provider or create_embedding_provider()
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name, embedding_function=None
         )
 
-        self.collection = self.client.get_or_create_collection(
-            name=collection_name, embedding_function=openai_ef
+        # The ChromaDB client is synchronous, so queries run in a bounded pool of
+        # worker threads to keep them from blocking the event loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="chromadb"
+        )
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        if not documents:
+            return
+        embeddings = await self.embedding_provider.embed(
+            [document.content for document in documents]
+        )
+        # Upserting by ID keeps re-ingested chunks from being duplicated
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.executor,
+            lambda: self.collection.upsert(
+                ids=[document.id for document in documents],
+                embeddings=embeddings.tolist(),
+                documents=[document.content for document in documents],
+                metadatas=[{"source": document.source} for document in documents],
+            ),
         )
 
     async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
-        results = self.collection.query(query_texts=[query], n_results=top_k)
+        return (await self.query_batch([query], top_k))[0]
 
-        vector_store_results = []
+    async def query_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[VectorStoreResult]]:
+        """
+        Query the store with several queries at once, in a single embedding request
+        and a single ChromaDB query.
+
+        :param queries: The query strings
+        :param top_k: Number of top results to return per query
+        :return: A list of results for each query
+        """
+        if not queries:
+            return []
+        query_embeddings = await self.embedding_provider.embed(queries)
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            self.executor,
+            lambda: self.collection.query(
+                query_embeddings=query_embeddings.tolist(), n_results=top_k
+            ),
+        )
 
         # Process query results
         # The ChromaDB query method returns results in a specific format:
         # - 'documents', 'metadatas', and 'distances' are lists of lists
-        # - The outer list corresponds to the number of queries (in our case, always 1)
+        # - The outer list corresponds to the queries
         # - The inner lists contain the results for each query
-        # We use [0] to access the results of our single query, then zip these lists together
-        # enumerate is used to get an index (i) for each result, starting from 0
-        for i, (document, metadata, distance) in enumerate(
-            zip(
-                results["documents"][0],
-                results["metadatas"][0],
-                results["distances"][0],
-            )
+        # We zip the inner lists of each query together, and enumerate is used to get
+        # an index (i) for each result, starting from 0
+        batch_results = []
+        for documents, metadatas, distances in zip(
+            results["documents"], results["metadatas"], results["distances"]
         ):
-            # Convert distance to a similarity score (assuming cosine distance)
-            # Cosine distance ranges from 0 to 2, so we normalize and invert it
-            similarity_score = 1 - (distance / 2)
-
-            vector_store_results.append(
-                VectorStoreResult(
-                    content=document,
-                    metadata=VectorStoreMetadata(
-                        score=similarity_score,
-                        source=metadata.get("source", f"document_{i}"),
-                    ),
+            vector_store_results = []
+            for i, (document, metadata, distance) in enumerate(
+                zip(documents, metadatas, distances)
+            ):
+                # Convert distance to a similarity score (assuming cosine distance)
+                # Cosine distance ranges from 0 to 2, so we normalize and invert it
+                similarity_score = 1 - (distance / 2)
+
+                vector_store_results.append(
+                    VectorStoreResult(
+                        content=document,
+                        metadata=VectorStoreMetadata(
+                            score=similarity_score,
+                            source=metadata.get("source", f"document_{i}"),
+                        ),
+                    )
                 )
-            )
+            batch_results.append(vector_store_results)
 
-        return vector_store_results
+        return batch_results
 
 
 class AstraDBStore(VectorStore):
@@ -142,40 +710,62 @@ class AstraDBStore(VectorStore):
                 "ASTRA_DB_ENDPOINT and ASTRA_DB_TOKEN must be set in the environment"
             )
 
+        from astrapy import DataAPIClient
+
         self.client = DataAPIClient(token=self.astra_db_token)
         self.db = self.client.get_database_by_api_endpoint(self.astra_db_endpoint)
-        self.collection = self.db.get_collection(collection_name)
+        # Use the async collection so queries don't block the event loop
+        self.collection = self.db.get_collection(collection_name).to_async()
 
     def _filter_unique_results(
         self,
-        results: List[Dict[str, Any]],
+        results: Iterable[Dict[str, Any]],
         top_k: int,
     ) -> List[Dict[str, Any]]:
         """
-        Filter results to ensure uniqueness based on document ID.
+        Filter results to ensure uniqueness based on document content.
 
         :param results: List of result dictionaries from AstraDB query
         :param top_k: Maximum number of results to return
         :return: List of unique result dictionaries, up to top_k in length
         """
-        seen_content = set()
-        unique_results = []
-        for result in results:
-            content = result.get("content")
-            if content not in seen_content:
-                seen_content.add(content)
-                unique_results.append(result)
-                if len(unique_results) == top_k:
-                    break
-        return unique_results
+        return filter_unique_results(
+            results, top_k, key=lambda result: result.get("content")
+        )
+
+    async def add_documents(self, documents: List[DocumentChunk]) -> None:
+        from astrapy.exceptions import InsertManyException
+
+        # The collection embeds each document's $vectorize field on insertion
+        try:
+            await self.collection.insert_many(
+                [
+                    {
+                        "_id": document.id,
+                        "content": document.content,
+                        "$vectorize": document.content,
+                        "metadata": {"source": document.source},
+                    }
+                    for document in documents
+                ],
+                ordered=False,
+            )
+        except InsertManyException as e:
+            # Chunk IDs are content hashes, so existing documents are already current
+            if any(
+                error.error_code != "DOCUMENT_ALREADY_EXISTS"
+                for error in e.error_descriptors
+            ):
+                raise
 
     async def query(self, query: str, top_k: int = 5) -> List[VectorStoreResult]:
-        results = self.collection.find(
+        cursor = self.collection.find(
             sort={"$vectorize": query},
             limit=top_k,
             projection={"$vectorize": True},
             include_similarity=True,
         )
+        results = [result async for result in cursor]
 
         # Filter for unique results
         unique_results = self._filter_unique_results(results, top_k)
@@ -197,3 +787,34 @@ class AstraDBStore(VectorStore):
             )
 
         return vector_store_results
+
+
+def create_vector_store(
+    backend: str = VECTOR_STORE,
+    collection_name: Optional[str] = None,
+    path: Optional[str] = None,
+) -> VectorStore:
+    """
+    Create a vector store of the backend selected by the VECTOR_STORE setting.
+
+    Only the client library of the selected backend is imported, so workers don't pay
+    for loading the others.
+
+    :param backend: One of "astra", "chroma", "local" or "mock"
+    :param collection_name: The collection name, for Astra DB and ChromaDB
+    :param path: The database directory, for ChromaDB and the local store
+    :return: The vector store
+    """
+    path = path or VECTOR_STORE_PATH
+    collection_name = collection_name or "default_collection"
+    if backend == "astra":
+        return AstraDBStore(collection_name=collection_name)
+    if backend == "chroma":
+        return ChromaDBStore(path=path or "db", collection_name=collection_name)
+    if backend == "local":
+        return LocalVectorStore(
+            create_embedding_provider(), path=path or "vector_index"
+        )
+    if backend == "mock":
+        return MockVectorStore()
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -0,0 +1,463 @@
+"""
+Load-test and micro-benchmark the chat pipeline with a stubbed LLM and vector store.
+
+The load mode serves the app with uvicorn in this process, replaces the LLM with a
+fake that has a configurable latency and token-streaming profile, and retrieves
+from a MockVectorStore. Each configuration drives concurrent chat traffic and
+reports latency percentiles, throughput and memory:
+
+    python -m benchmarks.bench_chat load --concurrency 1 10 50 --requests 200
+    python -m benchmarks.bench_chat load --stream --tokens 300 --token-interval 0.01
+
+The micro mode times the CPU-bound steps of a request in isolation: prompt
+preparation in RAGService, Markdown rendering and template rendering:
+
+    python -m benchmarks.bench_chat micro --iterations 2000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# The app reads its settings on import; the stubs below replace every upstream
+# service, so a placeholder key and the mock vector store are enough to run it
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("VECTOR_STORE", "mock")
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+import uvicorn  # noqa: E402
+
+from app import main  # noqa: E402
+from app.chat_gpt_client import Message, MessageRole  # noqa: E402
+from app.models import RagCitation  # noqa: E402
+from app.rag_service import RAGService  # noqa: E402
+from app.vector_store import MockVectorStore  # noqa: E402
+
+SAMPLE_MESSAGE = "How do I configure the vector store and what does it cost?"
+
+# A response with the Markdown features models commonly produce
+SAMPLE_RESPONSE = (
+    "## Configuration\n\n"
+    "Set the **collection name** and the `ASTRA_DB_ENDPOINT` variable, then:\n\n"
+    "1. Create the collection.\n"
+    "2. Load the documents.\n"
+    "3. Restart the app.\n\n"
+    "```python\nstore = AstraDBStore(collection_name='docs')\n```\n\n"
+    "> Retrieval adds about 100 ms to each request.\n\n"
+) * 4
+
+
+@dataclass
+class LLMProfile:
+    """Latency profile of the fake LLM."""
+
+    # Seconds before the first token
+    latency: float = 0.5
+    # Number of tokens in each response, and seconds between them
+    tokens: int = 100
+    token_interval: float = 0.0
+
+
+@dataclass
+class LoadResult:
+    concurrency: int
+    stream: bool
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    first_token_p50: Optional[float] = None
+    first_token_p95: Optional[float] = None
+    peak_traced_memory_mb: Optional[float] = None
+    max_rss_mb: float = 0.0
+
+
+@dataclass
+class MicroResult:
+    name: str
+    iterations: int
+    mean_us: float
+    p50_us: float
+    p99_us: float
+
+
+@dataclass
+class Report:
+    mode: str
+    settings: Dict[str, object]
+    results: List[object] = field(default_factory=list)
+
+
+@dataclass
+class RequestTiming:
+    latency: float
+    first_token: Optional[float] = None
+    error: bool = False
+
+
+def install_stubs(profile: LLMProfile, retrieval_latency: float) -> None:
+    """
+    Replace the LLM, the summarizer and the vector stores of the app with fakes.
+
+    :param profile: The latency profile of the fake LLM
+    :param retrieval_latency: Seconds each vector store query takes
+    """
+    tokens = SAMPLE_RESPONSE.split(" ")
+    tokens = [tokens[i % len(tokens)] + " " for i in range(profile.tokens)]
+
+    async def get_chat_response_with_history(messages, *args, **kwargs) -> str:
+        await asyncio.sleep(profile.latency + profile.tokens * profile.token_interval)
+        return "".join(tokens)
+
+    async def stream_chat_response_with_history(
+        messages, *args, **kwargs
+    ) -> AsyncIterator[str]:
+        await asyncio.sleep(profile.latency)
+        for token in tokens:
+            if profile.token_interval:
+                await asyncio.sleep(profile.token_interval)
+            yield token
+
+    async def summarize_conversation(summary, messages) -> str:
+        await asyncio.sleep(profile.latency)
+        return "A summary of the earlier conversation."
+
+    main.get_chat_response_with_history = get_chat_response_with_history
+    main.stream_chat_response_with_history = stream_chat_response_with_history
+    # Built here rather than with main.get_rag_service(), whose vector store depends
+    # on the VECTOR_STORE setting of whoever imported the app first
+    main.vector_store = MockVectorStore(delay=retrieval_latency)
+    main.rag_service = RAGService(main.vector_store, summarizer=summarize_conversation)
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def send_chat(client: httpx.AsyncClient, stream: bool) -> RequestTiming:
+    """
+    Send one chat message and wait for the complete response.
+
+    :param client: The client of one simulated user
+    :param stream: Use the streaming endpoints instead of POST /chat
+    :return: The latency, and the time to the first streamed chunk
+    """
+    start = time.perf_counter()
+    if not stream:
+        response = await client.post("/chat", data={"message": SAMPLE_MESSAGE})
+        return RequestTiming(
+            latency=time.perf_counter() - start,
+            error=response.status_code != 200,
+        )
+
+    response = await client.post("/chat/stream", data={"message": SAMPLE_MESSAGE})
+    if response.status_code != 200:
+        return RequestTiming(latency=time.perf_counter() - start, error=True)
+    message_id = response.text.split('data-stream-url="/chat/stream/')[1].split('"')[0]
+
+    first_token = None
+    async with client.stream("GET", f"/chat/stream/{message_id}") as events:
+        if events.status_code != 200:
+            return RequestTiming(latency=time.perf_counter() - start, error=True)
+        async for line in events.aiter_lines():
+            if first_token is None and line == "event: chunk":
+                first_token = time.perf_counter() - start
+            if line == "event: done":
+                break
+    return RequestTiming(latency=time.perf_counter() - start, first_token=first_token)
+
+
+async def drive_load(
+    base_url: str, concurrency: int, total_requests: int, stream: bool
+) -> List[RequestTiming]:
+    """
+    Send chat messages from concurrent users, each with its own session.
+
+    :param base_url: The URL the app is served at
+    :param concurrency: The number of users sending messages at the same time
+    :param total_requests: The number of messages sent by all users together
+    :param stream: Use the streaming endpoints instead of POST /chat
+    :return: The timing of each message
+    """
+    timings: List[RequestTiming] = []
+    remaining = iter(range(total_requests))
+
+    async def user() -> None:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            for _ in remaining:
+                try:
+                    timings.append(await send_chat(client, stream))
+                except httpx.HTTPError:
+                    timings.append(RequestTiming(latency=0.0, error=True))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return timings
+
+
+async def run_load(
+    concurrency: int,
+    total_requests: int,
+    stream: bool = False,
+    url: Optional[str] = None,
+    trace_memory: bool = False,
+) -> LoadResult:
+    """
+    Run one load test configuration, serving the app in this process unless a URL is given.
+
+    :param concurrency: The number of users sending messages at the same time
+    :param total_requests: The number of messages sent by all users together
+    :param stream: Use the streaming endpoints instead of POST /chat
+    :param url: The URL of an app that is already running
+    :param trace_memory: Measure the peak memory allocated with tracemalloc, which
+        slows Python down considerably
+    :return: The latency, throughput and memory statistics
+    """
+    server = None
+    if url is None:
+        config = uvicorn.Config(
+            main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"
+        )
+        server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        host, port = server.servers[0].sockets[0].getsockname()[:2]
+        url = f"http://{host}:{port}"
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        timings = await drive_load(url, concurrency, total_requests, stream)
+    finally:
+        duration = time.perf_counter() - start
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        if server is not None:
+            server.should_exit = True
+            await serve_task
+
+    latencies = [timing.latency for timing in timings if not timing.error]
+    first_tokens = [
+        timing.first_token for timing in timings if timing.first_token is not None
+    ]
+    return LoadResult(
+        concurrency=concurrency,
+        stream=stream,
+        requests=len(timings),
+        errors=sum(timing.error for timing in timings),
+        duration=duration,
+        throughput=len(latencies) / duration,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        first_token_p50=percentile(first_tokens, 50) if stream else None,
+        first_token_p95=percentile(first_tokens, 95) if stream else None,
+        peak_traced_memory_mb=peak_memory,
+        max_rss_mb=max_rss_mb(),
+    )
+
+
+async def time_operation(
+    name: str, operation: Callable[[], Awaitable[object]], iterations: int
+) -> MicroResult:
+    # Warm up caches, such as the tokenizer and compiled templates
+    for _ in range(min(iterations, 10)):
+        await operation()
+
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await operation()
+        durations.append(time.perf_counter() - start)
+
+    durations_us = [duration * 1_000_000 for duration in durations]
+    return MicroResult(
+        name=name,
+        iterations=iterations,
+        mean_us=float(np.mean(durations_us)),
+        p50_us=percentile(durations_us, 50),
+        p99_us=percentile(durations_us, 99),
+    )
+
+
+async def run_micro(iterations: int) -> List[MicroResult]:
+    """
+    Time the CPU-bound steps of a chat request in isolation.
+
+    :param iterations: The number of times each step is timed
+    :return: The statistics of each step
+    """
+    rag_service = RAGService(MockVectorStore(delay=0))
+    chat_history = [
+        Message(
+            role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=SAMPLE_RESPONSE if i % 2 else SAMPLE_MESSAGE,
+        )
+        for i in range(20)
+    ]
+    citations = [
+        RagCitation(source=f"document_{i}.txt", content=SAMPLE_RESPONSE[:500])
+        for i in range(5)
+    ]
+    bot_message_template = main.templates.get_template("bot_message.html")
+
+    async def prepare_prompt():
+        return await rag_service.prepare_prompt(
+            system_prompt=main.SYSTEM_PROMPT,
+            chat_history=chat_history,
+            user_message=SAMPLE_MESSAGE,
+        )
+
+    async def render_markdown():
+        return main.render_markdown(SAMPLE_RESPONSE)
+
+    async def render_template():
+        return bot_message_template.render(
+            bot_response_html=SAMPLE_RESPONSE,
+            citations=citations,
+            message_id="benchmark",
+        )
+
+    operations: Dict[str, Callable[[], Awaitable[object]]] = {
+        "rag_prepare_prompt": prepare_prompt,
+        "render_markdown": render_markdown,
+        "render_template": render_template,
+    }
+    return [
+        await time_operation(name, operation, iterations)
+        for name, operation in operations.items()
+    ]
+
+
+def format_load_results(results: List[LoadResult]) -> str:
+    lines = [
+        f"{'users':>6} {'reqs':>6} {'errs':>5} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>9} {'rss MB':>7} {'traced MB':>9}"
+    ]
+    for result in results:
+        first_token = (
+            f"{result.first_token_p50 * 1000:9.1f}"
+            if result.first_token_p50 is not None
+            else f"{'-':>9}"
+        )
+        traced = (
+            f"{result.peak_traced_memory_mb:9.1f}"
+            if result.peak_traced_memory_mb is not None
+            else f"{'-':>9}"
+        )
+        lines.append(
+            f"{result.concurrency:6d} {result.requests:6d} {result.errors:5d} "
+            f"{result.throughput:8.1f} {result.p50 * 1000:8.1f} "
+            f"{result.p95 * 1000:8.1f} {result.p99 * 1000:8.1f} {first_token} "
+            f"{result.max_rss_mb:7.1f} {traced}"
+        )
+    return "\n".join(lines)
+
+
+def format_micro_results(results: List[MicroResult]) -> str:
+    lines = [f"{'operation':<20} {'mean us':>10} {'p50 us':>10} {'p99 us':>10}"]
+    for result in results:
+        lines.append(
+            f"{result.name:<20} {result.mean_us:10.1f} "
+            f"{result.p50_us:10.1f} {result.p99_us:10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    load = modes.add_parser("load", help="Drive concurrent chat traffic")
+    load.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 10, 50],
+        help="Numbers of concurrent users, one configuration each",
+    )
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument(
+        "--stream", action="store_true", help="Use the streaming endpoints"
+    )
+    load.add_argument("--llm-latency", type=float, default=0.5)
+    load.add_argument("--tokens", type=int, default=100)
+    load.add_argument("--token-interval", type=float, default=0.0)
+    load.add_argument("--retrieval-latency", type=float, default=0.1)
+    load.add_argument(
+        "--url", help="Benchmark an app that is already running instead of stubs"
+    )
+    load.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure the peak allocated memory with tracemalloc (slow)",
+    )
+
+    micro = modes.add_parser("micro", help="Time hot-path steps in isolation")
+    micro.add_argument("--iterations", type=int, default=1000)
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> Report:
+    if args.mode == "micro":
+        report = Report(mode="micro", settings={"iterations": args.iterations})
+        report.results = await run_micro(args.iterations)
+        print(format_micro_results(report.results))
+        return report
+
+    profile = LLMProfile(
+        latency=args.llm_latency, tokens=args.tokens, token_interval=args.token_interval
+    )
+    if args.url is None:
+        install_stubs(profile, args.retrieval_latency)
+    report = Report(
+        mode="load",
+        settings={
+            "requests": args.requests,
+            "stream": args.stream,
+            "retrieval_latency": args.retrieval_latency,
+            **asdict(profile),
+        },
+    )
+    for concurrency in args.concurrency:
+        report.results.append(
+            await run_load(
+                concurrency, args.requests, args.stream, args.url, args.trace_memory
+            )
+        )
+    print(format_load_results(report.results))
+    return report
+
+
+def main_cli(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Per-request log lines would drown out the results
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(asdict(report), f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,155 @@
+"""
+Measure how long a worker takes to import the app and start up, per vector store.
+
+Each run starts a fresh interpreter, imports app.main, runs the startup of its
+lifespan with the VECTOR_STORE backend under test, and reports which heavy client
+libraries were loaded:
+
+    python -m benchmarks.bench_startup --backends eager mock astra --runs 5
+
+The "eager" configuration imports the client libraries of every vector store before
+the app, as every worker did before they were imported by their backend only, and
+then starts with the mock backend.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Client libraries that only some backends need
+HEAVY_MODULES = ["astrapy", "chromadb", "faiss"]
+
+# Runs in the fresh interpreter and prints its timings as JSON
+CHILD_SCRIPT = """
+import asyncio, importlib, json, sys, time
+
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+from app import main
+imported = time.perf_counter()
+
+
+async def start_up():
+    async with main.lifespan(main.app):
+        return time.perf_counter()
+
+
+started = asyncio.run(start_up())
+print(json.dumps({
+    "import": imported - start,
+    "startup": started - imported,
+    "modules": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+@dataclass
+class StartupResult:
+    backend: str
+    runs: int
+    import_ms: float = 0.0
+    startup_ms: float = 0.0
+    total_ms: float = 0.0
+    modules: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def run_startup(backend: str, runs: int) -> StartupResult:
+    """
+    Time the import and startup of the app in fresh interpreters.
+
+    :param backend: A VECTOR_STORE backend, or "eager" to import every vector store
+        client library first and start with the mock backend
+    :param runs: The number of interpreters started
+    :return: The median timings, and the heavy modules that were loaded
+    """
+    result = StartupResult(backend=backend, runs=runs)
+    eager_modules = HEAVY_MODULES if backend == "eager" else []
+    imports, startups = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        # Placeholder credentials, since nothing is sent to the upstream services
+        env = {
+            "OPENAI_API_KEY": "benchmark",
+            "ASTRA_DB_ENDPOINT": "https://00000000-0000-0000-0000-000000000000"
+            "-us-east1.apps.astra.datastax.com",
+            "ASTRA_DB_TOKEN": "benchmark",
+            **os.environ,
+            "VECTOR_STORE": "mock" if backend == "eager" else backend,
+            "VECTOR_STORE_PATH": directory,
+            "EMBEDDING_CACHE_DIR": "",
+        }
+        for _ in range(runs):
+            process = subprocess.run(
+                [sys.executable, "-c", CHILD_SCRIPT, *eager_modules],
+                cwd=PROJECT_ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode != 0:
+                result.error = process.stderr.strip().splitlines()[-1]
+                return result
+            timings = json.loads(process.stdout.strip().splitlines()[-1])
+            imports.append(timings["import"])
+            startups.append(timings["startup"])
+            result.modules = timings["modules"]
+
+    result.import_ms = float(np.median(imports)) * 1000
+    result.startup_ms = float(np.median(startups)) * 1000
+    result.total_ms = result.import_ms + result.startup_ms
+    return result
+
+
+def format_results(results: List[StartupResult]) -> str:
+    lines = [
+        f"{'backend':<8} {'import ms':>10} {'startup ms':>11} {'total ms':>9}  modules"
+    ]
+    for result in results:
+        if result.error is not None:
+            lines.append(f"{result.backend:<8} failed: {result.error}")
+            continue
+        lines.append(
+            f"{result.backend:<8} {result.import_ms:10.1f} {result.startup_ms:11.1f} "
+            f"{result.total_ms:9.1f}  {', '.join(result.modules) or '-'}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["eager", "mock", "astra"],
+        choices=["eager", "astra", "chroma", "local", "mock"],
+        help="Configurations to start, one interpreter per run each",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    results = [run_startup(backend, args.runs) for backend in args.backends]
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
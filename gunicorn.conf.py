@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables, so settings in .env take precedence over the defaults below
+load_dotenv()
+
+# Production server: gunicorn manages one uvicorn worker per core, each with its own
+# event loop (uvloop and httptools are used when installed). Run with:
+#
+#     gunicorn app.main:app -c gunicorn.conf.py
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+# Workers that don't report back within this many seconds are restarted
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Seconds a stopping worker gets to finish its requests, including streamed responses
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Restart each worker after this many requests, to bound memory growth (0 disables)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+# A follow-up request, such as opening a response stream, may reach another worker,
+# so state is shared through SQLite unless configured otherwise. The app is imported
+# by each worker after this file runs, so the workers see these settings.
+if workers > 1:
+    os.environ.setdefault("SHARED_STATE_BACKEND", "sqlite")
+    os.environ.setdefault("CHAT_HISTORY_BACKEND", "sqlite")
+
+# The BM25 index and the local vector store are loaded into each worker, so documents
+# uploaded through /api/ingest would only reach the worker that received them, and
+# each worker saving its own copy would overwrite the others' uploads
+if (
+    workers > 1
+    and os.getenv("INGEST_API_ENABLED", "false").lower() == "true"
+    and (os.getenv("LEXICAL_INDEX_PATH") or os.getenv("VECTOR_STORE") == "local")
+):
+    raise ValueError(
+        "INGEST_API_ENABLED requires WEB_CONCURRENCY=1 with LEXICAL_INDEX_PATH or "
+        "VECTOR_STORE=local; ingest with python -m app.ingestion instead"
+    )
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from app.admission import AdmissionController, OverloadedError
+from app.metrics import ADMISSION_REJECTIONS
+
+
+async def hold(controller, seconds, running):
+    async with controller.admit():
+        running.append(1)
+        await asyncio.sleep(seconds)
+        running.pop()
+
+
+@pytest.mark.asyncio
+async def test_admit_limits_concurrency():
+    controller = AdmissionController("test", max_concurrency=2)
+    running = []
+    max_running = 0
+
+    async def call():
+        nonlocal max_running
+        async with controller.admit():
+            running.append(1)
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    assert max_running == 2
+    assert controller.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_admit_rejects_when_queue_is_full():
+    controller = AdmissionController("test", max_concurrency=1, queue_size=1)
+    rejections = ADMISSION_REJECTIONS.values.get(("test", "queue_full"), 0)
+    running = []
+
+    holder = asyncio.create_task(hold(controller, 0.05, running))
+    waiter = asyncio.create_task(hold(controller, 0, running))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(OverloadedError) as error:
+        async with controller.admit():
+            pass
+
+    assert error.value.retry_after == 10
+    assert ADMISSION_REJECTIONS.values[("test", "queue_full")] == rejections + 1
+    # The queued call is still admitted once the slot is free
+    await asyncio.gather(holder, waiter)
+
+
+@pytest.mark.asyncio
+async def test_admit_rejects_after_queue_timeout():
+    controller = AdmissionController("test", max_concurrency=1, queue_timeout=0.02)
+    holder = asyncio.create_task(hold(controller, 0.2, []))
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError, match="busy") as error:
+        async with controller.admit():
+            pass
+
+    assert time.perf_counter() - start < 0.15
+    assert error.value.retry_after == 1
+    assert controller.waiting == 0
+    holder.cancel()
+
+
+@pytest.mark.asyncio
+async def test_admit_releases_slot_on_error():
+    controller = AdmissionController("test", max_concurrency=1, queue_timeout=0.1)
+
+    with pytest.raises(RuntimeError):
+        async with controller.admit():
+            raise RuntimeError("upstream failed")
+
+    async with controller.admit():
+        pass
+
+
+@pytest.mark.asyncio
+async def test_admit_applies_rate_limit():
+    controller = AdmissionController("test", max_concurrency=10, rate_limit=20)
+
+    start = time.perf_counter()
+    for _ in range(30):
+        async with controller.admit():
+            pass
+
+    # A burst of 20 calls, then 10 more at 20 per second
+    assert time.perf_counter() - start >= 0.4
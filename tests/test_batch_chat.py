@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import pytest
+from app import batch_chat
+from app.batch_chat import iter_lines, run_batch_chat
+from app.rag_service import RAGService
+from app.vector_store import VectorStore, VectorStoreMetadata, VectorStoreResult
+
+
+class BatchVectorStore(VectorStore):
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def query(self, query, top_k=5):
+        return (await self.query_batch([query], top_k))[0]
+
+    async def query_batch(self, queries, top_k=5):
+        self.batches.append(queries)
+        if self.fail:
+            raise RuntimeError("Vector store unavailable")
+        return [
+            [
+                VectorStoreResult(
+                    content=f"About {query}",
+                    metadata=VectorStoreMetadata(score=0.9, source=f"{query}.txt"),
+                )
+            ]
+            for query in queries
+        ]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    state = {"in_flight": 0, "max_in_flight": 0, "prompts": []}
+
+    async def get_chat_response_with_history(messages, **kwargs):
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        state["prompts"].append(messages[-1].content)
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        return f"Answer to {messages[-1].content}"
+
+    monkeypatch.setattr(
+        "app.batch_chat.get_chat_response_with_history", get_chat_response_with_history
+    )
+    return state
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+async def collect(store, lines, **kwargs):
+    answers = [
+        answer
+        async for answer in run_batch_chat(
+            RAGService(store, single_flight=False), iterate(lines), "System", **kwargs
+        )
+    ]
+    return sorted(answers, key=lambda answer: answer.index)
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_across_chunks():
+    chunks = [b'{"message": "caf', b"\xc3", b'\xa9"}\r\n\n{"mess', b'age": "b"}']
+
+    lines = [line async for line in iter_lines(iterate(chunks))]
+
+    assert lines == ['{"message": "café"}', "", '{"message": "b"}']
+
+
+@pytest.mark.asyncio
+async def test_run_batch_chat(llm):
+    store = BatchVectorStore()
+    lines = [json.dumps({"message": f"question {i}", "id": str(i)}) for i in range(5)]
+
+    answers = await collect(store, lines, batch_size=2, concurrency=2)
+
+    assert store.batches == [
+        ["question 0", "question 1"],
+        ["question 2", "question 3"],
+        ["question 4"],
+    ]
+    assert [answer.id for answer in answers] == ["0", "1", "2", "3", "4"]
+    assert answers[0].response == "Answer to question 0"
+    assert answers[0].citations[0].source == "question 0.txt"
+    assert answers[0].error is None
+    assert answers[0].timings.llm_ms >= 10
+    assert answers[0].timings.total_ms >= answers[0].timings.llm_ms
+    assert llm["max_in_flight"] == 2
+
+
+@pytest.mark.asyncio
+async def test_run_batch_chat_reports_invalid_questions(llm):
+    lines = ['{"message": "valid"}', "", "not json", '{"id": "no message"}']
+
+    answers = await collect(BatchVectorStore(), lines)
+
+    assert [answer.index for answer in answers] == [0, 1, 2]
+    assert answers[0].response == "Answer to valid"
+    assert answers[1].error.startswith("Invalid question")
+    assert answers[2].error.startswith("Invalid question")
+    assert llm["prompts"] == ["valid"]
+
+
+@pytest.mark.asyncio
+async def test_run_batch_chat_reports_retrieval_errors(llm):
+    lines = ['{"message": "a"}', '{"message": "b"}']
+
+    answers = await collect(BatchVectorStore(fail=True), lines)
+
+    assert [answer.error for answer in answers] == [
+        "Retrieval failed: Vector store unavailable"
+    ] * 2
+    assert llm["prompts"] == []
+
+
+def test_main_writes_answers(llm, monkeypatch, tmp_path):
+    questions = tmp_path / "questions.ndjson"
+    questions.write_text('{"message": "a", "id": "1"}\n{"message": "b"}\n')
+    output = tmp_path / "answers.ndjson"
+    monkeypatch.setattr(
+        "app.main.get_rag_service", lambda: RAGService(BatchVectorStore())
+    )
+
+    count = asyncio.run(batch_chat.main([str(questions), "--output", str(output)]))
+
+    answers = [json.loads(line) for line in output.read_text().splitlines()]
+    assert count == 2
+    assert sorted(answer["response"] for answer in answers) == [
+        "Answer to a",
+        "Answer to b",
+    ]
@@ -0,0 +1,56 @@
+import pytest
+
+from benchmarks import bench_chat, bench_startup
+
+
+@pytest.mark.asyncio
+async def test_run_load_reports_latency_of_every_request():
+    bench_chat.install_stubs(
+        bench_chat.LLMProfile(latency=0.01, tokens=20), retrieval_latency=0
+    )
+
+    result = await bench_chat.run_load(concurrency=3, total_requests=6)
+
+    assert result.requests == 6
+    assert result.errors == 0
+    assert 0 < result.p50 <= result.p95 <= result.p99
+    assert result.throughput > 0
+    assert result.first_token_p50 is None
+
+
+@pytest.mark.asyncio
+async def test_run_load_streaming_reports_time_to_first_token():
+    bench_chat.install_stubs(
+        bench_chat.LLMProfile(latency=0.01, tokens=20, token_interval=0.001),
+        retrieval_latency=0,
+    )
+
+    result = await bench_chat.run_load(
+        concurrency=2, total_requests=4, stream=True, trace_memory=True
+    )
+
+    assert result.requests == 4
+    assert result.errors == 0
+    assert 0 < result.first_token_p50 <= result.p50
+    assert result.peak_traced_memory_mb > 0
+
+
+@pytest.mark.asyncio
+async def test_run_micro_times_each_operation():
+    results = await bench_chat.run_micro(iterations=3)
+
+    assert [result.name for result in results] == [
+        "rag_prepare_prompt",
+        "render_markdown",
+        "render_template",
+    ]
+    assert all(result.iterations == 3 and result.mean_us > 0 for result in results)
+
+
+def test_run_startup_skips_unused_client_libraries():
+    result = bench_startup.run_startup("mock", runs=1)
+
+    assert result.error is None
+    assert result.import_ms > 0 and result.startup_ms > 0
+    assert result.total_ms == result.import_ms + result.startup_ms
+    assert result.modules == []
@@ -1,6 +1,22 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, patch
-from app.chat_gpt_client import get_chat_response_with_history, Message, MessageRole
+from app.admission import AdmissionController, OverloadedError
+from app.completion_cache import CompletionCache
+from app.metrics import ROUTE_COST, ROUTE_REQUESTS
+from app.chat_gpt_client import (
+    ROUTES,
+    Route,
+    classify_request,
+    estimate_cost,
+    get_chat_response_with_history,
+    select_route,
+    get_client,
+    stream_chat_response_with_history,
+    summarize_conversation,
+    Message,
+    MessageRole,
+)
 
 
 # Fixture for chat history
@@ -72,6 +88,320 @@ async def test_get_chat_response_with_history_parameterized(
     assert response == expected
 
 
+async def collect_stream(messages):
+    return [delta async for delta in stream_chat_response_with_history(messages)]
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_stream_chat_response_with_history_yields_deltas(
+    mock_client, chat_history, load_env_variables
+):
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=MockStream(["Hello", None, ", ", "world"], include_empty=True)
+    )
+    deltas = await collect_stream(chat_history)
+    assert deltas == ["Hello", ", ", "world"]
+    assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_stream_chat_response_with_history_api_error(
+    mock_client, chat_history, load_env_variables
+):
+    mock_client.chat.completions.create = AsyncMock(side_effect=Exception("API error"))
+    deltas = await collect_stream(chat_history)
+    assert deltas == ["I'm sorry, but I encountered an error: API error"]
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_stream_chat_response_with_history_error_mid_stream(
+    mock_client, chat_history, load_env_variables
+):
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=MockStream(["Partial"], error=Exception("Connection lost"))
+    )
+    deltas = await collect_stream(chat_history)
+    assert deltas == [
+        "Partial",
+        "I'm sorry, but I encountered an error: Connection lost",
+    ]
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_summarize_conversation_extends_previous_summary(
+    mock_client, chat_history, load_env_variables
+):
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+
+    summary = await summarize_conversation("Earlier summary", chat_history)
+
+    assert summary == "Mocked response content"
+    request = mock_client.chat.completions.create.call_args.kwargs
+    assert request["temperature"] == 0
+    assert request["messages"][1].content.startswith(
+        "Summary so far: Earlier summary\n\n"
+    )
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_summarize_conversation_raises_on_api_error(
+    mock_client, chat_history, load_env_variables
+):
+    mock_client.chat.completions.create = AsyncMock(side_effect=Exception("API Error"))
+
+    with pytest.raises(Exception, match="API Error"):
+        await summarize_conversation(None, chat_history)
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_uses_completion_cache(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    monkeypatch.setattr("app.chat_gpt_client.completion_cache", CompletionCache())
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+
+    first = await get_chat_response_with_history(chat_history, temperature=0)
+    second = await get_chat_response_with_history(chat_history, temperature=0)
+
+    assert first == second == "Mocked response content"
+    assert mock_client.chat.completions.create.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_bypasses_cache_when_sampling(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    monkeypatch.setattr("app.chat_gpt_client.completion_cache", CompletionCache())
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+
+    await get_chat_response_with_history(chat_history, temperature=0.7)
+    await get_chat_response_with_history(chat_history, temperature=0.7)
+
+    assert mock_client.chat.completions.create.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_does_not_cache_errors(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    monkeypatch.setattr("app.chat_gpt_client.completion_cache", CompletionCache())
+    mock_client.chat.completions.create = AsyncMock(side_effect=Exception("API error"))
+    await get_chat_response_with_history(chat_history, temperature=0)
+
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+    response = await get_chat_response_with_history(chat_history, temperature=0)
+
+    assert response == "Mocked response content"
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_stream_chat_response_with_history_uses_completion_cache(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    monkeypatch.setattr("app.chat_gpt_client.completion_cache", CompletionCache())
+    mock_client.chat.completions.create = AsyncMock(
+        side_effect=lambda **kwargs: MockStream(["Hello", ", world"])
+    )
+
+    first = [
+        delta
+        async for delta in stream_chat_response_with_history(
+            chat_history, temperature=0
+        )
+    ]
+    second = [
+        delta
+        async for delta in stream_chat_response_with_history(
+            chat_history, temperature=0
+        )
+    ]
+
+    assert first == ["Hello", ", world"]
+    assert second == ["Hello, world"]
+    assert mock_client.chat.completions.create.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_coalesces_concurrent_requests(
+    mock_client, chat_history, load_env_variables
+):
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.01)
+        return MockResponse()
+
+    mock_client.chat.completions.create = AsyncMock(side_effect=slow_create)
+
+    responses = await asyncio.gather(
+        *(get_chat_response_with_history(chat_history) for _ in range(3))
+    )
+
+    assert responses == ["Mocked response content"] * 3
+    assert mock_client.chat.completions.create.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_shares_errors(
+    mock_client, chat_history, load_env_variables
+):
+    async def failing_create(**kwargs):
+        await asyncio.sleep(0.01)
+        raise Exception("API error")
+
+    mock_client.chat.completions.create = AsyncMock(side_effect=failing_create)
+
+    responses = await asyncio.gather(
+        *(get_chat_response_with_history(chat_history) for _ in range(2))
+    )
+
+    assert all("encountered an error: API error" in response for response in responses)
+    assert mock_client.chat.completions.create.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_get_chat_response_with_history_raises_when_overloaded(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    # Every slot is taken and no call may wait for one
+    full = AdmissionController("llm", max_concurrency=0, queue_size=0)
+    monkeypatch.setattr("app.chat_gpt_client.llm_admission", full)
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+
+    with pytest.raises(OverloadedError):
+        await get_chat_response_with_history(chat_history)
+    assert mock_client.chat.completions.create.call_count == 0
+
+
+def user_messages(content, history=0):
+    return [
+        Message(role=MessageRole.system, content="Context"),
+        *(
+            Message(role=MessageRole.user, content=f"Earlier message {i}")
+            for i in range(history)
+        ),
+        Message(role=MessageRole.user, content=content),
+    ]
+
+
+def test_classify_request():
+    assert classify_request(user_messages("Hi there!"), [0.1]).name == "fast"
+    question = "What is the refund policy for damaged items?"
+    assert classify_request(user_messages(question), [0.9, 0.4]).name == "fast"
+    assert classify_request(user_messages(question), [0.5]).name == "standard"
+    assert classify_request(user_messages(question, history=6), [0.9]).name == (
+        "standard"
+    )
+    assert classify_request(user_messages(question, history=12)).name == "complex"
+    assert classify_request(user_messages("word " * 60), [0.9]).name == "complex"
+
+
+def test_select_route_is_opt_in(monkeypatch):
+    assert select_route(user_messages("Hi")) is None
+
+    monkeypatch.setattr("app.chat_gpt_client.MODEL_ROUTING_ENABLED", True)
+    assert select_route(user_messages("Hi")) is ROUTES["fast"]
+
+
+def test_estimate_cost():
+    usage = type("Usage", (), {"prompt_tokens": 1000, "completion_tokens": 100})()
+
+    assert estimate_cost("gpt-4o", usage) == pytest.approx(0.0035)
+    assert estimate_cost("unknown-model", usage) == 0
+    assert estimate_cost("gpt-4o", None) == 0
+
+
+TEST_ROUTE = Route(
+    name="test", models=["slow-model", "gpt-4o-mini"], max_tokens=200, timeout=0.05
+)
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_route_falls_back_when_a_model_is_slow(
+    mock_client, chat_history, load_env_variables
+):
+    async def create(model, **kwargs):
+        if model == "slow-model":
+            await asyncio.sleep(1)
+        response = MockResponse()
+        response.usage = type(
+            "Usage", (), {"prompt_tokens": 1000, "completion_tokens": 1000}
+        )()
+        return response
+
+    mock_client.chat.completions.create = AsyncMock(side_effect=create)
+
+    response = await get_chat_response_with_history(chat_history, route=TEST_ROUTE)
+
+    assert response == "Mocked response content"
+    calls = mock_client.chat.completions.create.call_args_list
+    assert [call.kwargs["model"] for call in calls] == ["slow-model", "gpt-4o-mini"]
+    assert all(call.kwargs["max_tokens"] == 200 for call in calls)
+    assert ROUTE_REQUESTS.values[("test", "slow-model", "fallback")] >= 1
+    assert ROUTE_REQUESTS.values[("test", "gpt-4o-mini", "ok")] >= 1
+    assert ROUTE_COST.values[("test", "gpt-4o-mini")] >= 0.00075
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_route_falls_back_when_overloaded(
+    mock_client, chat_history, load_env_variables, monkeypatch
+):
+    full = AdmissionController("llm", max_concurrency=0, queue_size=0)
+    monkeypatch.setattr("app.chat_gpt_client.llm_admission", full)
+    mock_client.chat.completions.create = AsyncMock(return_value=MockResponse())
+
+    # Every model is overloaded, so the last one's error is raised
+    with pytest.raises(OverloadedError):
+        await get_chat_response_with_history(chat_history, route=TEST_ROUTE)
+    assert ROUTE_REQUESTS.values[("test", "gpt-4o-mini", "error")] >= 1
+
+
+@pytest.mark.asyncio
+@patch("app.chat_gpt_client.client")
+async def test_stream_route_falls_back_before_the_first_token(
+    mock_client, chat_history, load_env_variables
+):
+    async def create(model, **kwargs):
+        if model == "slow-model":
+            await asyncio.sleep(1)
+        return MockStream([f"From {model}"])
+
+    mock_client.chat.completions.create = AsyncMock(side_effect=create)
+
+    deltas = [
+        delta
+        async for delta in stream_chat_response_with_history(
+            chat_history, route=TEST_ROUTE
+        )
+    ]
+
+    assert deltas == ["From gpt-4o-mini"]
+
+
+def test_get_client_is_created_on_first_use(monkeypatch):
+    monkeypatch.setattr("app.chat_gpt_client.client", None)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    with pytest.raises(ValueError, match="OPENAI_API_KEY"):
+        get_client()
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test_api_key")
+    client = get_client()
+    assert client.api_key == "test_api_key"
+    assert get_client() is client
+
+
 class MockResponse:
     def __init__(self):
         self.choices = [MockChoice()]
@@ -85,3 +415,38 @@ class MockChoice:
 class MockMessage:
     def __init__(self):
         self.content = "Mocked response content"
+
+
+class MockStream:
+    """Async iterator of streamed completion chunks."""
+
+    def __init__(self, deltas, include_empty=False, error=None):
+        self.chunks = [MockChunk(delta) for delta in deltas]
+        if include_empty:
+            # Some chunks (e.g. usage reports) arrive without any choices
+            self.chunks.insert(1, MockChunk(None, has_choices=False))
+        self.error = error
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+
+class MockChunk:
+    def __init__(self, content, has_choices=True):
+        self.choices = [MockStreamChoice(content)] if has_choices else []
+
+
+class MockStreamChoice:
+    def __init__(self, content):
+        self.delta = MockDelta(content)
+
+
+class MockDelta:
+    def __init__(self, content):
+        self.content = content
@@ -0,0 +1,137 @@
+import pytest
+from app.chat_gpt_client import Message, MessageRole
+from app.chat_history import (
+    InMemoryChatHistoryStore,
+    SQLiteChatHistoryStore,
+    create_chat_history_store,
+)
+
+
+def make_messages(*contents):
+    return [
+        Message(
+            role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=content,
+        )
+        for i, content in enumerate(contents)
+    ]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryChatHistoryStore(max_messages=4)
+    return SQLiteChatHistoryStore(path=str(tmp_path / "history.db"), max_messages=4)
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_isolated(store):
+    await store.add_messages("alice", make_messages("Hi", "Hello Alice"))
+    await store.add_messages("bob", make_messages("Hey"))
+
+    assert [m.content for m in await store.get_messages("alice")] == [
+        "Hi",
+        "Hello Alice",
+    ]
+    assert [m.content for m in await store.get_messages("bob")] == ["Hey"]
+    assert await store.get_messages("carol") == []
+
+
+@pytest.mark.asyncio
+async def test_history_is_bounded_and_limited(store):
+    await store.add_messages("alice", make_messages("1", "2", "3"))
+    await store.add_messages("alice", make_messages("4", "5", "6"))
+
+    messages = await store.get_messages("alice")
+    assert [m.content for m in messages] == ["3", "4", "5", "6"]
+    assert messages[1].role == MessageRole.user
+    assert [m.content for m in await store.get_messages("alice", limit=2)] == [
+        "5",
+        "6",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_clear(store):
+    await store.add_messages("alice", make_messages("Hi"))
+    await store.add_messages("bob", make_messages("Hey"))
+
+    await store.clear("alice")
+
+    assert await store.get_messages("alice") == []
+    assert len(await store.get_messages("bob")) == 1
+
+
+@pytest.mark.asyncio
+async def test_summarize_replaces_oldest_messages(store):
+    await store.add_messages("alice", make_messages("1", "2", "3", "4"))
+    assert await store.get_summary("alice") is None
+
+    messages = await store.get_messages("alice")
+
+    assert await store.summarize("alice", "Counted to two", messages[1].id)
+
+    assert [m.content for m in await store.get_messages("alice")] == ["3", "4"]
+    assert await store.get_summary("alice") == "Counted to two"
+
+    await store.clear("alice")
+    assert await store.get_summary("alice") is None
+
+
+@pytest.mark.asyncio
+async def test_stale_summaries_are_dropped(store):
+    await store.add_messages("alice", make_messages("1", "2", "3", "4"))
+    snapshot = await store.get_messages("alice")
+    assert await store.summarize("alice", "Counted to three", snapshot[2].id)
+
+    # Summaries made from the same snapshot, up to replaced messages
+    assert not await store.summarize("alice", "Counted to three", snapshot[2].id)
+    assert not await store.summarize("alice", "Counted to two", snapshot[1].id)
+
+    assert [m.content for m in await store.get_messages("alice")] == ["4"]
+    assert await store.get_summary("alice") == "Counted to three"
+    assert not await store.summarize("bob", "Nothing", snapshot[3].id)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "history.db")
+    await SQLiteChatHistoryStore(path=path).add_messages("alice", make_messages("Hi"))
+
+    messages = await SQLiteChatHistoryStore(path=path).get_messages("alice")
+
+    assert [m.content for m in messages] == ["Hi"]
+
+
+@pytest.mark.asyncio
+async def test_in_memory_store_evicts_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.chat_history.time.monotonic", lambda: now[0])
+    store = InMemoryChatHistoryStore(session_ttl=60)
+
+    await store.add_messages("idle", make_messages("Hi"))
+    now[0] += 30
+    await store.add_messages("active", make_messages("Hi"))
+    now[0] += 40
+    await store.get_messages("active")
+
+    assert await store.get_messages("idle") == []
+    assert len(await store.get_messages("active")) == 1
+
+
+@pytest.mark.asyncio
+async def test_in_memory_store_evicts_least_recently_used_sessions():
+    store = InMemoryChatHistoryStore(max_sessions=2)
+
+    await store.add_messages("a", make_messages("Hi"))
+    await store.add_messages("b", make_messages("Hi"))
+    await store.get_messages("a")
+    await store.add_messages("c", make_messages("Hi"))
+
+    assert await store.get_messages("b") == []
+    assert len(await store.get_messages("a")) == 1
+
+
+def test_create_chat_history_store_unknown_backend():
+    with pytest.raises(ValueError):
+        create_chat_history_store("redis")
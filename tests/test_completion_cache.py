@@ -0,0 +1,64 @@
+import pytest
+from app.chat_gpt_client import Message, MessageRole
+from app.completion_cache import CompletionCache
+
+
+def make_key(content="Hello", model="gpt-4o", temperature=0.0, max_tokens=100):
+    messages = [Message(role=MessageRole.user, content=content)]
+    return CompletionCache.make_key(messages, model, temperature, max_tokens)
+
+
+def test_make_key_covers_the_whole_request():
+    assert make_key() == make_key()
+    assert make_key() != make_key(content="Hi")
+    assert make_key() != make_key(model="gpt-4o-mini")
+    assert make_key() != make_key(temperature=0.5)
+    assert make_key() != make_key(max_tokens=200)
+
+
+def test_sampled_completions_are_only_cached_if_allowed():
+    assert CompletionCache().is_cacheable(0)
+    assert not CompletionCache().is_cacheable(0.7)
+    assert CompletionCache(allow_sampling=True).is_cacheable(0.7)
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_hits_and_misses():
+    cache = CompletionCache(max_size=10, ttl=60, directory=None)
+
+    assert await cache.get(make_key()) is None
+    await cache.set(make_key(), "Cached")
+
+    assert await cache.get(make_key()) == "Cached"
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_evicts_and_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.completion_cache.time.monotonic", lambda: now[0])
+    cache = CompletionCache(max_size=2, ttl=60, directory=None)
+
+    await cache.set("a", "A")
+    await cache.set("b", "B")
+    await cache.set("c", "C")
+    assert await cache.get("a") is None
+
+    now[0] += 61
+    assert await cache.get("b") is None
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_restarts(tmp_path):
+    cache = CompletionCache(max_size=10, ttl=60, directory=str(tmp_path))
+    await cache.set(make_key(), "Cached")
+    cache.close()
+
+    restarted = CompletionCache(max_size=10, ttl=60, directory=str(tmp_path))
+    assert await restarted.get(make_key()) == "Cached"
+    assert await restarted.get(make_key()) == "Cached"
+    assert restarted.stats["disk_hits"] == 1
+    assert restarted.stats["memory_hits"] == 1
+    restarted.close()
@@ -0,0 +1,180 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.embeddings import (
+    CachedEmbeddingProvider,
+    EmbeddingProvider,
+    OpenAIEmbeddingProvider,
+)
+
+
+class CountingEmbeddingProvider(EmbeddingProvider):
+    model = "test-model"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    async def embed(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts])
+
+
+def expected_embeddings(texts):
+    return np.array(
+        [[len(text), text.count("a"), 1.0] for text in texts], dtype=np.float32
+    )
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_only_embeds_misses(tmp_path):
+    provider = CountingEmbeddingProvider()
+    cache = CachedEmbeddingProvider(provider, str(tmp_path))
+
+    first = await cache.embed(["apple", "banana"])
+    second = await cache.embed(["banana", "cherry", "apple"])
+
+    assert provider.calls == [["apple", "banana"], ["cherry"]]
+    np.testing.assert_array_equal(first, expected_embeddings(["apple", "banana"]))
+    np.testing.assert_array_equal(
+        second, expected_embeddings(["banana", "cherry", "apple"])
+    )
+    assert second.dtype == np.float32
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 3
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_embeds_duplicates_once(tmp_path):
+    provider = CountingEmbeddingProvider()
+    cache = CachedEmbeddingProvider(provider, str(tmp_path))
+
+    embeddings = await cache.embed(["apple", "apple", "kiwi"])
+
+    assert provider.calls == [["apple", "kiwi"]]
+    np.testing.assert_array_equal(
+        embeddings, expected_embeddings(["apple", "apple", "kiwi"])
+    )
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_persists_embeddings(tmp_path):
+    await CachedEmbeddingProvider(CountingEmbeddingProvider(), str(tmp_path)).embed(
+        ["apple", "banana"]
+    )
+
+    provider = CountingEmbeddingProvider()
+    reloaded = CachedEmbeddingProvider(provider, str(tmp_path))
+    embeddings = await reloaded.embed(["banana", "apple"])
+
+    assert provider.calls == []
+    assert isinstance(reloaded.vectors, np.memmap)
+    np.testing.assert_array_equal(embeddings, expected_embeddings(["banana", "apple"]))
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_shares_directory_between_instances(tmp_path):
+    first = CachedEmbeddingProvider(CountingEmbeddingProvider(), str(tmp_path))
+    second = CachedEmbeddingProvider(CountingEmbeddingProvider(), str(tmp_path))
+
+    await first.embed(["apple"])
+    await second.embed(["banana", "apple"])
+
+    # Appends from either instance keep the index aligned with the embeddings
+    provider = CountingEmbeddingProvider()
+    reloaded = CachedEmbeddingProvider(provider, str(tmp_path))
+    embeddings = await reloaded.embed(["apple", "banana"])
+    assert provider.calls == []
+    assert len(reloaded.rows) == 2
+    np.testing.assert_array_equal(embeddings, expected_embeddings(["apple", "banana"]))
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_publishes_rows_after_vectors(
+    tmp_path, monkeypatch
+):
+    first = CachedEmbeddingProvider(CountingEmbeddingProvider(), str(tmp_path))
+    second = CachedEmbeddingProvider(CountingEmbeddingProvider(), str(tmp_path))
+    await second.embed(["apple"])
+    memmap = np.memmap
+    rows_seen = []
+
+    def recording_memmap(*args, **kwargs):
+        # embed() must not find the new row before the vectors that hold it
+        rows_seen.append(len(first.rows))
+        return memmap(*args, **kwargs)
+
+    monkeypatch.setattr(np, "memmap", recording_memmap)
+    first._refresh()
+
+    assert rows_seen == [0]
+    assert len(first.rows) == len(first.vectors) == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_coalesces_concurrent_misses(tmp_path):
+    provider = CountingEmbeddingProvider()
+    cache = CachedEmbeddingProvider(provider, str(tmp_path), batch_window=0.01)
+
+    results = await asyncio.gather(
+        cache.embed(["apple"]),
+        cache.embed(["banana", "apple"]),
+        cache.embed(["cherry"]),
+    )
+
+    assert provider.calls == [["apple", "banana", "cherry"]]
+    np.testing.assert_array_equal(results[1], expected_embeddings(["banana", "apple"]))
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_propagates_errors(tmp_path):
+    provider = CountingEmbeddingProvider(error=RuntimeError("rate limited"))
+    cache = CachedEmbeddingProvider(provider, str(tmp_path))
+
+    results = await asyncio.gather(
+        cache.embed(["apple"]), cache.embed(["apple"]), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(provider.calls) == 1
+
+    # Failed embeddings aren't cached, so they are requested again
+    provider.error = None
+    await cache.embed(["apple"])
+    assert len(provider.calls) == 2
+    assert cache.stats["size"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_provider_survives_cancelled_caller(tmp_path):
+    provider = CountingEmbeddingProvider()
+    cache = CachedEmbeddingProvider(provider, str(tmp_path))
+
+    cancelled = asyncio.create_task(cache.embed(["apple"]))
+    waiting = asyncio.create_task(cache.embed(["apple"]))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    np.testing.assert_array_equal(await waiting, expected_embeddings(["apple"]))
+    assert len(provider.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_openai_embedding_provider_batches_requests(monkeypatch):
+    requests = []
+
+    async def mock_get_embeddings(texts, model):
+        requests.append((list(texts), model))
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr("app.chat_gpt_client.get_embeddings", mock_get_embeddings)
+    provider = OpenAIEmbeddingProvider(model="embedding-model", batch_size=2)
+
+    embeddings = await provider.embed(["a", "bb", "ccc"])
+
+    assert requests == [(["a", "bb"], "embedding-model"), (["ccc"], "embedding-model")]
+    np.testing.assert_array_equal(embeddings, [[1.0], [2.0], [3.0]])
@@ -0,0 +1,119 @@
+import copy
+import json
+
+import pytest
+from app.chat_gpt_client import CHAT_GPT_DEFAULT_MAX_TOKENS, Message, MessageRole
+from app.flow_executor import FLOW_PATH, FlowExecutor, load_flow_executor
+
+with open(FLOW_PATH) as f:
+    FLOW = json.load(f)
+
+HISTORY = [
+    Message(role=MessageRole.user, content="Hi"),
+    Message(role=MessageRole.assistant, content="Hello"),
+]
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    async def get_chat_response_with_history(messages, **kwargs):
+        calls.append({"prompt": messages[-1].content, **kwargs})
+        return "A reply from the flow."
+
+    async def stream_chat_response_with_history(messages, **kwargs):
+        calls.append({"prompt": messages[-1].content, **kwargs})
+        for delta in ["A reply ", "from the flow."]:
+            yield delta
+
+    monkeypatch.setattr(
+        "app.flow_executor.get_chat_response_with_history",
+        get_chat_response_with_history,
+    )
+    monkeypatch.setattr(
+        "app.flow_executor.stream_chat_response_with_history",
+        stream_chat_response_with_history,
+    )
+    return calls
+
+
+def test_compile_orders_nodes_in_stages():
+    executor = load_flow_executor()
+
+    stages = [sorted(node.type for node in stage) for stage in executor.stages]
+
+    assert stages == [
+        ["ChatInput", "Memory"],
+        ["Prompt"],
+        ["OpenAIModel"],
+        ["ChatOutput"],
+    ]
+    assert executor.nodes["Prompt-e7qkR"].inputs == {
+        "context": "Memory-FvisK",
+        "user_message": "ChatInput-ZVCpy",
+    }
+
+
+def test_tweaks_override_fields_without_changing_the_flow():
+    flow = copy.deepcopy(FLOW)
+
+    executor = FlowExecutor(flow, {"OpenAIModel-YWZWf": {"model_name": "gpt-4o-mini"}})
+
+    assert executor.nodes["OpenAIModel-YWZWf"].params["model_name"] == "gpt-4o-mini"
+    assert flow == FLOW
+
+
+def test_unsupported_node_type():
+    flow = copy.deepcopy(FLOW)
+    flow["data"]["nodes"][0]["data"]["type"] = "AstraDB"
+
+    with pytest.raises(ValueError, match="Unsupported flow node type"):
+        FlowExecutor(flow)
+
+
+def test_cycle():
+    flow = copy.deepcopy(FLOW)
+    edge = copy.deepcopy(flow["data"]["edges"][0])
+    edge["source"], edge["target"] = edge["target"], edge["source"]
+    edge["data"]["targetHandle"]["fieldName"] = "session_id"
+    flow["data"]["edges"].append(edge)
+
+    with pytest.raises(ValueError, match="cycle"):
+        FlowExecutor(flow)
+
+
+@pytest.mark.asyncio
+async def test_run(model_calls):
+    executor = load_flow_executor()
+
+    response = await executor.run("How are you?", HISTORY)
+
+    assert response == "A reply from the flow."
+    assert model_calls == [
+        {
+            "prompt": "User: Hi\nAI: Hello\n\nUser: How are you?\nAI: ",
+            "max_tokens": CHAT_GPT_DEFAULT_MAX_TOKENS,
+            "model": "gpt-4o",
+            "temperature": 0.1,
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_keeps_the_last_messages(model_calls):
+    executor = load_flow_executor(tweaks={"Memory-FvisK": {"n_messages": 1}})
+
+    await executor.run("How are you?", HISTORY)
+
+    assert model_calls[0]["prompt"] == "AI: Hello\n\nUser: How are you?\nAI: "
+
+
+@pytest.mark.asyncio
+async def test_stream(model_calls):
+    executor = load_flow_executor()
+
+    deltas = [delta async for delta in executor.stream("How are you?", HISTORY)]
+
+    assert deltas == ["A reply ", "from the flow."]
+    assert model_calls[0]["prompt"].endswith("User: How are you?\nAI: ")
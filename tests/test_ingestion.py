@@ -0,0 +1,192 @@
+import asyncio
+import io
+
+import pytest
+
+from app.ingestion import (
+    IngestionManifest,
+    chunk_text,
+    ingest_chunks,
+    ingest_paths,
+    iter_chunks,
+    iter_files,
+    make_chunk_id,
+)
+from app.vector_store import DocumentChunk, LocalVectorStore, VectorStore
+from tests.test_vector_store import bag_of_words_embeddings
+
+
+class RecordingVectorStore(VectorStore):
+    def __init__(self, delay=0.0, fail_on_call=None):
+        self.delay = delay
+        self.fail_on_call = fail_on_call
+        self.pages = []
+        self.running = 0
+        self.max_running = 0
+
+    async def query(self, query, top_k=5):
+        return []
+
+    async def add_documents(self, documents):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if len(self.pages) + 1 == self.fail_on_call:
+                raise RuntimeError("insert failed")
+            self.pages.append(documents)
+        finally:
+            self.running -= 1
+
+
+def make_chunks(count, source="doc.txt"):
+    return [
+        DocumentChunk(
+            id=make_chunk_id(source, f"chunk {i}"), content=f"chunk {i}", source=source
+        )
+        for i in range(count)
+    ]
+
+
+def test_chunk_text_overlaps_consecutive_chunks():
+    text = " ".join(f"word{i:03d}" for i in range(200))
+
+    chunks = list(chunk_text([text], chunk_size=100, overlap=20))
+
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    # Every word is kept, and each chunk starts with the end of the previous one
+    assert set(" ".join(chunks).split()) == set(text.split())
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.split()[0] in previous.split()
+
+
+def test_chunk_text_prefers_paragraph_boundaries():
+    paragraphs = ["First paragraph " * 3, "Second paragraph " * 3]
+
+    chunks = list(chunk_text(["\n\n".join(paragraphs)], chunk_size=80, overlap=0))
+
+    assert chunks == [paragraph.strip() for paragraph in paragraphs]
+
+
+def test_chunk_text_is_independent_of_segmentation():
+    text = "".join(f"Sentence number {i}. " for i in range(100))
+    segments = [text[i : i + 7] for i in range(0, len(text), 7)]
+
+    assert list(chunk_text(segments, 120, 30)) == list(chunk_text([text], 120, 30))
+
+
+def test_chunk_text_rejects_overlap_not_less_than_chunk_size():
+    with pytest.raises(ValueError):
+        list(chunk_text(["text"], chunk_size=10, overlap=10))
+
+
+def test_iter_chunks_rejects_unsupported_files():
+    with pytest.raises(ValueError, match="Unsupported document type"):
+        list(iter_chunks("image.png", io.BytesIO(b"")))
+
+
+def test_iter_chunks_ids_depend_on_source_and_content():
+    chunks = list(iter_chunks("a.md", io.BytesIO(b"# Title\n\nSome text")))
+    same = list(iter_chunks("a.md", io.BytesIO(b"# Title\n\nSome text")))
+    other_source = list(iter_chunks("b.md", io.BytesIO(b"# Title\n\nSome text")))
+
+    assert [chunk.content for chunk in chunks] == ["# Title\n\nSome text"]
+    assert chunks[0].id == same[0].id
+    assert chunks[0].id != other_source[0].id
+
+
+def test_iter_files_finds_supported_documents(tmp_path):
+    (tmp_path / "b.md").write_text("b")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "a.txt").write_text("a")
+    (tmp_path / "image.png").write_bytes(b"")
+
+    assert list(iter_files([str(tmp_path)])) == [
+        str(tmp_path / "b.md"),
+        str(tmp_path / "nested" / "a.txt"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ingest_chunks_adds_pages_with_bounded_concurrency():
+    store = RecordingVectorStore(delay=0.01)
+
+    stats = await ingest_chunks(store, make_chunks(25), batch_size=4, max_concurrency=2)
+
+    assert stats.chunks == 25
+    assert stats.added == 25
+    assert [len(page) for page in store.pages] == [4, 4, 4, 4, 4, 4, 1]
+    assert store.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_chunks_skips_chunks_in_manifest(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    store = RecordingVectorStore()
+    await ingest_chunks(store, make_chunks(5), manifest, namespace="test")
+
+    stats = await ingest_chunks(store, make_chunks(8), manifest, namespace="test")
+
+    assert stats.skipped == 5
+    assert stats.added == 3
+    assert [chunk.content for chunk in store.pages[-1]] == [
+        "chunk 5",
+        "chunk 6",
+        "chunk 7",
+    ]
+
+    # The manifest keeps track of each store separately
+    other_stats = await ingest_chunks(
+        store, make_chunks(8), manifest, namespace="other"
+    )
+    assert other_stats.added == 8
+
+
+@pytest.mark.asyncio
+async def test_ingest_chunks_skips_duplicates_within_a_run():
+    store = RecordingVectorStore()
+
+    stats = await ingest_chunks(store, make_chunks(3) + make_chunks(3))
+
+    assert stats.added == 3
+    assert stats.skipped == 3
+
+
+@pytest.mark.asyncio
+async def test_ingest_chunks_only_records_added_pages(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    store = RecordingVectorStore(fail_on_call=2)
+
+    with pytest.raises(RuntimeError):
+        await ingest_chunks(
+            store, make_chunks(6), manifest, batch_size=2, max_concurrency=1
+        )
+
+    # The failed page and those after it are added by the next run
+    retry_store = RecordingVectorStore()
+    stats = await ingest_chunks(retry_store, make_chunks(6), manifest, batch_size=2)
+    assert stats.skipped == 2
+    assert stats.added == 4
+
+
+@pytest.mark.asyncio
+async def test_ingest_paths_is_incremental(tmp_path):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    (documents / "cats.md").write_text("Cats are small furry pets.")
+    (documents / "dogs.txt").write_text("Dogs are loyal pets.")
+    store = LocalVectorStore(bag_of_words_embeddings)
+
+    stats = await ingest_paths(store, [str(documents)])
+    assert stats.files == 2
+    assert stats.added == 2
+
+    (documents / "dogs.txt").write_text("Dogs are loyal and playful pets.")
+    stats = await ingest_paths(store, [str(documents)])
+    # The local store skips the chunks it already has
+    assert stats.chunks == 2
+    assert len(store.documents) == 3
+
+    results = await store.query("playful dogs", top_k=1)
+    assert results[0].content == "Dogs are loyal and playful pets."
+    assert results[0].metadata.source == str(documents / "dogs.txt")
@@ -0,0 +1,211 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import pytest_asyncio
+from app import langflow_client
+from app.langflow_client import (
+    TWEAKS,
+    close_http_client,
+    get_chat_response,
+    run_flow,
+    stream_chat_response,
+)
+
+
+class StubLangflowHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.requests.append(
+            json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        )
+
+        if server.failures_remaining > 0:
+            server.failures_remaining -= 1
+            self.send_json(503, {"detail": "Service unavailable"})
+        elif self.path.endswith("?stream=true"):
+            self.send_events(server.events)
+        else:
+            self.send_json(
+                200,
+                {
+                    "outputs": [
+                        {"outputs": [{"results": {"message": {"text": "Stub reply"}}}]}
+                    ]
+                },
+            )
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_events(self, events):
+        # Each event is written as its own chunk, as Langflow streams them
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = (json.dumps(event) + "\n\n").encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLangflowHandler)
+    server.connections = set()
+    server.requests = []
+    server.failures_remaining = 0
+    server.events = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        langflow_client,
+        "BASE_API_URL",
+        f"http://127.0.0.1:{server.server_address[1]}/api/v1/run",
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def shared_client():
+    # The shared client is bound to the event loop of the test that created it
+    yield
+    await close_http_client()
+
+
+@pytest.mark.asyncio
+async def test_run_flow_reuses_connections(stub_server):
+    for i in range(3):
+        response = await run_flow(f"Message {i}")
+        assert "error" not in response
+
+    assert len(stub_server.requests) == 3
+    assert len(stub_server.connections) == 1
+
+
+@pytest.mark.asyncio
+async def test_run_flow_retries_server_errors(stub_server, monkeypatch):
+    monkeypatch.setattr(langflow_client, "LANGFLOW_RETRY_BACKOFF", 0.0)
+    stub_server.failures_remaining = 2
+
+    assert await get_chat_response("Hello") == "Stub reply"
+    assert len(stub_server.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_run_flow_gives_up_after_max_retries(stub_server, monkeypatch):
+    stub_server.failures_remaining = 10
+
+    response = await langflow_client.post_with_retry(
+        langflow_client.get_http_client(),
+        f"{langflow_client.BASE_API_URL}/flow",
+        max_retries=2,
+        backoff=0.0,
+        json={},
+    )
+
+    assert response.status_code == 503
+    assert len(stub_server.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_run_flow_connection_error(monkeypatch):
+    monkeypatch.setattr(
+        langflow_client, "BASE_API_URL", "http://127.0.0.1:1/api/v1/run"
+    )
+    monkeypatch.setattr(langflow_client, "LANGFLOW_MAX_RETRIES", 1)
+
+    response = await run_flow("Hello")
+
+    assert "error" in response
+
+
+@pytest.mark.asyncio
+async def test_get_chat_response_uses_session_tweaks(stub_server):
+    assert await get_chat_response("Hello", session_id="alice") == "Stub reply"
+    assert await get_chat_response("Hello", session_id="bob") == "Stub reply"
+
+    alice, bob = stub_server.requests
+    assert alice["session_id"] == "alice"
+    assert alice["tweaks"]["TextInput-yH3PL"]["input_value"] == "alice"
+    assert bob["tweaks"]["TextInput-yH3PL"]["input_value"] == "bob"
+    # The shared tweaks are left untouched
+    assert TWEAKS["TextInput-yH3PL"] == {}
+
+
+async def collect_stream(message, session_id="alice"):
+    return [delta async for delta in stream_chat_response(message, session_id)]
+
+
+def make_end_event(text):
+    return {
+        "event": "end",
+        "data": {
+            "result": {
+                "outputs": [{"outputs": [{"results": {"message": {"text": text}}}]}]
+            }
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_yields_tokens(stub_server):
+    stub_server.events = [
+        {"event": "add_message", "data": {"text": "Hello"}},
+        {"event": "token", "data": {"chunk": "Stub"}},
+        {"event": "token", "data": {"chunk": " reply"}},
+        make_end_event("Stub reply"),
+    ]
+
+    assert await collect_stream("Hello") == ["Stub", " reply"]
+    assert stub_server.requests[0]["session_id"] == "alice"
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_falls_back_to_the_result(stub_server):
+    stub_server.events = [make_end_event("Whole reply")]
+
+    assert await collect_stream("Hello") == ["Whole reply"]
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_error_event(stub_server):
+    stub_server.events = [
+        {"event": "token", "data": {"chunk": "Partial"}},
+        {"event": "error", "data": {"error": "Model unavailable"}},
+    ]
+
+    assert await collect_stream("Hello") == [
+        "Partial",
+        "I'm sorry, but I encountered an error: Model unavailable",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_connection_error(monkeypatch):
+    monkeypatch.setattr(
+        langflow_client, "BASE_API_URL", "http://127.0.0.1:1/api/v1/run"
+    )
+    monkeypatch.setattr(langflow_client, "LANGFLOW_MAX_RETRIES", 0)
+
+    deltas = await collect_stream("Hello")
+
+    assert len(deltas) == 1
+    assert deltas[0].startswith("I'm sorry, but I encountered an error")
@@ -0,0 +1,87 @@
+import pytest
+
+from app.lexical_index import BM25Index, load_lexical_index, tokenize
+from app.vector_store import DocumentChunk
+
+
+def make_documents(*contents):
+    return [
+        DocumentChunk(id=f"id-{i}", content=content, source=f"doc{i}.txt")
+        for i, content in enumerate(contents)
+    ]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Order SKU-1234 ships in v2.1, see ERROR_CODE.") == [
+        "order",
+        "sku-1234",
+        "sku",
+        "1234",
+        "ships",
+        "in",
+        "v2.1",
+        "v2",
+        "1",
+        "see",
+        "error_code",
+        "error",
+        "code",
+    ]
+
+
+def test_search_ranks_exact_identifiers_first():
+    index = BM25Index()
+    index.add(
+        make_documents(
+            "Part SKU-1234 is a blue widget.",
+            "Part SKU-1235 is a red widget.",
+            "Widgets are sold in packs of ten.",
+        )
+    )
+
+    results = index.search("Where is SKU-1234?", top_k=2)
+
+    assert results[0].content == "Part SKU-1234 is a blue widget."
+    assert results[0].metadata.source == "doc0.txt"
+    assert results[0].metadata.score > results[1].metadata.score
+
+
+def test_search_without_matching_terms():
+    index = BM25Index()
+    assert index.search("anything") == []
+
+    index.add(make_documents("cats and dogs"))
+    assert index.search("giraffes") == []
+
+
+@pytest.mark.asyncio
+async def test_add_documents_skips_known_ids():
+    index = BM25Index()
+    await index.add_documents(make_documents("cats", "dogs"))
+
+    assert index.add(make_documents("cats", "dogs", "birds")) == 1
+    assert len(index.documents) == 3
+    results = await index.query("birds")
+    assert [result.content for result in results] == ["birds"]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "index" / "lexical_index.json")
+    index = BM25Index(path)
+    index.add(make_documents("Part SKU-1234 is blue.", "Part SKU-1235 is red."))
+    index.save()
+
+    loaded = load_lexical_index(path)
+
+    assert loaded.ids == index.ids
+    assert loaded.postings == index.postings
+    assert [r.content for r in loaded.search("SKU-1235", top_k=1)] == [
+        "Part SKU-1235 is red."
+    ]
+    # Documents added after loading extend the saved index
+    assert loaded.add(make_documents("cats", "dogs", "Part SKU-9 is green.")) == 1
+    assert loaded.search("SKU-9")[0].content == "Part SKU-9 is green."
+
+
+def test_load_lexical_index_is_disabled_without_path():
+    assert load_lexical_index("") is None
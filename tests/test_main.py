@@ -1,19 +1,43 @@
+import asyncio
+import json
+import time
+import httpx
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
-from app.main import app
+from app.admission import OverloadedError
+from app.embeddings import EmbeddingProvider
+from app.ingestion import IngestionManifest
+from app.main import app, format_sse, render_markdown
+from app.models import RagCitation
+from app.rag_service import RAGService
+from app.vector_store import ChromaDBStore, LocalVectorStore, MockVectorStore
 from bs4 import BeautifulSoup
 
 client = TestClient(app)
 
 # Mock data
 mock_rag_citations = [
-    {"source": "Source 1", "content": "Content 1"},
-    {"source": "Source 2", "content": "Content 2"},
+    RagCitation(source="Source 1", content="Content 1"),
+    RagCitation(source="Source 2", content="Content 2"),
 ]
 
 mock_chat_response = "This is a mock response from the LLM."
 
 
+@pytest.fixture(autouse=True)
+def rag_service(monkeypatch):
+    # Each test gets its own RAG service over a mock vector store, instead of the one
+    # the app creates on startup
+    store = MockVectorStore(delay=0)
+    service = RAGService(store)
+    monkeypatch.setattr("app.main.vector_store", store)
+    monkeypatch.setattr("app.main.local_vector_store", None)
+    monkeypatch.setattr("app.main.lexical_index", None)
+    monkeypatch.setattr("app.main.rag_service", service)
+    return service
+
+
 # Mock functions
 async def mock_prepare_messages_with_sources(*args, **kwargs):
     return [], mock_rag_citations
@@ -84,3 +108,536 @@ def test_sources_toggle_independent(mock_services):
     assert len(unique_ids) == len(
         all_ids
     ), f"Some IDs are not unique. All IDs: {all_ids}, Unique IDs: {unique_ids}"
+
+
+def test_chat_history_is_per_session(mock_services):
+    alice = TestClient(app)
+    bob = TestClient(app)
+
+    alice.post("/chat", data={"message": "Hello from Alice"})
+    bob.post("/chat", data={"message": "Hello from Bob"})
+
+    alice_history = alice.get("/api/chat_history").json()
+    assert [m["content"] for m in alice_history] == [
+        "Hello from Alice",
+        mock_chat_response,
+    ]
+    assert bob.get("/api/chat_history").json()[0]["content"] == "Hello from Bob"
+
+    alice.post("/api/clear_history")
+    assert alice.get("/api/chat_history").json() == []
+    assert len(bob.get("/api/chat_history").json()) == 2
+
+
+def test_long_chat_history_is_summarized(mock_services, monkeypatch):
+    summarized = []
+    prompt_summaries = []
+
+    async def summarizer(summary, messages):
+        summarized.append([m.content for m in messages])
+        return "Summary of the greetings"
+
+    async def prepare_messages_with_sources(*args, summary=None, **kwargs):
+        prompt_summaries.append(summary)
+        return [], mock_rag_citations
+
+    monkeypatch.setattr("app.main.rag_service.summarizer", summarizer)
+    monkeypatch.setattr("app.main.rag_service.summary_trigger_tokens", 1)
+    monkeypatch.setattr("app.main.rag_service.summary_keep_messages", 2)
+    monkeypatch.setattr(
+        "app.main.rag_service.prepare_messages_with_sources",
+        prepare_messages_with_sources,
+    )
+    session = TestClient(app)
+
+    for message in ["Hello", "Hi again", "Bye"]:
+        session.post("/chat", data={"message": message})
+
+    # Each exchange is summarized once a later one has been answered
+    assert summarized == [
+        ["Hello", mock_chat_response],
+        ["Hi again", mock_chat_response],
+    ]
+    assert prompt_summaries == [None, None, "Summary of the greetings"]
+    assert [m["content"] for m in session.get("/api/chat_history").json()] == [
+        "Bye",
+        mock_chat_response,
+    ]
+
+
+def test_chat_reports_server_timing_and_metrics(mock_services):
+    response = client.post("/chat", data={"message": "Hello"})
+
+    stages = [
+        entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")
+    ]
+    assert "markdown" in stages
+    assert "template" in stages
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'chat_request_duration_seconds_count{route="/chat"}' in metrics.text
+    assert 'chat_stage_duration_seconds_count{stage="markdown"}' in metrics.text
+    assert 'chat_requests_in_flight{route="/chat"} 0' in metrics.text
+
+
+async def mock_stream_chat_response_with_history(*args, **kwargs):
+    for delta in ["This is ", "a **streamed** ", "response."]:
+        yield delta
+
+
+@pytest.fixture
+def mock_streaming_services(monkeypatch):
+    monkeypatch.setattr(
+        "app.main.rag_service.prepare_messages_with_sources",
+        mock_prepare_messages_with_sources,
+    )
+    monkeypatch.setattr(
+        "app.main.stream_chat_response_with_history",
+        mock_stream_chat_response_with_history,
+    )
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = block.split("\n")
+        event = lines[0].removeprefix("event: ")
+        data = "\n".join(line.removeprefix("data: ") for line in lines[1:])
+        events.append((event, data))
+    return events
+
+
+def start_stream(message):
+    response = client.post("/chat/stream", data={"message": message})
+    assert response.status_code == 200
+    soup = BeautifulSoup(response.content, "html.parser")
+    placeholder = soup.find(attrs={"data-stream-url": True})
+    assert placeholder is not None
+    return placeholder["data-stream-url"]
+
+
+def test_format_sse_multiline_data():
+    assert format_sse("chunk", "<p>one</p>\n<p>two</p>") == (
+        "event: chunk\ndata: <p>one</p>\ndata: <p>two</p>\n\n"
+    )
+
+
+def test_format_sse_empty_data():
+    assert format_sse("done", "") == "event: done\ndata: \n\n"
+
+
+def test_chat_stream(mock_streaming_services):
+    stream_url = start_stream("Tell me about streaming")
+
+    response = client.get(stream_url)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_sse(response.text)
+    names = [event for event, _ in events]
+    assert names[-2:] == ["citations", "done"]
+    assert set(names[:-2]) == {"chunk"}
+
+    # The last chunk carries the complete rendered response
+    final_chunk = [data for event, data in events if event == "chunk"][-1]
+    assert "<strong>streamed</strong>" in final_chunk
+    assert "response." in final_chunk
+
+    citations = BeautifulSoup(dict(events)["citations"], "html.parser")
+    assert citations.find("button", attrs={"data-bs-toggle": "collapse"})
+    # The citations are loaded when the sources are expanded
+    assert "Content 1" not in citations.get_text()
+    citations_url = citations.find(attrs={"hx-get": True})["hx-get"]
+    assert "Content 1" in client.get(citations_url).text
+
+    # Each stream can only be consumed once
+    assert client.get(stream_url).status_code == 404
+
+
+@pytest.fixture
+def langflow_backend(monkeypatch):
+    calls = []
+
+    async def get_langflow_response(message, session_id):
+        calls.append((message, session_id))
+        return "A reply from **Langflow**."
+
+    async def stream_langflow_response(message, session_id):
+        calls.append((message, session_id))
+        for delta in ["A reply ", "from Langflow."]:
+            yield delta
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("The OpenAI path was used")
+
+    monkeypatch.setattr("app.main.CHAT_BACKEND", "langflow")
+    monkeypatch.setattr("app.main.get_langflow_response", get_langflow_response)
+    monkeypatch.setattr("app.main.stream_langflow_response", stream_langflow_response)
+    monkeypatch.setattr("app.main.rag_service.prepare_messages_with_sources", fail)
+    return calls
+
+
+def test_chat_with_langflow_backend(langflow_backend):
+    session = TestClient(app)
+
+    response = session.post("/chat", data={"message": "Hello"})
+
+    assert response.status_code == 200
+    assert "<strong>Langflow</strong>" in response.text
+    session_id = session.cookies["chat_session"]
+    assert langflow_backend == [("Hello", session_id)]
+    assert [m["content"] for m in session.get("/api/chat_history").json()] == [
+        "Hello",
+        "A reply from **Langflow**.",
+    ]
+
+
+def test_chat_stream_with_langflow_backend(langflow_backend):
+    events = parse_sse(client.get(start_stream("Hello")).text)
+
+    assert [event for event, _ in events][-2:] == ["citations", "done"]
+    assert "A reply from Langflow." in events[-3][1]
+    assert langflow_backend[0][0] == "Hello"
+
+
+@pytest.fixture
+def flow_backend(monkeypatch):
+    calls = []
+
+    class StubFlowExecutor:
+        async def run(self, message, history):
+            calls.append((message, [m.content for m in history]))
+            return "A reply from the **flow**."
+
+        async def stream(self, message, history):
+            calls.append((message, [m.content for m in history]))
+            for delta in ["A reply ", "from the flow."]:
+                yield delta
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("The OpenAI path was used")
+
+    monkeypatch.setattr("app.main.CHAT_BACKEND", "flow")
+    monkeypatch.setattr("app.main.flow_executor", StubFlowExecutor())
+    monkeypatch.setattr("app.main.rag_service.prepare_messages_with_sources", fail)
+    return calls
+
+
+def test_chat_with_flow_backend(flow_backend):
+    session = TestClient(app)
+
+    session.post("/chat", data={"message": "Hello"})
+    response = session.post("/chat", data={"message": "And then?"})
+
+    assert response.status_code == 200
+    assert "<strong>flow</strong>" in response.text
+    assert flow_backend == [
+        ("Hello", []),
+        ("And then?", ["Hello", "A reply from the **flow**."]),
+    ]
+
+
+def test_chat_stream_with_flow_backend(flow_backend):
+    events = parse_sse(client.get(start_stream("Hello")).text)
+
+    assert [event for event, _ in events][-2:] == ["citations", "done"]
+    assert "A reply from the flow." in events[-3][1]
+    assert flow_backend[0][0] == "Hello"
+
+
+def test_chat_stream_unknown_id():
+    assert client.get("/chat/stream/does-not-exist").status_code == 404
+
+
+def test_chat_stream_prepare_error(mock_streaming_services, monkeypatch):
+    async def failing_prepare_messages_with_sources(*args, **kwargs):
+        raise RuntimeError("Vector store unavailable")
+
+    monkeypatch.setattr(
+        "app.main.rag_service.prepare_messages_with_sources",
+        failing_prepare_messages_with_sources,
+    )
+    stream_url = start_stream("Hello")
+
+    events = parse_sse(client.get(stream_url).text)
+    assert [event for event, _ in events] == ["chunk", "done"]
+    assert "Vector store unavailable" in events[0][1]
+
+
+class SlowChromaCollection:
+    """Synchronous collection whose queries block the calling thread."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def query(self, query_embeddings, n_results):
+        time.sleep(self.delay)
+        return {
+            "documents": [["Slow content"]],
+            "metadatas": [[{"source": "slow.txt"}]],
+            "distances": [[0.2]],
+        }
+
+
+class ConstantEmbeddingProvider(EmbeddingProvider):
+    async def embed(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class MockChromaClient:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_or_create_collection(self, name, embedding_function):
+        return self.collection
+
+
+def make_slow_chroma_store(monkeypatch, delay, max_concurrency):
+    # chromadb is only imported by the ChromaDB store
+    pytest.importorskip("chromadb")
+    collection = SlowChromaCollection(delay)
+    monkeypatch.setattr(
+        "chromadb.PersistentClient",
+        lambda path, settings: MockChromaClient(collection),
+    )
+    monkeypatch.setattr("chromadb.config.Settings", lambda allow_reset: None)
+    return ChromaDBStore(
+        path="unused",
+        max_concurrency=max_concurrency,
+        embedding_provider=ConstantEmbeddingProvider(),
+    )
+
+
+async def post_concurrent_chats(count):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *(
+                http.post("/chat", data={"message": f"Question {i}"})
+                for i in range(count)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    assert all(response.status_code == 200 for response in responses)
+    return elapsed
+
+
+@pytest.mark.asyncio
+async def test_concurrent_chats_overlap_vector_queries(monkeypatch):
+    delay = 0.2
+    count = 4
+    store = make_slow_chroma_store(monkeypatch, delay, max_concurrency=count)
+    monkeypatch.setattr("app.main.rag_service.vector_stores", [store])
+    monkeypatch.setattr(
+        "app.main.get_chat_response_with_history", mock_get_chat_response_with_history
+    )
+
+    elapsed = await post_concurrent_chats(count)
+
+    # Serialized queries would take count * delay
+    assert elapsed < delay * count * 0.6
+
+
+@pytest.mark.asyncio
+async def test_chroma_concurrency_is_bounded(monkeypatch):
+    delay = 0.1
+    count = 4
+    store = make_slow_chroma_store(monkeypatch, delay, max_concurrency=1)
+    monkeypatch.setattr("app.main.rag_service.vector_stores", [store])
+    monkeypatch.setattr(
+        "app.main.get_chat_response_with_history", mock_get_chat_response_with_history
+    )
+
+    elapsed = await post_concurrent_chats(count)
+
+    assert elapsed >= delay * count
+
+
+def test_ingest_disabled_by_default():
+    response = client.post(
+        "/api/ingest", files={"files": ("notes.txt", b"Some notes", "text/plain")}
+    )
+    assert response.status_code == 404
+
+
+def test_ingest_adds_uploaded_documents(monkeypatch, tmp_path):
+    added = []
+
+    async def mock_add_documents(documents):
+        added.extend(documents)
+
+    monkeypatch.setattr("app.main.vector_store.add_documents", mock_add_documents)
+    monkeypatch.setattr(
+        "app.main.ingestion_manifest",
+        IngestionManifest(str(tmp_path / "manifest.sqlite3")),
+    )
+    files = [
+        ("files", ("notes.txt", b"Some notes", "text/plain")),
+        ("files", ("readme.md", b"# Readme", "text/markdown")),
+    ]
+
+    response = client.post("/api/ingest", files=files)
+    assert response.status_code == 200
+    assert response.json() == {"files": 2, "chunks": 2, "skipped": 0, "added": 2}
+    assert [document.source for document in added] == ["notes.txt", "readme.md"]
+
+    response = client.post("/api/ingest", files=files)
+    assert response.json()["skipped"] == 2
+
+    response = client.post(
+        "/api/ingest", files={"files": ("image.png", b"", "image/png")}
+    )
+    assert response.status_code == 400
+
+
+def test_ingest_saves_the_local_store(monkeypatch, tmp_path):
+    store = LocalVectorStore(ConstantEmbeddingProvider(), path=str(tmp_path / "index"))
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr("app.main.vector_store", store)
+    monkeypatch.setattr("app.main.local_vector_store", store)
+    monkeypatch.setattr("app.main.ingestion_manifest", manifest)
+    files = {"files": ("notes.txt", b"Some notes", "text/plain")}
+
+    response = client.post("/api/ingest", files=files)
+
+    assert response.json()["added"] == 1
+    saved = LocalVectorStore(ConstantEmbeddingProvider(), path=str(tmp_path / "index"))
+    assert [document["source"] for document in saved.documents] == ["notes.txt"]
+    # The store skips the chunks it has itself, so the manifest isn't used
+    with manifest._connect() as connection:
+        assert connection.execute("SELECT COUNT(*) FROM chunks").fetchone() == (0,)
+
+    client.post("/api/ingest", files=files)
+    assert len(store.documents) == 1
+
+
+def test_batch_chat_disabled_by_default():
+    response = client.post("/api/batch_chat", content=b'{"message": "Hello"}\n')
+    assert response.status_code == 404
+
+
+def test_batch_chat_streams_answers(monkeypatch):
+    async def mock_get_chat_response_with_history(messages, **kwargs):
+        return f"Answer to {messages[-1].content}"
+
+    monkeypatch.setattr("app.main.BATCH_CHAT_API_ENABLED", True)
+    monkeypatch.setattr(
+        "app.batch_chat.get_chat_response_with_history",
+        mock_get_chat_response_with_history,
+    )
+    body = b'{"message": "Hello", "id": "a"}\n{"message": "Bye", "id": "b"}\n'
+
+    response = client.post("/api/batch_chat", content=body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    answers = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted((answer["id"], answer["response"]) for answer in answers) == [
+        ("a", "Answer to Hello"),
+        ("b", "Answer to Bye"),
+    ]
+    assert all(answer["citations"] for answer in answers)
+    assert all(answer["timings"]["total_ms"] > 0 for answer in answers)
+
+
+def test_chat_answers_503_when_overloaded(mock_services, monkeypatch):
+    async def overloaded(*args, **kwargs):
+        raise OverloadedError("llm", retry_after=3)
+
+    monkeypatch.setattr("app.main.get_chat_response_with_history", overloaded)
+
+    response = client.post("/chat", data={"message": "Hello"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert "busy" in response.json()["detail"]
+
+    # HTMX requests get a bot message to show in the chat
+    response = client.post(
+        "/chat", data={"message": "Hello"}, headers={"HX-Request": "true"}
+    )
+    assert response.status_code == 503
+    soup = BeautifulSoup(response.text, "html.parser")
+    assert "busy" in soup.find("div", class_="message-content").text
+
+
+def test_citations_load_when_sources_expand(mock_services, monkeypatch):
+    citations = [RagCitation(source="guide.md", content="<b>Bold</b> claim")]
+
+    async def prepare_messages_with_sources(*args, **kwargs):
+        return [], citations
+
+    monkeypatch.setattr(
+        "app.main.rag_service.prepare_messages_with_sources",
+        prepare_messages_with_sources,
+    )
+
+    response = client.post("/chat", data={"message": "Hello"})
+    soup = BeautifulSoup(response.text, "html.parser")
+    sources = soup.find("ul", attrs={"hx-get": True})
+    assert sources.get_text(strip=True) == ""
+    assert "show.bs.collapse" in sources["hx-trigger"]
+
+    response = client.get(sources["hx-get"])
+    assert response.status_code == 200
+    item = BeautifulSoup(response.text, "html.parser").find("li")
+    assert item.get_text(strip=True) == "<b>Bold</b> claim..."
+    assert item.find("i")["title"] == "guide.md"
+
+    assert client.get("/citations/unknown").status_code == 404
+
+
+def test_render_markdown_escapes_raw_html():
+    html = render_markdown("**Hi** <script>alert(1)</script>\n\n| a |\n|---|\n| 1 |")
+
+    assert "<strong>Hi</strong>" in html
+    assert "<script>" not in html
+    assert "&lt;script&gt;" in html
+    assert "<table>" in html
+
+
+def test_healthz():
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+
+def test_readyz_after_startup(monkeypatch):
+    created = []
+
+    def create_vector_store(collection_name):
+        created.append(collection_name)
+        return MockVectorStore(delay=0)
+
+    monkeypatch.setattr("app.main.rag_service", None)
+    monkeypatch.setattr("app.main.create_vector_store", create_vector_store)
+
+    # Before the lifespan has run, the worker isn't ready
+    response = TestClient(app).get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["checks"]["startup"] == "pending"
+    assert response.json()["checks"]["vector_store"] == "pending"
+    assert created == []
+
+    with TestClient(app) as started_client:
+        response = started_client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["checks"] == {
+            "startup": "ok",
+            "vector_store": "ok",
+            "openai": "ok",
+        }
+    # The vector store is created once, on startup
+    assert len(created) == 1
+
+
+def test_readyz_without_openai_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY")
+    monkeypatch.setattr("app.chat_gpt_client.client", None)
+
+    with TestClient(app) as started_client:
+        response = started_client.get("/readyz")
+        assert response.status_code == 503
+        assert "OPENAI_API_KEY" in response.json()["checks"]["openai"]
+        # The app still serves requests that don't need OpenAI
+        assert started_client.get("/healthz").status_code == 200
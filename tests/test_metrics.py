@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+from app.metrics import (
+    MetricsRegistry,
+    RequestTimer,
+    current_request_timer,
+    record_token_usage,
+    registry,
+    timed_stage,
+)
+
+
+def test_counter_and_gauge_render():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("requests_total", "Requests.", ["route"])
+    gauge = metrics.gauge("in_flight", "In flight.")
+
+    counter.inc(route="/chat")
+    counter.inc(2, route="/chat")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    rendered = metrics.render()
+    assert "# TYPE requests_total counter" in rendered
+    assert 'requests_total{route="/chat"} 3' in rendered
+    assert "# TYPE in_flight gauge" in rendered
+    assert "in_flight 1" in rendered
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("latency", "Latency.", ["stage"], buckets=(0.1, 1))
+
+    histogram.observe(0.05, stage="llm")
+    histogram.observe(0.1, stage="llm")
+    histogram.observe(0.5, stage="llm")
+    histogram.observe(5, stage="llm")
+
+    lines = metrics.render().splitlines()
+    assert 'latency_bucket{stage="llm",le="0.1"} 2' in lines
+    assert 'latency_bucket{stage="llm",le="1"} 3' in lines
+    assert 'latency_bucket{stage="llm",le="+Inf"} 4' in lines
+    assert 'latency_sum{stage="llm"} 5.65' in lines
+    assert 'latency_count{stage="llm"} 4' in lines
+
+
+def test_timed_stage_records_to_current_request():
+    timer = RequestTimer()
+    token = current_request_timer.set(timer)
+    try:
+        with timed_stage("retrieval"):
+            pass
+    finally:
+        current_request_timer.reset(token)
+
+    assert [stage for stage, _ in timer.stages] == ["retrieval"]
+    assert timer.server_timing().startswith("retrieval;dur=")
+
+
+def test_record_token_usage():
+    usage = SimpleNamespace(prompt_tokens=12, completion_tokens=34)
+
+    record_token_usage("test-model", usage)
+    record_token_usage("test-model", None)
+
+    rendered = registry.render()
+    assert 'chat_llm_tokens_total{model="test-model",type="prompt"} 12' in rendered
+    assert 'chat_llm_tokens_total{model="test-model",type="completion"} 34' in rendered
@@ -0,0 +1,388 @@
+import asyncio
+import time
+import pytest
+from app.chat_gpt_client import Message, MessageRole
+from app.context_builder import (
+    ApproximateTokenizer,
+    ContextBuilder,
+    TOKENS_PER_MESSAGE,
+)
+from app.lexical_index import BM25Index
+from app.rag_service import RAGService
+from app.vector_store import (
+    DocumentChunk,
+    VectorStore,
+    VectorStoreMetadata,
+    VectorStoreResult,
+    reciprocal_rank_fusion,
+)
+
+
+class WordTokenizer:
+    """Tokenizer with one token per whitespace-separated word."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def make_result(content, score, source="doc.txt"):
+    return VectorStoreResult(
+        content=content, metadata=VectorStoreMetadata(score=score, source=source)
+    )
+
+
+class StaticVectorStore(VectorStore):
+    def __init__(self, results):
+        self.results = results
+
+    async def query(self, query, top_k=5):
+        return self.results[:top_k]
+
+
+def make_builder(**kwargs):
+    defaults = dict(
+        token_budget=1000,
+        max_document_tokens=1000,
+        min_chunk_tokens=2,
+        tokenizer=WordTokenizer(),
+    )
+    return ContextBuilder(**{**defaults, **kwargs})
+
+
+def test_documents_are_ranked_by_score():
+    builder = make_builder()
+    results = [
+        make_result("low relevance", 0.2, "low.txt"),
+        make_result("high relevance", 0.9, "high.txt"),
+    ]
+
+    prompt = builder.build("System", results, [], "Question")
+
+    assert prompt.messages[0].content.endswith("high relevance\nlow relevance")
+    assert [c.source for c in prompt.citations] == ["high.txt", "low.txt"]
+
+
+def test_documents_over_budget_are_truncated_then_dropped():
+    builder = make_builder(max_document_tokens=7)
+    results = [
+        make_result("one two three", 0.9, "first.txt"),
+        make_result("four five six seven", 0.8, "second.txt"),
+        make_result("eight", 0.7, "third.txt"),
+    ]
+
+    prompt = builder.build("System", results, [], "Question")
+
+    # The first document takes 4 tokens, leaving 2 for the truncated second one
+    assert [c.source for c in prompt.citations] == ["first.txt", "second.txt"]
+    assert prompt.citations[1].content == "four five"
+
+
+def test_small_remainders_drop_the_document():
+    builder = make_builder(max_document_tokens=5, min_chunk_tokens=3)
+    results = [
+        make_result("one two three", 0.9, "first.txt"),
+        make_result("four five six seven", 0.8, "second.txt"),
+    ]
+
+    prompt = builder.build("System", results, [], "Question")
+
+    assert [c.source for c in prompt.citations] == ["first.txt"]
+
+
+def test_history_is_trimmed_oldest_first():
+    history = [
+        Message(role=MessageRole.user, content="oldest message"),
+        Message(role=MessageRole.assistant, content="middle message"),
+        Message(role=MessageRole.user, content="newest message"),
+    ]
+    builder = make_builder(token_budget=100)
+    fixed = builder.build("System", [], [], "Question").prompt_tokens
+
+    message_tokens = 2 + TOKENS_PER_MESSAGE
+    builder = make_builder(token_budget=fixed + 2 * message_tokens)
+    prompt = builder.build("System", [], history, "Question")
+
+    assert [m.content for m in prompt.messages[1:-1]] == [
+        "middle message",
+        "newest message",
+    ]
+    assert prompt.prompt_tokens == fixed + 2 * message_tokens
+    assert prompt.prompt_tokens <= builder.token_budget
+
+
+def test_approximate_tokenizer_round_trips():
+    tokenizer = ApproximateTokenizer()
+    tokens = tokenizer.encode("Hello, world!")
+
+    assert len(tokens) == 4
+    assert tokenizer.decode(tokens) == "Hello, world!"
+    assert tokenizer.decode(tokens[:2]) == "Hello, w"
+
+
+@pytest.mark.asyncio
+async def test_prepare_messages_with_sources_uses_context_builder():
+    store = StaticVectorStore([make_result("relevant content", 0.9, "a.txt")])
+    service = RAGService(store, context_builder=make_builder())
+
+    prompt = await service.prepare_prompt("System", [], "Question")
+    messages, citations = await service.prepare_messages_with_sources(
+        "System", [], "Question"
+    )
+
+    assert messages == prompt.messages
+    assert messages[0].content == "System\n\nRelevant context: relevant content"
+    assert messages[-1] == Message(role=MessageRole.user, content="Question")
+    assert [c.source for c in citations] == ["a.txt"]
+    assert prompt.prompt_tokens > 0
+
+
+@pytest.mark.asyncio
+async def test_prepare_prompt_includes_summary():
+    service = RAGService(StaticVectorStore([]), context_builder=make_builder())
+
+    prompt = await service.prepare_prompt(
+        "System", [], "Question", summary="The user asked about pricing"
+    )
+
+    assert prompt.messages[0].content.startswith(
+        "System\n\nSummary of the earlier conversation: The user asked about pricing"
+    )
+
+
+def make_history(count, words=10):
+    return [
+        Message(
+            role=MessageRole.user if i % 2 == 0 else MessageRole.assistant,
+            content=" ".join([f"message{i}"] * words),
+        )
+        for i in range(count)
+    ]
+
+
+def test_count_messages_to_summarize():
+    service = RAGService(
+        StaticVectorStore([]),
+        context_builder=make_builder(),
+        summary_trigger_tokens=100,
+        summary_keep_messages=3,
+    )
+    message_tokens = 10 + TOKENS_PER_MESSAGE
+
+    assert service.count_messages_to_summarize(make_history(2)) == 0
+    assert service.count_messages_to_summarize(make_history(100 // message_tokens)) == 0
+    # Whole exchanges are summarized, so the kept history starts with a user message
+    assert service.count_messages_to_summarize(make_history(9)) == 6
+    assert service.count_messages_to_summarize(make_history(10)) == 6
+
+    service.summary_trigger_tokens = 0
+    assert service.count_messages_to_summarize(make_history(10)) == 0
+
+
+@pytest.mark.asyncio
+async def test_update_summary_extends_the_summary_with_older_messages():
+    calls = []
+
+    async def summarizer(summary, messages):
+        calls.append((summary, [m.content.split()[0] for m in messages]))
+        return "New summary"
+
+    service = RAGService(
+        StaticVectorStore([]),
+        context_builder=make_builder(),
+        summarizer=summarizer,
+        summary_trigger_tokens=50,
+        summary_keep_messages=2,
+    )
+
+    assert await service.update_summary(None, make_history(2)) is None
+    assert await service.update_summary("Old summary", make_history(6)) == (
+        "New summary",
+        4,
+    )
+    assert calls == [("Old summary", ["message0", "message1", "message2", "message3"])]
+
+
+class DelayedVectorStore(VectorStore):
+    def __init__(self, results, delay=0.0, error=None):
+        self.results = results
+        self.delay = delay
+        self.error = error
+        self.cancelled = False
+        self.queries = 0
+
+    async def query(self, query, top_k=5):
+        self.queries += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.results[:top_k]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_merges_and_dedupes_across_stores():
+    first = DelayedVectorStore(
+        [make_result("shared", 0.6, "first.txt"), make_result("only first", 0.5)]
+    )
+    second = DelayedVectorStore(
+        [make_result("shared", 0.8, "second.txt"), make_result("only second", 0.7)]
+    )
+    service = RAGService([first, second], context_builder=make_builder())
+
+    results = await service.retrieve("query", top_k=3)
+
+    assert [r.content for r in results] == ["shared", "only second", "only first"]
+    assert results[0].metadata.source == "second.txt"
+
+
+@pytest.mark.asyncio
+async def test_retrieve_skips_slow_stores():
+    fast = DelayedVectorStore([make_result("fast", 0.5)])
+    slow = DelayedVectorStore([make_result("slow", 0.9)], delay=5)
+    service = RAGService(
+        [fast, slow], context_builder=make_builder(), store_timeout=0.1
+    )
+
+    start = time.perf_counter()
+    results = await service.retrieve("query")
+
+    assert time.perf_counter() - start < 1
+    assert [r.content for r in results] == ["fast"]
+    await asyncio.sleep(0)  # Let the cancellation reach the slow query
+    assert slow.cancelled
+
+
+@pytest.mark.asyncio
+async def test_retrieve_skips_failing_stores():
+    working = DelayedVectorStore([make_result("working", 0.5)])
+    failing = DelayedVectorStore([], error=RuntimeError("Store down"))
+    service = RAGService([working, failing], context_builder=make_builder())
+
+    assert [r.content for r in await service.retrieve("query")] == ["working"]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_raises_when_every_store_fails():
+    failing = DelayedVectorStore([], error=RuntimeError("Store down"))
+    service = RAGService([failing], context_builder=make_builder())
+
+    with pytest.raises(RuntimeError, match="Store down"):
+        await service.retrieve("query")
+
+
+@pytest.mark.asyncio
+async def test_retrieve_coalesces_identical_concurrent_queries():
+    store = DelayedVectorStore([make_result("shared", 0.5)], delay=0.01)
+    service = RAGService(store, context_builder=make_builder())
+
+    results = await asyncio.gather(
+        service.retrieve("popular question"),
+        service.retrieve("popular question"),
+        service.retrieve("other question"),
+    )
+
+    assert store.queries == 2
+    assert [r.content for r in results[0]] == ["shared"]
+    assert results[0] is not results[1]
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    vector = [make_result("a", 0.9), make_result("b", 0.8), make_result("c", 0.7)]
+    lexical = [make_result("c", 12.0), make_result("d", 9.0), make_result("b", 3.0)]
+
+    fused = reciprocal_rank_fusion([vector, lexical], top_k=3, k=60)
+
+    # Ranked second and third in both searches, b and c beat a and d
+    assert [r.content for r in fused] == ["c", "b", "a"]
+    assert fused[0].metadata.score == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[1].metadata.score == pytest.approx(1 / 62 + 1 / 63)
+
+
+@pytest.mark.asyncio
+async def test_retrieve_fuses_lexical_and_vector_rankings():
+    vector_store = DelayedVectorStore(
+        [make_result("Resetting a password", 0.9), make_result("Error codes", 0.8)]
+    )
+    lexical_index = BM25Index()
+    lexical_index.add(
+        [
+            DocumentChunk(id="1", content="Error codes", source="errors.md"),
+            DocumentChunk(id="2", content="Error ERR-4012 means", source="e.md"),
+        ]
+    )
+    service = RAGService(
+        vector_store, context_builder=make_builder(), lexical_index=lexical_index
+    )
+
+    results = await service.retrieve("What does ERR-4012 mean?", top_k=3)
+
+    # The exact identifier match, missed by the vector store, is retrieved
+    assert [r.content for r in results] == [
+        "Resetting a password",
+        "Error ERR-4012 means",
+        "Error codes",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_falls_back_to_lexical_results():
+    failing = DelayedVectorStore([], error=RuntimeError("Store down"))
+    lexical_index = BM25Index()
+    lexical_index.add([DocumentChunk(id="1", content="ERR-4012", source="e.md")])
+    service = RAGService(
+        failing, context_builder=make_builder(), lexical_index=lexical_index
+    )
+
+    results = await service.retrieve("ERR-4012")
+
+    assert [r.content for r in results] == ["ERR-4012"]
+
+
+class BatchVectorStore(VectorStore):
+    def __init__(self):
+        self.batches = []
+
+    async def query(self, query, top_k=5):
+        raise AssertionError("Batches are queried at once")
+
+    async def query_batch(self, queries, top_k=5):
+        self.batches.append((queries, top_k))
+        return [
+            [make_result(f"{query} answer", 0.9), make_result("shared", 0.5)]
+            for query in queries
+        ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_batch_queries_each_store_once():
+    store = BatchVectorStore()
+    service = RAGService(store, fetch_multiplier=2)
+
+    results = await service.retrieve_batch(["cats", "dogs"], top_k=1)
+
+    assert store.batches == [(["cats", "dogs"], 2)]
+    assert [[r.content for r in query_results] for query_results in results] == [
+        ["cats answer"],
+        ["dogs answer"],
+    ]
+    assert await service.retrieve_batch([]) == []
+
+
+@pytest.mark.asyncio
+async def test_prepare_prompts_without_history():
+    service = RAGService(BatchVectorStore(), context_builder=make_builder())
+
+    prompts = await service.prepare_prompts("System", ["cats", "dogs"], top_k=1)
+
+    assert [prompt.messages[-1].content for prompt in prompts] == ["cats", "dogs"]
+    assert [prompt.citations[0].content for prompt in prompts] == [
+        "cats answer",
+        "dogs answer",
+    ]
+    assert all(len(prompt.messages) == 2 for prompt in prompts)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from app.rag_service import RAGService
+from app.reranking import (
+    diversify,
+    filter_by_score,
+    maximal_marginal_relevance,
+    term_vectors,
+)
+from app.vector_store import VectorStore, VectorStoreMetadata, VectorStoreResult
+
+
+def make_result(content, score, source="doc.txt"):
+    return VectorStoreResult(
+        content=content, metadata=VectorStoreMetadata(score=score, source=source)
+    )
+
+
+class RecordingVectorStore(VectorStore):
+    def __init__(self, results):
+        self.results = results
+        self.top_ks = []
+
+    async def query(self, query, top_k=5):
+        self.top_ks.append(top_k)
+        return self.results[:top_k]
+
+
+def test_filter_by_score():
+    results = [make_result("a", 0.9), make_result("b", 0.5), make_result("c", 0.7)]
+
+    assert [r.content for r in filter_by_score(results, 0.7)] == ["a", "c"]
+
+
+def test_term_vectors_are_normalized():
+    vectors = term_vectors(["the cat sat", "the cat sat", "dogs bark", ""])
+    similarity = vectors @ vectors.T
+
+    assert similarity[0, 1] == pytest.approx(1)
+    assert similarity[0, 2] == pytest.approx(0)
+    assert np.linalg.norm(vectors[3]) == 0
+
+
+def test_maximal_marginal_relevance_skips_redundant_candidates():
+    relevance = np.array([1.0, 0.95, 0.5])
+    # The first two candidates are near duplicates
+    similarity = np.array([[1.0, 0.98, 0.1], [0.98, 1.0, 0.1], [0.1, 0.1, 1.0]])
+
+    assert maximal_marginal_relevance(relevance, similarity, 2, 0.5) == [0, 2]
+    assert maximal_marginal_relevance(relevance, similarity, 2, 1.0) == [0, 1]
+    assert maximal_marginal_relevance(relevance, similarity, 5, 0.5) == [0, 2, 1]
+
+
+def test_diversify_drops_near_duplicate_chunks():
+    results = [
+        make_result("Refunds are issued within 14 days of the return.", 0.92),
+        make_result("Refunds are issued within 14 days of a return.", 0.91),
+        make_result("Shipping is free for orders over 50 euros.", 0.8),
+    ]
+
+    assert [r.metadata.score for r in diversify(results, 2)] == [0.92, 0.8]
+    assert diversify(results, 2, lambda_=1) == results[:2]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_over_fetches_and_drops_low_scores():
+    store = RecordingVectorStore(
+        [
+            make_result("Refunds take 14 days", 0.9),
+            make_result("Shipping is free", 0.8),
+            make_result("Unrelated chunk", 0.3),
+        ]
+    )
+    service = RAGService(store, fetch_multiplier=3, min_score=0.5)
+
+    results = await service.retrieve("refunds", top_k=2)
+
+    assert store.top_ks == [6]
+    assert [r.content for r in results] == ["Refunds take 14 days", "Shipping is free"]
+    assert await service.retrieve("refunds", top_k=5) == results
+
+
+@pytest.mark.asyncio
+async def test_retrieve_applies_the_reranker():
+    store = RecordingVectorStore(
+        [make_result("first", 0.9), make_result("second", 0.8)]
+    )
+    calls = []
+
+    async def reranker(query, candidates):
+        calls.append((query, [c.content for c in candidates]))
+        return list(reversed(candidates))
+
+    service = RAGService(store, reranker=reranker, mmr_lambda=1)
+
+    results = await service.retrieve("query", top_k=1)
+
+    assert calls == [("query", ["first", "second"])]
+    assert [r.content for r in results] == ["second"]
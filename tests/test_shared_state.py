@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.shared_state import (
+    InMemoryStateStore,
+    SQLiteStateStore,
+    create_state_store,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryStateStore(max_size=10, ttl=60)
+    return SQLiteStateStore("test", ttl=60, path=str(tmp_path / "state.sqlite3"))
+
+
+@pytest.mark.asyncio
+async def test_set_get_and_pop(store):
+    await store.set("key", "value")
+
+    assert await store.get("key") == "value"
+    assert await store.pop("key") == "value"
+    # Values can only be taken once
+    assert await store.pop("key") is None
+    assert await store.get("key") is None
+    assert await store.get("unknown") is None
+
+
+@pytest.mark.asyncio
+async def test_values_expire(store):
+    store.ttl = 0.05
+    await store.set("key", "value")
+    await asyncio.sleep(0.1)
+
+    assert await store.get("key") is None
+    assert await store.pop("key") is None
+
+
+@pytest.mark.asyncio
+async def test_in_memory_store_drops_oldest_values():
+    store = InMemoryStateStore(max_size=2, ttl=60)
+    for key in ["a", "b", "c"]:
+        await store.set(key, key)
+
+    assert await store.get("a") is None
+    assert await store.get("c") == "c"
+
+
+@pytest.mark.asyncio
+async def test_sqlite_stores_share_values_between_workers(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    worker_1 = SQLiteStateStore("streams", ttl=60, path=path)
+    worker_2 = SQLiteStateStore("streams", ttl=60, path=path)
+    other_namespace = SQLiteStateStore("citations", ttl=60, path=path)
+
+    await worker_1.set("message", "pending")
+
+    assert await other_namespace.get("message") is None
+    results = await asyncio.gather(worker_1.pop("message"), worker_2.pop("message"))
+    assert sorted(results, key=str) == [None, "pending"]
+
+
+def test_create_state_store_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        create_state_store("test", 10, 60, backend="redis")
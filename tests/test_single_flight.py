@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app.single_flight import SingleFlight
+
+
+class CountingCall:
+    def __init__(self, result="result", error=None, delay=0.01):
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_with_the_same_key_share_one_call():
+    single_flight = SingleFlight("test")
+    call = CountingCall()
+
+    results = await asyncio.gather(*(single_flight.do("key", call) for _ in range(5)))
+
+    assert results == ["result"] * 5
+    assert call.calls == 1
+    assert len(single_flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_with_different_keys_run_separately():
+    single_flight = SingleFlight("test")
+    call = CountingCall()
+
+    await asyncio.gather(single_flight.do("a", call), single_flight.do("b", call))
+
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_completed_calls_are_not_reused():
+    single_flight = SingleFlight("test")
+    call = CountingCall()
+
+    await single_flight.do("key", call)
+    await single_flight.do("key", call)
+
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller_and_are_not_kept():
+    single_flight = SingleFlight("test")
+    call = CountingCall(error=RuntimeError("upstream failed"))
+
+    results = await asyncio.gather(
+        single_flight.do("key", call),
+        single_flight.do("key", call),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert call.calls == 1
+
+    call.error = None
+    assert await single_flight.do("key", call) == "result"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_others():
+    single_flight = SingleFlight("test")
+    call = CountingCall()
+
+    first = asyncio.create_task(single_flight.do("key", call))
+    second = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "result"
+    assert first.cancelled()
+    assert call.calls == 1
+    assert not call.cancelled
+
+
+@pytest.mark.asyncio
+async def test_call_is_cancelled_with_its_last_caller():
+    single_flight = SingleFlight("test")
+    call = CountingCall(delay=5)
+
+    task = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0)
+
+    assert call.cancelled
+    # A new caller doesn't join the cancelled call
+    call.delay = 0
+    assert await single_flight.do("key", call) == "result"
@@ -0,0 +1,452 @@
+import os
+import subprocess
+import sys
+import zlib
+import numpy as np
+import pytest
+from app.embeddings import EmbeddingProvider
+from app.vector_store import (
+    AstraDBStore,
+    CachedVectorStore,
+    ChromaDBStore,
+    DocumentChunk,
+    LocalVectorStore,
+    MockVectorStore,
+    VectorStore,
+    VectorStoreMetadata,
+    VectorStoreResult,
+    create_vector_store,
+)
+
+
+@pytest.fixture
+def astra_env(monkeypatch):
+    monkeypatch.setenv(
+        "ASTRA_DB_ENDPOINT",
+        "https://01234567-89ab-cdef-0123-456789abcdef-us-east1.apps.astra.datastax.com",
+    )
+    monkeypatch.setenv("ASTRA_DB_TOKEN", "test_token")
+
+
+class MockAsyncCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class MockAsyncCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.find_kwargs = None
+
+    def find(self, **kwargs):
+        self.find_kwargs = kwargs
+        return MockAsyncCursor(self.documents)
+
+
+@pytest.mark.asyncio
+async def test_astra_db_store_query_uses_async_cursor(astra_env):
+    store = AstraDBStore(collection_name="test_collection")
+    store.collection = MockAsyncCollection(
+        [
+            {
+                "content": "First",
+                "$similarity": 0.9,
+                "metadata": {"source": "a.txt"},
+            },
+            {
+                "content": "First",
+                "$similarity": 0.8,
+                "metadata": {"source": "a.txt"},
+            },
+            {"content": "Second", "$similarity": 0.7, "metadata": {}},
+        ]
+    )
+
+    results = await store.query("What is first?", top_k=5)
+
+    assert store.collection.find_kwargs["sort"] == {"$vectorize": "What is first?"}
+    assert all(isinstance(result, VectorStoreResult) for result in results)
+    assert [result.content for result in results] == ["First", "Second"]
+    assert results[0].metadata.score == 0.9
+    assert results[1].metadata.source == "Unknown"
+
+
+class CountingVectorStore(VectorStore):
+    def __init__(self):
+        self.calls = []
+
+    async def query(self, query, top_k=5):
+        self.calls.append((query, top_k))
+        return [
+            VectorStoreResult(
+                content=f"{query} #{len(self.calls)}",
+                metadata=VectorStoreMetadata(score=1.0, source="counting.txt"),
+            )
+        ]
+
+
+@pytest.mark.asyncio
+async def test_cached_vector_store_hits_on_normalized_query():
+    backend = CountingVectorStore()
+    store = CachedVectorStore(backend, max_size=10, ttl=60)
+
+    first = await store.query("What is  RAG?", top_k=3)
+    second = await store.query("  what is rag?", top_k=3)
+
+    assert len(backend.calls) == 1
+    assert [r.content for r in first] == [r.content for r in second]
+    assert store.stats["hits"] == 1
+    assert store.stats["misses"] == 1
+    assert store.stats["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_cached_vector_store_query_batch_only_fetches_misses():
+    backend = CountingVectorStore()
+    store = CachedVectorStore(backend, max_size=10, ttl=60)
+    await store.query("cached", top_k=3)
+
+    results = await store.query_batch(["Cached", "new", "new "], top_k=3)
+
+    assert backend.calls == [("cached", 3), ("new", 3)]
+    assert [[r.content for r in query_results] for query_results in results] == [
+        ["cached #1"],
+        ["new #2"],
+        ["new #2"],
+    ]
+    assert await store.query("new", top_k=3) == results[1]
+    assert len(backend.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_vector_store_query_batch_defaults_to_concurrent_queries():
+    backend = CountingVectorStore()
+
+    results = await backend.query_batch(["a", "b"], top_k=2)
+
+    assert backend.calls == [("a", 2), ("b", 2)]
+    assert [query_results[0].content for query_results in results] == ["a #1", "b #2"]
+
+
+@pytest.mark.asyncio
+async def test_cached_vector_store_keys_on_top_k():
+    backend = CountingVectorStore()
+    store = CachedVectorStore(backend, max_size=10, ttl=60)
+
+    await store.query("question", top_k=3)
+    await store.query("question", top_k=5)
+
+    assert backend.calls == [("question", 3), ("question", 5)]
+
+
+@pytest.mark.asyncio
+async def test_cached_vector_store_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.vector_store.time.monotonic", lambda: now[0])
+    backend = CountingVectorStore()
+    store = CachedVectorStore(backend, max_size=10, ttl=60)
+
+    await store.query("question")
+    now[0] += 59
+    await store.query("question")
+    now[0] += 2
+    await store.query("question")
+
+    assert len(backend.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_vector_store_evicts_least_recently_used():
+    backend = CountingVectorStore()
+    store = CachedVectorStore(backend, max_size=2, ttl=60)
+
+    await store.query("a")
+    await store.query("b")
+    await store.query("a")  # "b" is now least recently used
+    await store.query("c")
+    await store.query("a")
+    await store.query("b")
+
+    assert [query for query, _ in backend.calls] == ["a", "b", "c", "b"]
+    assert store.stats["size"] == 2
+
+
+async def bag_of_words_embeddings(texts, dimensions=64):
+    """Deterministic embeddings that make texts sharing words similar."""
+    embeddings = []
+    for text in texts:
+        vector = [0.0] * dimensions
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode()) % dimensions] += 1.0
+        embeddings.append(vector)
+    return embeddings
+
+
+LOCAL_DOCUMENTS = [
+    ("Cats are small furry pets", "cats.txt"),
+    ("Dogs are loyal pets", "dogs.txt"),
+    ("Python is a programming language", "python.txt"),
+    ("Rust is a systems programming language", "rust.txt"),
+]
+
+
+async def make_local_store(**kwargs):
+    store = LocalVectorStore(bag_of_words_embeddings, **kwargs)
+    texts, sources = zip(*LOCAL_DOCUMENTS)
+    await store.add(list(texts), list(sources))
+    return store
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+async def test_local_vector_store_query(index_type):
+    store = await make_local_store(index_type=index_type)
+
+    results = await store.query("python programming language", top_k=2)
+
+    assert [r.metadata.source for r in results] == ["python.txt", "rust.txt"]
+    assert results[0].metadata.score >= results[1].metadata.score
+
+
+@pytest.mark.asyncio
+async def test_local_vector_store_query_batch():
+    store = await make_local_store()
+
+    results = await store.query_batch(["loyal dogs", "furry cats"], top_k=1)
+
+    assert [r[0].metadata.source for r in results] == ["dogs.txt", "cats.txt"]
+
+
+@pytest.mark.asyncio
+async def test_local_vector_store_top_k_larger_than_corpus():
+    store = await make_local_store()
+
+    results = await store.query("pets", top_k=10)
+
+    assert len(results) == len(LOCAL_DOCUMENTS)
+
+
+@pytest.mark.asyncio
+async def test_local_vector_store_empty():
+    store = LocalVectorStore(bag_of_words_embeddings)
+
+    assert await store.query("anything") == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+async def test_local_vector_store_save_and_load(tmp_path, index_type):
+    store = await make_local_store(index_type=index_type)
+    store.save(str(tmp_path))
+
+    loaded = LocalVectorStore(
+        bag_of_words_embeddings, path=str(tmp_path), index_type=index_type
+    )
+    results = await loaded.query("loyal dogs", top_k=1)
+
+    assert results[0].metadata.source == "dogs.txt"
+    await loaded.add(["Parrots can talk"], ["parrots.txt"])
+    results = await loaded.query("talk parrots", top_k=1)
+    assert results[0].content == "Parrots can talk"
+
+
+@pytest.mark.asyncio
+async def test_local_vector_store_save_after_reingesting(tmp_path):
+    documents = [
+        DocumentChunk(id=source, content=content, source=source)
+        for content, source in LOCAL_DOCUMENTS
+    ]
+    store = LocalVectorStore(bag_of_words_embeddings, path=str(tmp_path))
+    await store.add_documents(documents)
+    store.save()
+
+    # The loaded vectors are memory-mapped from the file that is saved again
+    loaded = LocalVectorStore(bag_of_words_embeddings, path=str(tmp_path))
+    await loaded.add_documents(documents)
+    loaded.save()
+
+    reloaded = LocalVectorStore(bag_of_words_embeddings, path=str(tmp_path))
+    assert len(reloaded.documents) == len(LOCAL_DOCUMENTS)
+    results = await reloaded.query("loyal dogs", top_k=1)
+    assert results[0].metadata.source == "dogs.txt"
+    assert sorted(os.listdir(tmp_path)) == ["documents.json", "vectors.npy"]
+
+
+class MockInsertCollection:
+    def __init__(self, error=None):
+        self.error = error
+        self.inserted = []
+
+    async def insert_many(self, documents, ordered=True):
+        self.inserted.extend(documents)
+        if self.error is not None:
+            raise self.error
+
+
+def make_insert_error(error_code):
+    from astrapy.exceptions import InsertManyException
+    from astrapy.results import InsertManyResult
+
+    error = InsertManyException(
+        text="Insert failed",
+        partial_result=InsertManyResult(raw_results=[], inserted_ids=[]),
+        error_descriptors=[],
+        detailed_error_descriptors=[],
+    )
+    error.error_descriptors = [
+        type("Descriptor", (), {"error_code": error_code})(),
+    ]
+    return error
+
+
+@pytest.mark.asyncio
+async def test_astra_db_store_add_documents_vectorizes_content(astra_env):
+    store = AstraDBStore(collection_name="test_collection")
+    store.collection = MockInsertCollection()
+
+    await store.add_documents(
+        [DocumentChunk(id="abc", content="Cats are pets", source="cats.txt")]
+    )
+
+    assert store.collection.inserted == [
+        {
+            "_id": "abc",
+            "content": "Cats are pets",
+            "$vectorize": "Cats are pets",
+            "metadata": {"source": "cats.txt"},
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_astra_db_store_add_documents_ignores_existing_documents(astra_env):
+    store = AstraDBStore(collection_name="test_collection")
+    chunk = DocumentChunk(id="abc", content="Cats are pets", source="cats.txt")
+
+    store.collection = MockInsertCollection(
+        make_insert_error("DOCUMENT_ALREADY_EXISTS")
+    )
+    await store.add_documents([chunk])
+
+    store.collection = MockInsertCollection(make_insert_error("SERVER_ERROR"))
+    with pytest.raises(Exception, match="Insert failed"):
+        await store.add_documents([chunk])
+
+
+@pytest.mark.asyncio
+async def test_local_vector_store_add_documents_skips_known_ids(tmp_path):
+    store = LocalVectorStore(bag_of_words_embeddings, path=str(tmp_path))
+    chunks = [
+        DocumentChunk(id="cats", content="Cats are pets", source="cats.txt"),
+        DocumentChunk(id="dogs", content="Dogs are pets", source="dogs.txt"),
+    ]
+    await store.add_documents(chunks)
+    store.save()
+
+    reloaded = LocalVectorStore(bag_of_words_embeddings, path=str(tmp_path))
+    await reloaded.add_documents(chunks)
+
+    assert len(reloaded.documents) == 2
+
+
+class MockChromaCollection:
+    def __init__(self):
+        self.upserts = []
+        self.queries = []
+
+    def upsert(self, **kwargs):
+        self.upserts.append(kwargs)
+
+    def query(self, query_embeddings, n_results):
+        self.queries.append(query_embeddings)
+        return {
+            "documents": [["Cats are pets"]] * len(query_embeddings),
+            "metadatas": [[{"source": "cats.txt"}]] * len(query_embeddings),
+            "distances": [[0.5]] * len(query_embeddings),
+        }
+
+
+class BagOfWordsEmbeddingProvider(EmbeddingProvider):
+    async def embed(self, texts):
+        return np.asarray(await bag_of_words_embeddings(texts), dtype=np.float32)
+
+
+@pytest.mark.asyncio
+async def test_chroma_db_store_embeds_with_provider(monkeypatch):
+    pytest.importorskip("chromadb")
+    collection = MockChromaCollection()
+    client = type(
+        "MockChromaClient",
+        (),
+        {"get_or_create_collection": lambda self, name, embedding_function: collection},
+    )()
+    monkeypatch.setattr("chromadb.PersistentClient", lambda path, settings: client)
+    monkeypatch.setattr("chromadb.config.Settings", lambda allow_reset: None)
+    store = ChromaDBStore(
+        path="unused", embedding_provider=BagOfWordsEmbeddingProvider()
+    )
+
+    await store.add_documents(
+        [DocumentChunk(id="cats", content="Cats are pets", source="cats.txt")]
+    )
+    results = await store.query("Are cats pets?", top_k=1)
+
+    assert collection.upserts[0]["ids"] == ["cats"]
+    assert collection.upserts[0]["embeddings"] == await bag_of_words_embeddings(
+        ["Cats are pets"]
+    )
+    assert collection.queries == [await bag_of_words_embeddings(["Are cats pets?"])]
+    assert results[0].metadata.score == 0.75
+
+
+@pytest.mark.asyncio
+async def test_chroma_db_store_query_batch(monkeypatch):
+    pytest.importorskip("chromadb")
+    collection = MockChromaCollection()
+    client = type(
+        "MockChromaClient",
+        (),
+        {"get_or_create_collection": lambda self, name, embedding_function: collection},
+    )()
+    monkeypatch.setattr("chromadb.PersistentClient", lambda path, settings: client)
+    monkeypatch.setattr("chromadb.config.Settings", lambda allow_reset: None)
+    store = ChromaDBStore(
+        path="unused", embedding_provider=BagOfWordsEmbeddingProvider()
+    )
+
+    results = await store.query_batch(["Are cats pets?", "Do cats purr?"], top_k=1)
+
+    # Both queries are embedded and sent in a single query
+    assert collection.queries == [
+        await bag_of_words_embeddings(["Are cats pets?", "Do cats purr?"])
+    ]
+    assert [[r.content for r in query_results] for query_results in results] == [
+        ["Cats are pets"],
+        ["Cats are pets"],
+    ]
+
+
+def test_create_vector_store(astra_env):
+    assert isinstance(create_vector_store("mock"), MockVectorStore)
+    assert isinstance(create_vector_store("astra", "docs"), AstraDBStore)
+    with pytest.raises(ValueError):
+        create_vector_store("pinecone")
+
+
+def test_client_libraries_are_imported_by_their_backend_only():
+    code = (
+        "import sys, app.vector_store; "
+        "print(sorted({'astrapy', 'chromadb', 'faiss'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == "[]"